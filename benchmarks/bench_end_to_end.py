@@ -0,0 +1,123 @@
+"""
+Measures the end-to-end throughput of main.py against the local stand-in server.
+
+For every combination of course size and injected latency, a StandInServer is started,
+main.py runs non-interactively in a fresh folder (login, dashboard, every course, every
+lesson, videos and attachments), and the script reports the lessons per second, the
+megabytes per second written to disk and the peak memory of the run. Options after
+'--' are passed to main.py, to compare settings such as worker counts or backends.
+
+A run also fails when the attachments on disk are not exactly the ones the server holds
+(for example with --gzip-attachments, where the server compresses every attachment), and,
+with --expect-max-height, when a segment of a video rendition taller than that was fetched (to check
+that '-- --max-height N' reaches both the native HLS engine and yt-dlp).
+
+Peak memory is read from the resource usage of the main.py process and its worker
+processes, which is only available on Unix.
+
+Usage:
+    python benchmarks/bench_end_to_end.py [--lessons N ...] [--latency S ...] [school options] [-- main.py options]
+"""
+import argparse
+import hashlib
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = pathlib.Path(__file__).resolve().parent
+MAIN_SCRIPT = BENCHMARKS_DIR.parent / "main.py"
+sys.path.insert(0, str(BENCHMARKS_DIR))
+
+import stand_in_server  # noqa: E402
+
+
+def folder_size(path: pathlib.Path) -> int:
+    """Returns the size of the downloaded files, ignoring the hidden cache, session and profile folders."""
+    return sum(
+        file.stat().st_size for file in path.rglob('*')
+        if file.is_file() and not any(part.startswith('.') for part in file.relative_to(path).parts)
+        and file.suffix not in ('.sqlite3', '.json', '.prom')
+    )
+
+
+def attachment_mismatches(path: pathlib.Path, server: stand_in_server.StandInServer) -> int:
+    """Returns how many attachments are missing from 'path' or differ from the ones the server holds."""
+    expected = server.attachment_digests()
+    saved = [
+        hashlib.sha256(file.read_bytes()).hexdigest() for file in path.rglob('*.pdf')
+        if not any(part.startswith('.') for part in file.relative_to(path).parts)
+    ]
+    return sum(digest not in expected for digest in saved) + len(expected - set(saved))
+
+
+def run_main(server: stand_in_server.StandInServer, work_dir: pathlib.Path, main_args: list):
+    """Runs main.py against the server in 'work_dir'. Returns the exit status, the seconds and the peak RSS in MiB."""
+    command = [
+        sys.executable, str(MAIN_SCRIPT),
+        '--platform-url', server.login_url, '--email', 'aluno@example.com', '--course', '0',
+        *main_args,
+    ]
+    environment = dict(os.environ, ASTRO_DL_PASSWORD='senha-de-teste', PYTHONIOENCODING='utf-8')
+    start = time.perf_counter()
+    with open(work_dir / 'main.log', 'w', encoding='utf-8') as log:
+        process = subprocess.Popen(command, cwd=work_dir, env=environment, stdout=log, stderr=subprocess.STDOUT,
+                                   stdin=subprocess.DEVNULL)
+        if hasattr(os, 'wait4'):
+            _, status, usage = os.wait4(process.pid, 0)
+            returncode = os.waitstatus_to_exitcode(status)
+            # ru_maxrss is in KiB on Linux and in bytes on macOS
+            peak_rss = usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+        else:
+            returncode = process.wait()
+            peak_rss = None
+    return returncode, time.perf_counter() - start, peak_rss
+
+
+def main_benchmark(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lessons', type=int, nargs='+', default=[3, 12],
+                        help="Aulas por módulo; um cenário para cada valor.")
+    parser.add_argument('--latency', type=float, nargs='+', default=[0.0, 0.05],
+                        help="Segundos adicionados a cada requisição; um cenário para cada valor.")
+    parser.add_argument('--keep', action='store_true', help="Mantém as pastas baixadas para inspeção.")
+    parser.add_argument('--expect-max-height', type=int, default=0,
+                        help="Falha se algum segmento de uma rendição mais alta que isso for baixado (0 para não conferir).")
+    stand_in_server.add_school_arguments(parser)
+    argv = sys.argv[1:] if argv is None else argv
+    main_args = argv[argv.index('--') + 1:] if '--' in argv else []
+    args = parser.parse_args(argv[:argv.index('--')] if '--' in argv else argv)
+
+    header = f"{'aulas':>6} {'latência':>9} {'segundos':>9} {'aulas/s':>8} {'MB/s':>7} {'pico MiB':>9} {'requisições':>12}  status"
+    print(header)
+    print("-" * len(header))
+    failures = 0
+    for lessons in args.lessons:
+        for latency in args.latency:
+            settings = stand_in_server.school_settings(args)
+            with stand_in_server.StandInServer(lessons=lessons, latency=latency, **settings) as server, \
+                    tempfile.TemporaryDirectory(prefix='astro-dl-bench-') as temporary_dir:
+                work_dir = pathlib.Path(temporary_dir)
+                returncode, seconds, peak_rss = run_main(server, work_dir, main_args)
+                megabytes = folder_size(work_dir / 'download') / (1024 * 1024)
+                requests_served = sum(server.hits.values())
+                mismatches = attachment_mismatches(work_dir / 'download', server) if returncode == 0 else 0
+                if args.expect_max_height:
+                    mismatches += sum(count for height, count in server.renditions.items() if height > args.expect_max_height)
+                status = f"erro {returncode}" if returncode else f"{mismatches} arquivos errados" if mismatches else 'ok'
+                failures += bool(returncode or mismatches)
+                peak = f"{peak_rss:>9.1f}" if peak_rss is not None else f"{'n/d':>9}"
+                print(f"{server.lesson_count:>6} {latency:>8.3f}s {seconds:>9.2f} {server.lesson_count / seconds:>8.2f} "
+                      f"{megabytes / seconds:>7.2f} {peak} {requests_served:>12}  {status}")
+                if args.keep or returncode or mismatches:
+                    kept = pathlib.Path(tempfile.mkdtemp(prefix='astro-dl-bench-kept-'))
+                    os.replace(work_dir, kept / 'run')
+                    os.makedirs(work_dir)
+                    print(f"       pasta mantida em {kept / 'run'} (saída em main.log)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_benchmark())
@@ -0,0 +1,120 @@
+"""
+Benchmarks the HTML extraction backends of main.py over saved platform pages.
+
+Every backend parses every fixture page through the same helper that main.py uses,
+and the script reports the parse time and peak memory of each one. The extracted
+dictionaries are compared with the ones of the 'html.parser' backend, and the script
+exits with status 1 if any backend returns something different.
+
+Fixture pages are picked by file name prefix: dashboard*.html, course*.html,
+lesson*.html and hotmart*.html. Real pages saved from the browser can be dropped into
+a folder and passed with --fixtures.
+
+Usage:
+    python benchmarks/bench_html_parsers.py [--fixtures DIR] [--repeat N] [--synthetic-lessons N]
+"""
+import argparse
+import pathlib
+import statistics
+import sys
+import time
+import tracemalloc
+
+BENCHMARKS_DIR = pathlib.Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARKS_DIR.parent))
+sys.path.insert(0, str(BENCHMARKS_DIR))
+
+import main  # noqa: E402
+import synthetic_pages  # noqa: E402
+
+BASE_URL = "https://escola.astronmembers.com"
+
+PAGE_PARSERS = {
+    'dashboard': lambda html: main._parse_courses_from_html(html, BASE_URL),
+    'course': lambda html: main._parse_course_structure_from_html(html, BASE_URL),
+    'lesson': lambda html: main._parse_lesson_content_from_html(html, f"{BASE_URL}/aula/1"),
+    'hotmart': lambda html: main._parse_hotmart_media_assets_from_html(html),
+}
+
+
+def available_backends():
+    """Returns the backends that can run here, skipping the lxml ones when lxml is missing."""
+    try:
+        import lxml  # noqa: F401
+        return list(main.HTML_BACKENDS)
+    except ImportError:
+        print("lxml não está instalado, os backends lxml serão ignorados.\n")
+        return [backend for backend in main.HTML_BACKENDS if not backend.startswith('lxml')]
+
+
+def load_pages(fixtures_dir: pathlib.Path, synthetic_lessons: int):
+    """Returns a list of (name, page kind, html) tuples to benchmark."""
+    pages = []
+    for path in sorted(fixtures_dir.glob('*.html')):
+        kind = next((kind for kind in PAGE_PARSERS if path.name.startswith(kind)), None)
+        if kind:
+            pages.append((path.name, kind, path.read_text(encoding='utf-8')))
+    if synthetic_lessons:
+        modules = synthetic_pages.synthetic_course_modules(max(1, synthetic_lessons // 25), 25)
+        pages.append((f"synthetic course ({synthetic_lessons} aulas)", 'course',
+                      synthetic_pages.course_page("Curso Sintético", modules)))
+    return pages
+
+
+def measure(parse, html: str, repeat: int):
+    """Returns the parse result, the median and minimum time in ms and the peak memory in KiB."""
+    tracemalloc.start()
+    result = parse(html)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse(html)
+        timings.append((time.perf_counter() - start) * 1000)
+    return result, statistics.median(timings), min(timings), peak / 1024
+
+
+def main_benchmark(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--fixtures', type=pathlib.Path, default=BENCHMARKS_DIR / 'fixtures',
+                        help="Folder with the saved pages.")
+    parser.add_argument('--repeat', type=int, default=20, help="Timed runs per page and backend.")
+    parser.add_argument('--synthetic-lessons', type=int, default=600,
+                        help="Also benchmark a synthetic course page with this many lessons (0 to skip).")
+    args = parser.parse_args(argv)
+
+    backends = available_backends()
+    pages = load_pages(args.fixtures, args.synthetic_lessons)
+    mismatches = 0
+
+    header = f"{'página':<36} {'backend':<14} {'mediana ms':>11} {'mín ms':>9} {'pico KiB':>10}  resultado"
+    print(header)
+    print("-" * len(header))
+    for name, kind, html in pages:
+        baseline = None
+        for backend in backends:
+            main.configure_html_backend(backend)
+            result, median_ms, min_ms, peak_kib = measure(PAGE_PARSERS[kind], html, args.repeat)
+            if baseline is None:
+                baseline = result
+                verdict = "referência"
+            elif result == baseline:
+                verdict = "idêntico"
+            else:
+                verdict = "DIFERENTE"
+                mismatches += 1
+            print(f"{name[:36]:<36} {backend:<14} {median_ms:>11.2f} {min_ms:>9.2f} {peak_kib:>10.0f}  {verdict}")
+        print()
+
+    main.configure_html_backend(main.DEFAULT_HTML_BACKEND)
+    if mismatches:
+        print(f"❌ {mismatches} resultados diferentes do html.parser.")
+        return 1
+    print("✅ Todos os backends extraíram os mesmos dados.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_benchmark())
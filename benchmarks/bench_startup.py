@@ -0,0 +1,110 @@
+"""
+Measures the startup time of main.py and checks that the quick commands stay light.
+
+Every sample runs in a fresh interpreter: an empty one as the baseline, 'import main'
+alone, and the 'status' and '--help' commands started both as a script and with
+'python -m main' (a script is compiled on every run, a module is loaded from its cached
+bytecode). The script also lists the heavy modules that 'import main' and 'status' load
+(modules imported lazily only count once they run), and exits with status 1 if any of
+bs4, m3u8, yt_dlp or requests is among them, or if the import takes longer than
+--max-import-ms.
+
+Usage:
+    python benchmarks/bench_startup.py [--repeat N] [--max-import-ms MS]
+"""
+import argparse
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = pathlib.Path(__file__).resolve().parent
+REPO_DIR = BENCHMARKS_DIR.parent
+MAIN_SCRIPT = REPO_DIR / "main.py"
+
+# Modules that only the scraping and downloading stages may load
+HEAVY_MODULES = ('bs4', 'm3u8', 'yt_dlp', 'requests')
+
+LOADED_MODULES_SNIPPET = (
+    "import sys, runpy; sys.argv = {argv!r}\n"
+    "try:\n"
+    "    runpy.run_module('main', run_name={run_name!r})\n"
+    "except SystemExit:\n"
+    "    pass\n"
+    "loaded = {{name.split('.')[0] for name, module in list(sys.modules.items()) if type(module).__name__ != '_LazyModule'}}\n"
+    "print(','.join(sorted(loaded)), file=sys.stderr)\n"
+)
+
+
+def timed_run(command: list, work_dir: pathlib.Path) -> float:
+    """Runs a command in a fresh interpreter and returns its wall time in milliseconds."""
+    environment = dict(os.environ, PYTHONPATH=str(REPO_DIR), PYTHONIOENCODING='utf-8')
+    start = time.perf_counter()
+    subprocess.run(command, cwd=work_dir, env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                   stdin=subprocess.DEVNULL)
+    return (time.perf_counter() - start) * 1000
+
+
+def loaded_heavy_modules(argv: list, run_name: str, work_dir: pathlib.Path) -> list:
+    """Returns the HEAVY_MODULES loaded after running main with 'argv' under 'run_name'."""
+    environment = dict(os.environ, PYTHONPATH=str(REPO_DIR), PYTHONIOENCODING='utf-8')
+    result = subprocess.run(
+        [sys.executable, '-c', LOADED_MODULES_SNIPPET.format(argv=argv, run_name=run_name)],
+        cwd=work_dir, env=environment, capture_output=True, text=True, stdin=subprocess.DEVNULL,
+    )
+    loaded = set(result.stderr.strip().splitlines()[-1].split(',')) if result.stderr.strip() else set()
+    return [module for module in HEAVY_MODULES if module in loaded]
+
+
+def main_benchmark(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=10, help="Runs per scenario.")
+    parser.add_argument('--max-import-ms', type=float, default=0,
+                        help="Fails if the median of 'import main' minus the empty interpreter exceeds this (0 to skip).")
+    args = parser.parse_args(argv)
+
+    scenarios = [
+        ('python (vazio)', [sys.executable, '-c', 'pass']),
+        ('import main', [sys.executable, '-c', 'import main']),
+        ('main.py status', [sys.executable, str(MAIN_SCRIPT), 'status']),
+        ('python -m main status', [sys.executable, '-m', 'main', 'status']),
+        ('main.py --help', [sys.executable, str(MAIN_SCRIPT), '--help']),
+        ('python -m main --help', [sys.executable, '-m', 'main', '--help']),
+    ]
+    failures = 0
+    with tempfile.TemporaryDirectory(prefix='astro-dl-startup-') as work_dir:
+        work_dir = pathlib.Path(work_dir)
+        # Writes the cached bytecode of main, as any previous run would have
+        timed_run([sys.executable, '-c', 'import main'], work_dir)
+
+        header = f"{'comando':<24} {'mediana ms':>11} {'mín ms':>9} {'além do vazio ms':>17}"
+        print(header)
+        print("-" * len(header))
+        medians = {}
+        for name, command in scenarios:
+            timings = [timed_run(command, work_dir) for _ in range(args.repeat)]
+            medians[name] = statistics.median(timings)
+            extra = medians[name] - medians['python (vazio)']
+            print(f"{name:<24} {medians[name]:>11.1f} {min(timings):>9.1f} {extra:>17.1f}")
+        print()
+
+        for name, main_argv, run_name in (('import main', ['main'], 'main'), ('status', ['main', 'status'], '__main__')):
+            heavy = loaded_heavy_modules(main_argv, run_name, work_dir)
+            if heavy:
+                print(f"❌ {name} carregou {', '.join(heavy)}.")
+                failures += 1
+            else:
+                print(f"✅ {name} não carregou {', '.join(HEAVY_MODULES)}.")
+
+    import_cost = medians['import main'] - medians['python (vazio)']
+    if args.max_import_ms and import_cost > args.max_import_ms:
+        print(f"❌ import main levou {import_cost:.1f} ms, acima do limite de {args.max_import_ms:.1f} ms.")
+        failures += 1
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_benchmark())
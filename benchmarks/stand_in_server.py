@@ -0,0 +1,380 @@
+"""
+Local stand-in for an Astronmembers school, to run main.py end to end without the platform.
+
+The server answers the same routes main.py uses, with pages built by synthetic_pages:
+the '/entrar' login (which sets the session cookie), the dashboard, course pages, lesson
+pages with their player iframe and attachments, a Panda-style HLS tree (master playlist,
+one media playlist per quality and MPEG-TS segments, optionally AES-128 encrypted) and a
+Hotmart-style embed page with '__NEXT_DATA__'. Every lesson whose number is a multiple of
+'hotmart_every' uses the Hotmart player; the others use Panda.
+
+Pages answer with an ETag and honour 'If-None-Match', attachments honour 'Range' (and can
+be sent gzip-encoded whatever the client asks, as some misconfigured servers do), and a
+fixed latency can be added to every request.
+
+Usage:
+    python benchmarks/stand_in_server.py [--port 8765] [--courses N] [--lessons N] [--latency S] ...
+"""
+import argparse
+import gzip
+import hashlib
+import http.server
+import json
+import pathlib
+import random
+import sys
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+BENCHMARKS_DIR = pathlib.Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARKS_DIR))
+
+import synthetic_pages  # noqa: E402
+
+SESSION_COOKIE = 'astro_sessao'
+TS_PACKET_SIZE = 188
+AES_KEY = b'0123456789abcdef'
+
+
+def _ts_segment(size: int, seed: int) -> bytes:
+    """Builds a segment of MPEG-TS packets (sync byte 0x47 every 188 bytes) with random payload."""
+    rng = random.Random(seed)
+    packets = max(1, size // TS_PACKET_SIZE)
+    return b''.join(b'\x47' + rng.randbytes(TS_PACKET_SIZE - 1) for _ in range(packets))
+
+
+class StandInServer:
+    """
+    A threaded HTTP server that serves a synthetic school.
+
+    Args:
+        courses: How many courses are listed on the dashboard.
+        modules: How many modules each course has.
+        lessons: How many lessons each module has.
+        attachments: How many attachments each lesson has.
+        attachment_size: The size of each attachment, in bytes.
+        segments: How many segments each video has.
+        segment_size: The size of each segment, in bytes.
+        latency: Seconds added to every request.
+        hotmart_every: Every lesson whose number is a multiple of this uses the Hotmart player (0 for none).
+        encrypt: Whether Panda streams are AES-128 encrypted.
+        gzip_attachments: Whether attachments are sent with 'Content-Encoding: gzip', ignoring 'Accept-Encoding'.
+        port: The port to listen on (0 picks a free one).
+    """
+
+    def __init__(self, courses: int = 2, modules: int = 2, lessons: int = 3, attachments: int = 2,
+                 attachment_size: int = 256 * 1024, segments: int = 4, segment_size: int = 512 * 1024,
+                 latency: float = 0.0, hotmart_every: int = 3, encrypt: bool = False,
+                 gzip_attachments: bool = False, port: int = 0):
+        self.courses = courses
+        self.modules = modules
+        self.lessons = lessons
+        self.attachments = attachments
+        self.attachment_size = attachment_size
+        self.segments = segments
+        self.latency = latency
+        self.hotmart_every = hotmart_every
+        self.encrypt = encrypt
+        self.gzip_attachments = gzip_attachments
+        self.hits: Dict[str, int] = {}
+        # Segments served per rendition height, to check which quality the client downloaded
+        self.renditions: Dict[int, int] = {}
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._segment = _ts_segment(segment_size, seed=1)
+        # Every video shares the same segments, so they are encrypted once, up front
+        self._encrypted_segments = [self._encrypt(index) for index in range(segments)] if encrypt else []
+        self._session_token = hashlib.sha1(str(time.time()).encode()).hexdigest()
+        self._httpd = _QuietServer(('127.0.0.1', port), _make_handler(self))
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """The base URL of the server."""
+        return f"http://127.0.0.1:{self._httpd.server_address[1]}"
+
+    @property
+    def login_url(self) -> str:
+        """The URL to give main.py as the platform URL."""
+        return f"{self.url}/entrar"
+
+    @property
+    def lesson_count(self) -> int:
+        return self.courses * self.modules * self.lessons
+
+    def start(self) -> 'StandInServer':
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='stand-in-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> 'StandInServer':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def count(self, kind: str, byte_count: int) -> None:
+        with self._lock:
+            self.hits[kind] = self.hits.get(kind, 0) + 1
+            self.bytes_sent += byte_count
+
+    def count_rendition(self, height: int) -> None:
+        with self._lock:
+            self.renditions[height] = self.renditions.get(height, 0) + 1
+
+    # Content of the school
+
+    def course_slug(self, course: int) -> str:
+        return f"curso-{course + 1}"
+
+    def lesson_id(self, course: int, module: int, lesson: int) -> str:
+        return f"{course + 1}{module + 1:02d}{lesson + 1:03d}"
+
+    def is_hotmart(self, lesson_id: str) -> bool:
+        return bool(self.hotmart_every) and int(lesson_id[-3:]) % self.hotmart_every == 0
+
+    def dashboard(self) -> str:
+        return synthetic_pages.dashboard_page([self.course_slug(c) for c in range(self.courses)])
+
+    def course(self, slug: str) -> Optional[str]:
+        course_slugs = [self.course_slug(c) for c in range(self.courses)]
+        if slug not in course_slugs:
+            return None
+        course = course_slugs.index(slug)
+        modules = [
+            {
+                'title': f"Módulo {module + 1}",
+                'lessons': [
+                    {'id': self.lesson_id(course, module, lesson), 'title': f"Aula {lesson + 1}", 'completed': False}
+                    for lesson in range(self.lessons)
+                ],
+            }
+            for module in range(self.modules)
+        ]
+        return synthetic_pages.course_page(f"Curso {course + 1}", modules)
+
+    def lesson(self, lesson_id: str) -> str:
+        if self.is_hotmart(lesson_id):
+            player_url = f"{self.url}/play.hotmart.com/embed/{lesson_id}"
+        else:
+            player_url = f"{self.url}/pandavideo/embed/?v={lesson_id}"
+        attachments = [
+            {'name': f"Material {index + 1}", 'href': f"/anexos/{lesson_id}/material-{index + 1}.pdf"}
+            for index in range(self.attachments)
+        ]
+        return synthetic_pages.lesson_page(player_url, f"Descrição da aula {lesson_id}.\nBons estudos!", attachments)
+
+    def hotmart_embed(self, lesson_id: str) -> str:
+        return synthetic_pages.hotmart_embed_page([f"{self.url}/hotmart/{lesson_id}/playlist.m3u8"])
+
+    def master_playlist(self, video_path: str) -> str:
+        return (
+            "#EXTM3U\n"
+            '#EXT-X-STREAM-INF:BANDWIDTH=2500000,RESOLUTION=1280x720,CODECS="avc1.64001f,mp4a.40.2"\n'
+            f"{video_path}/720/index.m3u8\n"
+            '#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360,CODECS="avc1.64001e,mp4a.40.2"\n'
+            f"{video_path}/360/index.m3u8\n"
+        )
+
+    def media_playlist(self, encrypted: bool) -> str:
+        key = f'#EXT-X-KEY:METHOD=AES-128,URI="{self.url}/chave.bin"\n' if encrypted else ''
+        segments = ''.join(f"#EXTINF:6.0,\nseg{index}.ts\n" for index in range(self.segments))
+        return f"#EXTM3U\n#EXT-X-VERSION:3\n#EXT-X-TARGETDURATION:6\n#EXT-X-MEDIA-SEQUENCE:0\n{key}{segments}#EXT-X-ENDLIST\n"
+
+    def _encrypt(self, index: int) -> bytes:
+        from yt_dlp.aes import aes_cbc_encrypt_bytes
+        padding = 16 - len(self._segment) % 16
+        return aes_cbc_encrypt_bytes(self._segment + bytes([padding]) * padding, AES_KEY, index.to_bytes(16, 'big'))
+
+    def segment(self, index: int, encrypted: bool) -> bytes:
+        return self._encrypted_segments[index] if encrypted else self._segment
+
+    def attachment(self, path: str) -> bytes:
+        seed = int(hashlib.md5(path.encode()).hexdigest()[:8], 16)
+        return random.Random(seed).randbytes(self.attachment_size)
+
+    def attachment_digests(self) -> set:
+        """The SHA-256 of every attachment of the school, to check the downloaded files against."""
+        return {
+            hashlib.sha256(self.attachment(f"/anexos/{self.lesson_id(course, module, lesson)}/material-{index + 1}.pdf")).hexdigest()
+            for course in range(self.courses) for module in range(self.modules) for lesson in range(self.lessons)
+            for index in range(self.attachments)
+        }
+
+
+class _QuietServer(http.server.ThreadingHTTPServer):
+    """Threaded server that does not print the connections the client closed early."""
+
+    def handle_error(self, request, client_address) -> None:
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+def _make_handler(school: StandInServer):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args) -> None:
+            pass
+
+        def _send(self, body, content_type: str = 'text/html; charset=utf-8', status: int = 200,
+                  headers: Optional[Dict[str, str]] = None, kind: str = 'página') -> None:
+            if isinstance(body, str):
+                body = body.encode('utf-8')
+            headers = dict(headers or {})
+            if content_type.startswith('text/html') and status == 200:
+                etag = f'"{hashlib.md5(body).hexdigest()}"'
+                headers['ETag'] = etag
+                if self.headers.get('If-None-Match') == etag:
+                    status, body = 304, b''
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            if self.command != 'HEAD':
+                self.wfile.write(body)
+            school.count(kind, len(body))
+
+        def _redirect(self, location: str) -> None:
+            self.send_response(302)
+            self.send_header('Location', location)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def _logged_in(self) -> bool:
+            return f"{SESSION_COOKIE}={school._session_token}" in (self.headers.get('Cookie') or '')
+
+        def do_POST(self) -> None:
+            time.sleep(school.latency)
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if urlparse(self.path).path == '/entrar':
+                return self._send('<html><body>ok</body></html>', kind='login',
+                                  headers={'Set-Cookie': f"{SESSION_COOKIE}={school._session_token}; Path=/; HttpOnly"})
+            self._send('não encontrado', status=404, kind='404')
+
+        def do_HEAD(self) -> None:
+            self.do_GET()
+
+        def do_GET(self) -> None:
+            time.sleep(school.latency)
+            url = urlparse(self.path)
+            path = url.path
+            parts = [part for part in path.split('/') if part]
+
+            if path in ('/', '/entrar'):
+                return self._send('<html><body><form method="post">login</form></body></html>', kind='login')
+
+            if path in ('/dashboard',) or parts[:1] in (['curso'], ['aula']):
+                if not self._logged_in():
+                    return self._redirect('/entrar')
+                if path == '/dashboard':
+                    return self._send(school.dashboard())
+                if parts[0] == 'curso' and len(parts) == 2:
+                    page = school.course(parts[1])
+                    return self._send(page) if page else self._send('não encontrado', status=404, kind='404')
+                if parts[0] == 'aula' and len(parts) == 2:
+                    return self._send(school.lesson(parts[1]))
+
+            if path.startswith('/pandavideo/embed'):
+                return self._send('<html><body>player</body></html>', kind='player')
+            if parts[:2] == ['play.hotmart.com', 'embed'] and len(parts) == 3:
+                return self._send(school.hotmart_embed(parts[2]), kind='player')
+
+            if path.endswith('/playlist.m3u8'):
+                return self._send(school.master_playlist(path.rsplit('/', 1)[0]), 'application/vnd.apple.mpegurl', kind='playlist')
+            if path.endswith('/index.m3u8'):
+                encrypted = school.encrypt and parts[0] != 'hotmart'
+                return self._send(school.media_playlist(encrypted), 'application/vnd.apple.mpegurl', kind='playlist')
+            if path == '/chave.bin':
+                return self._send(AES_KEY, 'application/octet-stream', kind='chave')
+            if path.endswith('.ts'):
+                if parts[-2].isdigit():
+                    school.count_rendition(int(parts[-2]))
+                encrypted = school.encrypt and parts[0] != 'hotmart'
+                index = int(parts[-1][3:-3])
+                return self._send(school.segment(index, encrypted), 'video/mp2t', kind='segmento')
+
+            if parts[:1] == ['anexos']:
+                body = school.attachment(path)
+                # Ranges of an encoded attachment count bytes of the encoded body
+                encoding = {'Content-Encoding': 'gzip'} if school.gzip_attachments else {}
+                if encoding:
+                    body = gzip.compress(body, mtime=0)
+                byte_range = self.headers.get('Range')
+                if byte_range:
+                    start = int(byte_range.split('=', 1)[1].split('-', 1)[0])
+                    if start >= len(body):
+                        return self._send(b'', 'application/octet-stream', 416,
+                                          {'Content-Range': f"bytes */{len(body)}"}, kind='anexo')
+                    return self._send(body[start:], 'application/octet-stream', 206,
+                                      {'Content-Range': f"bytes {start}-{len(body) - 1}/{len(body)}", **encoding},
+                                      kind='anexo')
+                return self._send(body, 'application/octet-stream', headers=encoding, kind='anexo')
+
+            if path == '/_stats':
+                return self._send(json.dumps({'hits': school.hits, 'bytes_sent': school.bytes_sent}),
+                                  'application/json', kind='stats')
+            self._send('não encontrado', status=404, kind='404')
+
+    return Handler
+
+
+def add_school_arguments(parser: argparse.ArgumentParser) -> None:
+    """Adds the options that shape the synthetic school to a command line parser."""
+    parser.add_argument('--courses', type=int, default=2, help="Cursos no dashboard.")
+    parser.add_argument('--modules', type=int, default=2, help="Módulos por curso.")
+    parser.add_argument('--attachments', type=int, default=2, help="Anexos por aula.")
+    parser.add_argument('--attachment-kb', type=int, default=256, help="Tamanho de cada anexo, em KiB.")
+    parser.add_argument('--segments', type=int, default=4, help="Segmentos por vídeo.")
+    parser.add_argument('--segment-kb', type=int, default=512, help="Tamanho de cada segmento, em KiB.")
+    parser.add_argument('--hotmart-every', type=int, default=3, help="Cada aula múltipla deste número usa o player Hotmart (0 para nenhuma).")
+    parser.add_argument('--encrypt', action='store_true', help="Criptografa os vídeos Panda com AES-128.")
+    parser.add_argument('--gzip-attachments', action='store_true',
+                        help="Envia os anexos compactados com gzip, mesmo sem 'Accept-Encoding'.")
+
+
+def school_settings(args: argparse.Namespace) -> dict:
+    """Returns the StandInServer keyword arguments from the options of add_school_arguments."""
+    return {
+        'courses': args.courses,
+        'modules': args.modules,
+        'attachments': args.attachments,
+        'attachment_size': args.attachment_kb * 1024,
+        'segments': args.segments,
+        'segment_size': args.segment_kb * 1024,
+        'hotmart_every': args.hotmart_every,
+        'encrypt': args.encrypt,
+        'gzip_attachments': args.gzip_attachments,
+    }
+
+
+def main_server(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--lessons', type=int, default=3, help="Aulas por módulo.")
+    parser.add_argument('--latency', type=float, default=0.0, help="Segundos adicionados a cada requisição.")
+    add_school_arguments(parser)
+    args = parser.parse_args(argv)
+
+    server = StandInServer(lessons=args.lessons, latency=args.latency, port=args.port, **school_settings(args))
+    print(f"Servidor de teste em {server.login_url} ({server.lesson_count} aulas). Ctrl+C para parar.")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_server())
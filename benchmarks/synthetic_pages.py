@@ -0,0 +1,179 @@
+"""
+Builders for synthetic Astronmembers pages, shaped like the real dashboard, course,
+lesson and Hotmart embed pages that main.py parses.
+
+The pages carry the same page chrome (head, menus, scripts, footer) as the real ones,
+so parse time and memory are representative, and can be scaled to any course size.
+"""
+import html
+import json
+from typing import Dict, List, Optional
+
+
+def _page_chrome(title: str, body: str) -> str:
+    """Wraps a page body with the header, menus, scripts and footer of the platform."""
+    stylesheets = "\n".join(
+        f'    <link rel="stylesheet" href="/assets/css/bundle-{i}.css?v=20250721">' for i in range(12)
+    )
+    scripts = "\n".join(
+        f'    <script src="/assets/js/vendor-{i}.js?v=20250721"></script>' for i in range(15)
+    )
+    menu = "\n".join(
+        f'        <li class="menu-item"><a href="/pagina/{i}"><i class="icon icon-{i}"></i><span>Menu {i}</span></a></li>'
+        for i in range(20)
+    )
+    return f"""<!DOCTYPE html>
+<html lang="pt-br">
+<head>
+    <meta charset="utf-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1">
+    <title>{html.escape(title)}</title>
+{stylesheets}
+    <script>window.dataLayer = window.dataLayer || []; function gtag(){{dataLayer.push(arguments);}}</script>
+</head>
+<body class="area-aluno">
+    <header class="topo">
+        <div class="logo"><a href="/dashboard"><img src="/assets/img/logo.png" alt="Escola"></a></div>
+        <ul class="menu-principal">
+{menu}
+        </ul>
+        <div class="perfil"><img src="/assets/img/avatar.png"><span>Aluno Exemplo</span></div>
+    </header>
+    <main class="conteudo">
+{body}
+    </main>
+    <footer class="rodape"><p>Todos os direitos reservados.</p><p>Plataforma Astronmembers</p></footer>
+{scripts}
+</body>
+</html>
+"""
+
+
+def dashboard_page(course_slugs: List[str], in_progress: int = 3) -> str:
+    """
+    Builds a dashboard page with a "Continuar Progresso" carousel and the course carousel.
+
+    Args:
+        course_slugs: The slugs of the courses listed in the course carousel.
+        in_progress: How many lessons are listed in the "Continuar Progresso" carousel.
+    """
+    progress_slides = "\n".join(
+        f'<div class="swiper-slide"><a href="aula/{slug}/1"><img src="/capas/{slug}.jpg"><h4>Continuar</h4></a></div>'
+        for slug in course_slugs[:in_progress]
+    )
+    course_slides = "\n".join(
+        f'<div class="swiper-slide"><a href="curso/{slug}"><img src="/capas/{slug}.jpg">'
+        f'<div class="progresso"><span style="width: 40%"></span></div></a></div>'
+        for slug in course_slugs
+    )
+    # Both carousels share the same markup; only the course links point to 'curso/'
+    body = f"""
+        <div class="box-slider-cursos continuar-progresso">
+            <h3>Continuar Progresso</h3>
+            <div class="swiper"><div class="swiper-wrapper">{progress_slides}</div></div>
+        </div>
+        <div class="box-slider-cursos">
+            <h3>Meus Cursos</h3>
+            <div class="swiper"><div class="swiper-wrapper">{course_slides}</div></div>
+        </div>
+"""
+    return _page_chrome("Dashboard", body)
+
+
+def course_page(course_title: str, modules: List[Dict], lesson_url_prefix: str = "/aula/") -> str:
+    """
+    Builds a course page with the 'div.modulos.videos' sidebar.
+
+    Args:
+        course_title: The title of the course.
+        modules: A list of {'title': str, 'lessons': [{'id': str, 'title': str, 'completed': bool}]}.
+        lesson_url_prefix: The path prefix of the lesson links.
+    """
+    module_blocks = []
+    for module in modules:
+        lesson_items = "\n".join(
+            f'<a href="{lesson_url_prefix}{lesson["id"]}">'
+            f'<li class="aulabox{" concluida" if lesson.get("completed") else ""}" data-aulaid="{lesson["id"]}">'
+            f'<div class="thumb"><img src="/thumbs/{lesson["id"]}.jpg"></div>'
+            f'<div class="info"><h6>{html.escape(lesson["title"])}</h6><span class="duracao">12:34</span></div>'
+            f'</li></a>'
+            for lesson in module['lessons']
+        )
+        module_blocks.append(
+            f'<dl><dt><h3>{html.escape(module["title"])}</h3><span class="qtd">{len(module["lessons"])} aulas</span></dt>'
+            f'<dd><ul>{lesson_items}</ul></dd></dl>'
+        )
+    body = f"""
+        <div class="player-area"><div class="video-placeholder"></div></div>
+        <div class="modulos videos">
+            <div class="modulo-head-content"><h2>{html.escape(course_title)}</h2><p>Progresso do curso</p></div>
+            {"".join(module_blocks)}
+        </div>
+"""
+    return _page_chrome(course_title, body)
+
+
+def synthetic_course_modules(module_count: int, lessons_per_module: int) -> List[Dict]:
+    """Builds the module list of a synthetic course for course_page."""
+    return [
+        {
+            'title': f"Módulo {m} - Conteúdo",
+            'lessons': [
+                {'id': f"{m * 1000 + l}", 'title': f"Aula {l}: Tópico {m}.{l}", 'completed': l % 3 == 0}
+                for l in range(1, lessons_per_module + 1)
+            ],
+        }
+        for m in range(1, module_count + 1)
+    ]
+
+
+def lesson_page(player_url: Optional[str], description: Optional[str], attachments: List[Dict[str, str]]) -> str:
+    """
+    Builds a lesson page with the player iframe, the description tab and the attachments tab.
+
+    Args:
+        player_url: The 'src' of the 'iframe.streaming-video-url', or None for no player.
+        description: The description paragraphs, or None for the "not found" placeholder.
+        attachments: A list of {'name': str, 'href': str}.
+    """
+    player = f'<iframe class="streaming-video-url" src="{html.escape(player_url)}" allowfullscreen></iframe>' if player_url else ''
+    if description:
+        description_html = "".join(f"<p>{html.escape(line)}</p>" for line in description.split("\n"))
+    else:
+        description_html = '<div class="content-notfound"><p>Nenhuma descrição.</p></div>'
+    attachment_links = "".join(
+        f'<a href="{html.escape(a["href"])}" target="_blank"><i class="icon-file"></i><p>{html.escape(a["name"])}</p></a>'
+        for a in attachments
+    )
+    comments = "".join(
+        f'<div class="comentario"><img src="/avatar/{i}.png"><p>Comentário {i} sobre a aula.</p></div>' for i in range(25)
+    )
+    body = f"""
+        <div class="player-area">{player}</div>
+        <ul class="abas"><li data-aba="descricao">Descrição</li><li data-aba="anexos">Anexos</li><li data-aba="comentarios">Comentários</li></ul>
+        <div class="aba aba-descricao">{description_html}</div>
+        <div class="aba aba-anexos"><div class="lista-anexos">{attachment_links}</div></div>
+        <div class="aba aba-comentarios">{comments}</div>
+"""
+    return _page_chrome("Aula", body)
+
+
+def hotmart_embed_page(media_urls: List[str]) -> str:
+    """Builds a Hotmart embed page whose '__NEXT_DATA__' lists the given media assets."""
+    next_data = {
+        'props': {
+            'pageProps': {
+                'applicationData': {
+                    'mediaAssets': [{'url': url, 'contentType': 'application/x-mpegURL'} for url in media_urls],
+                    'thumbnails': [f"https://thumb.example/{i}.jpg" for i in range(10)],
+                },
+            },
+        },
+        'page': '/embed/[mediaCode]',
+        'buildId': 'synthetic',
+    }
+    scripts = "".join(f'<script src="/_next/static/chunks/{i}.js" defer></script>' for i in range(20))
+    return f"""<!DOCTYPE html><html><head><meta charset="utf-8"><title>Hotmart Player</title>{scripts}</head>
+<body><div id="__next"><div class="player-container"><video></video></div></div>
+<script id="__NEXT_DATA__" type="application/json">{json.dumps(next_data)}</script></body></html>
+"""
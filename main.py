@@ -1,17 +1,536 @@
+from __future__ import annotations
+
+import argparse
+import base64
+import calendar
+import collections
+import concurrent.futures
+import contextlib
+import copy
+import functools
+import hashlib
+import importlib.util
+import io
 import json
-import requests
+import multiprocessing
+import os
+import pathlib
+import queue
 import re
-from typing import Dict, List, Optional, Any
-
+import shutil
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import tracemalloc
+from typing import TYPE_CHECKING, Dict, List, Optional, Any, Callable, Iterable, Tuple
 from urllib.parse import urlparse, urljoin, parse_qs, urlunparse
 
-from bs4 import BeautifulSoup
-import pathlib
-import m3u8
-import re
-import base64
-from yt_dlp import YoutubeDL
+# bs4, m3u8, yt_dlp and requests take most of the startup time, so they are only loaded when
+# used: 'status' never loads them, and 'list' only loads requests and bs4
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup, SoupStrainer
+    from yt_dlp import YoutubeDL
+
+
+def _lazy_import(name: str):
+    """
+    (Helper Function) Returns a module that is only executed on its first attribute access.
+
+    Used for modules referenced all over the file; the rest are imported inside the
+    functions that need them.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+def _load_lazy_module(module) -> None:
+    """
+    (Helper Function) Executes a module from _lazy_import right away.
+
+    LazyLoader is not thread-safe before Python 3.12: threads reaching an unloaded module at
+    the same time can see it half executed. Code about to start threads calls this first.
+    """
+    getattr(module, '__name__')
+
+requests = _lazy_import('requests')
+
+
+DEFAULT_SCRAPE_WORKERS = 4
+DEFAULT_RESOLVE_WORKERS = 2
+DEFAULT_DOWNLOAD_WORKERS = 2
+DEFAULT_QUEUE_SIZE = 8
+DOWNLOAD_ROOT = pathlib.Path("download")
+MANIFEST_PATH = DOWNLOAD_ROOT / "manifest.sqlite3"
+PAGE_CACHE_PATH = DOWNLOAD_ROOT / ".cache" / "pages"
+SESSION_CACHE_PATH = DOWNLOAD_ROOT / ".sessions"
+DEFAULT_PAGE_CACHE_SIZE_MB = 200
+HTML_BACKENDS = ('html.parser', 'lxml', 'strainer', 'lxml-strainer')
+# The strainers halve the parse time of dashboard and lesson pages, but a course page is
+# almost all module list, so only lxml makes it faster than html.parser
+DEFAULT_HTML_BACKEND = 'lxml-strainer' if importlib.util.find_spec('lxml') else 'strainer'
+DEFAULT_COURSE_PROCESSES = min(4, os.cpu_count() or 1)
+DEFAULT_MAX_TRANSFERS = 8
+DEFAULT_HLS_WORKERS = 8
+HLS_SEGMENT_RETRIES = 5
+# Files left by interrupted downloads (yt-dlp '.part'/'.ytdl', the native HLS engine '.part'/'.progress')
+PARTIAL_FILE_SUFFIXES = ('.part', '.ytdl', '.progress')
+# Temporary folders of the lesson folders being moved by 'sync', and the file naming their origin
+SYNC_FOLDER_PREFIX = '.sync-'
+SYNC_ORIGIN_FILE = 'origem.json'
+TS_PACKET_SIZE = 188
+MP4_TOP_LEVEL_BOXES = (b'ftyp', b'styp', b'moov', b'mdat', b'moof', b'sidx', b'free', b'skip', b'wide', b'pdin')
+MEDIA_PROBE_BYTES = 256 * TS_PACKET_SIZE * 8
+# A verified video may differ from its expected duration by this many seconds, or this share of it
+VIDEO_DURATION_TOLERANCE = 2.0
+VIDEO_DURATION_TOLERANCE_RATIO = 0.02
+# Optional work done on a process pool once a lesson is downloaded (see PostProcessor);
+# 'remux' and 'thumbnail' need ffmpeg
+POSTPROCESS_TASKS = ('remux', 'thumbnail', 'description')
+DEFAULT_POSTPROCESS_WORKERS = min(2, os.cpu_count() or 1)
+POSTPROCESS_FFMPEG_TIMEOUT = 3600
+DESCRIPTION_FILE_NAME = "Descrição.html"
+THUMBNAIL_FILE_NAME = "Miniatura.jpg"
+THUMBNAIL_WIDTH = 640
+# The thumbnail frame is taken at this share of the video, at most THUMBNAIL_MAX_POSITION seconds in
+THUMBNAIL_POSITION_RATIO = 0.1
+THUMBNAIL_MAX_POSITION = 60.0
+ATTACHMENT_RETRIES = 3
+ATTACHMENT_TIMEOUT = (15, 60)
+ATTACHMENT_CHUNK_SIZE = 1024 * 1024
+DEFAULT_ATTACHMENT_WORKERS = 8
+DEFAULT_ATTACHMENT_HOST_CONNECTIONS = 4
+DEFAULT_MAX_HOST_CONNECTIONS = 8
+ADAPTIVE_WINDOW = 5.0
+ADAPTIVE_DECREASE_COOLDOWN = 2.0
+# A host answering 429/503 (or failing to connect) gets no new lesson downloads for this long, doubled
+# on every consecutive throttle up to HOST_BACKOFF_MAX, unless it sends a Retry-After header
+HOST_BACKOFF_SECONDS = 5.0
+HOST_BACKOFF_MAX = 120.0
+CONTROL_FILE_PATH = DOWNLOAD_ROOT / "control.json"
+CONTROL_FILE_INTERVAL = 2.0
+REPORT_PATH = DOWNLOAD_ROOT / "run-report.json"
+PLAN_PATH = DOWNLOAD_ROOT / "plan.json"
+PLAN_VERSION = 1
+PLAN_DEFAULT_THROUGHPUT = 10 * 1024 * 1024
+PLAN_MIN_MEASURED_BYTES = 50 * 1024 * 1024
+DEDUPE_METHODS = ('auto', 'hardlink', 'reflink', 'copy', 'off')
+# Query parameters that only sign or track a URL; two URLs differing only in them point to the same file
+VOLATILE_QUERY_PARAMETERS = {
+    'expires', 'exp', 'signature', 'sig', 'policy', 'key-pair-id', 'token', 'hdnts', 'hdntl', '__token__',
+    'x-amz-algorithm', 'x-amz-credential', 'x-amz-date', 'x-amz-expires', 'x-amz-signedheaders',
+    'x-amz-signature', 'x-amz-security-token', 'utm_source', 'utm_medium', 'utm_campaign',
+}
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+PROFILE_PATH = DOWNLOAD_ROOT / "profile"
+PROFILE_TRACEBACK_FRAMES = 5
+PROFILE_SNAPSHOT_INTERVAL = 15.0
+PROFILE_TOP_ENTRIES = 25
+DEFAULT_JOB_CONCURRENCY = 2
+RESOLVED_URL_TTL = 6 * 3600
+RESOLVED_URL_EXPIRY_MARGIN = 300
+PANDA_PROBE_BYTES = 256 * 1024
+PANDA_PROBE_TIMEOUT = (5, 15)
+# Errors in a row on one Panda host, during a video, before the download moves to the next ranked host
+PANDA_FAILOVER_ERRORS = 2
+# CODECS prefixes of each video codec accepted by --prefer-codec, as written in HLS playlists
+VIDEO_CODEC_PREFIXES = {
+    'h264': ('avc1', 'avc3'),
+    'h265': ('hvc1', 'hev1'),
+    'vp9': ('vp09',),
+    'av1': ('av01',),
+}
+EXIT_OK = 0
+EXIT_INCOMPLETE = 1
+EXIT_INVALID_JOB_FILE = 2
+EXIT_LOGIN_FAILED = 3
+EXIT_NO_COURSES = 4
+
+_PIPELINE_SENTINEL = object()
+
+# Worker processes are spawned, never forked: the download threads of a run (or of the
+# sibling jobs of a job file) may hold locks that a forked child would inherit locked
+_process_context = multiprocessing.get_context('spawn')
+
+# Shared by every thread and worker process of a run to cap concurrent media transfers
+_media_transfer_semaphore = None
+_page_cache = None
+_html_backend = DEFAULT_HTML_BACKEND
+_hls_session = None
+_variant_policy = None
+_panda_endpoints = None
+_dedupe_method = 'auto'
+_hls_session_lock = threading.Lock()
+
+class RunMetrics:
+    """
+    Thread-safe counters of a run: operation latency histograms, failures, retries,
+    transferred bytes and video throughput per player type.
+
+    Worker processes collect their own metrics and hand a snapshot back to the main
+    process, which merges them before writing the report.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.operations = {}
+        self.retries = {}
+        self.bytes = {}
+        self.players = {}
+
+    def observe(self, operation: str, seconds: float, ok: bool = True) -> None:
+        """Records the latency of one call of an operation and whether it succeeded."""
+        with self._lock:
+            stats = self.operations.setdefault(operation, {
+                'count': 0, 'failures': 0, 'sum': 0.0, 'max': 0.0, 'buckets': [0] * (len(LATENCY_BUCKETS) + 1),
+            })
+            stats['count'] += 1
+            stats['failures'] += 0 if ok else 1
+            stats['sum'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+            bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound), len(LATENCY_BUCKETS))
+            stats['buckets'][bucket] += 1
+
+    def add_retry(self, operation: str, count: int = 1) -> None:
+        with self._lock:
+            self.retries[operation] = self.retries.get(operation, 0) + count
+
+    def add_bytes(self, kind: str, byte_count: int) -> None:
+        with self._lock:
+            self.bytes[kind] = self.bytes.get(kind, 0) + byte_count
+
+    def add_video(self, player: str, byte_count: int, seconds: float, ok: bool) -> None:
+        """Records one video download of a player type, for the per-player throughput."""
+        with self._lock:
+            stats = self.players.setdefault(player, {'videos': 0, 'failures': 0, 'bytes': 0, 'seconds': 0.0})
+            stats['videos'] += 1
+            stats['failures'] += 0 if ok else 1
+            stats['bytes'] += byte_count
+            stats['seconds'] += seconds
+
+    def snapshot(self, reset: bool = False) -> dict:
+        """Returns a picklable copy of the metrics, optionally clearing them."""
+        with self._lock:
+            snapshot = copy.deepcopy({
+                'operations': self.operations, 'retries': self.retries,
+                'bytes': self.bytes, 'players': self.players,
+            })
+            if reset:
+                self._reset()
+        return snapshot
+
+    def merge(self, snapshot: dict) -> None:
+        """Adds the metrics of a snapshot taken in another process."""
+        with self._lock:
+            for operation, stats in snapshot['operations'].items():
+                own = self.operations.setdefault(operation, {
+                    'count': 0, 'failures': 0, 'sum': 0.0, 'max': 0.0, 'buckets': [0] * (len(LATENCY_BUCKETS) + 1),
+                })
+                for key in ('count', 'failures', 'sum'):
+                    own[key] += stats[key]
+                own['max'] = max(own['max'], stats['max'])
+                own['buckets'] = [a + b for a, b in zip(own['buckets'], stats['buckets'])]
+            for target, source in ((self.retries, snapshot['retries']), (self.bytes, snapshot['bytes'])):
+                for key, value in source.items():
+                    target[key] = target.get(key, 0) + value
+            for player, stats in snapshot['players'].items():
+                own = self.players.setdefault(player, {'videos': 0, 'failures': 0, 'bytes': 0, 'seconds': 0.0})
+                for key, value in stats.items():
+                    own[key] += value
+
+    def report(self) -> dict:
+        """Builds the JSON run report."""
+        snapshot = self.snapshot()
+        finished = time.time()
+        for stats in snapshot['operations'].values():
+            stats['mean'] = stats['sum'] / stats['count'] if stats['count'] else 0.0
+            stats['buckets'] = dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'], stats['buckets']))
+        for stats in snapshot['players'].values():
+            stats['bytes_per_second'] = stats['bytes'] / stats['seconds'] if stats['seconds'] else 0.0
+        return {
+            'started': self.started,
+            'finished': finished,
+            'duration_seconds': finished - self.started,
+            **snapshot,
+        }
+
+    def prometheus_text(self) -> str:
+        """Renders the metrics in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = [
+            '# HELP astro_dl_operation_seconds Latency of the downloader operations.',
+            '# TYPE astro_dl_operation_seconds histogram',
+        ]
+        for operation, stats in sorted(snapshot['operations'].items()):
+            cumulative = 0
+            for bound, count in zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'], stats['buckets']):
+                cumulative += count
+                lines.append(f'astro_dl_operation_seconds_bucket{{operation="{operation}",le="{bound}"}} {cumulative}')
+            lines.append(f'astro_dl_operation_seconds_sum{{operation="{operation}"}} {stats["sum"]:.6f}')
+            lines.append(f'astro_dl_operation_seconds_count{{operation="{operation}"}} {stats["count"]}')
+        lines += ['# HELP astro_dl_operation_failures_total Failed calls per operation.', '# TYPE astro_dl_operation_failures_total counter']
+        lines += [f'astro_dl_operation_failures_total{{operation="{op}"}} {stats["failures"]}' for op, stats in sorted(snapshot['operations'].items())]
+        lines += ['# HELP astro_dl_retries_total Retried requests per operation.', '# TYPE astro_dl_retries_total counter']
+        lines += [f'astro_dl_retries_total{{operation="{op}"}} {count}' for op, count in sorted(snapshot['retries'].items())]
+        lines += ['# HELP astro_dl_bytes_total Transferred bytes per kind.', '# TYPE astro_dl_bytes_total counter']
+        lines += [f'astro_dl_bytes_total{{kind="{kind}"}} {count}' for kind, count in sorted(snapshot['bytes'].items())]
+        lines += ['# HELP astro_dl_player_bytes_total Video bytes per player type.', '# TYPE astro_dl_player_bytes_total counter']
+        lines += [f'astro_dl_player_bytes_total{{player="{player}"}} {stats["bytes"]}' for player, stats in sorted(snapshot['players'].items())]
+        lines += ['# HELP astro_dl_player_seconds_total Video download time per player type.', '# TYPE astro_dl_player_seconds_total counter']
+        lines += [f'astro_dl_player_seconds_total{{player="{player}"}} {stats["seconds"]:.3f}' for player, stats in sorted(snapshot['players'].items())]
+        lines += [
+            '# HELP astro_dl_run_duration_seconds Duration of the last run.', '# TYPE astro_dl_run_duration_seconds gauge',
+            f'astro_dl_run_duration_seconds {time.time() - self.started:.3f}',
+            '# HELP astro_dl_last_run_timestamp_seconds End of the last run.', '# TYPE astro_dl_last_run_timestamp_seconds gauge',
+            f'astro_dl_last_run_timestamp_seconds {time.time():.0f}',
+        ]
+        return "\n".join(lines) + "\n"
+
+_metrics = RunMetrics()
+
+def get_metrics() -> RunMetrics:
+    """Returns the metrics of the current process."""
+    return _metrics
+
+def instrumented(operation: str) -> Callable:
+    """Decorator that records the latency of a function, counting falsy results as failures."""
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            ok = False
+            try:
+                result = function(*args, **kwargs)
+                ok = bool(result)
+                return result
+            finally:
+                _metrics.observe(operation, time.perf_counter() - start, ok)
+        return wrapper
+    return decorator
+
+def write_run_report(path: pathlib.Path, prometheus_path: Optional[pathlib.Path] = None) -> None:
+    """
+    Writes the JSON run report and, optionally, a Prometheus textfile.
+
+    Both files are written to a temporary name and renamed, so the node exporter
+    textfile collector never reads a half-written file.
+    """
+    outputs = [(path, json.dumps(_metrics.report(), indent=2))]
+    if prometheus_path:
+        outputs.append((prometheus_path, _metrics.prometheus_text()))
+    for output_path, content in outputs:
+        try:
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            temporary_path = output_path.with_name(f".{output_path.name}.{os.getpid()}.tmp")
+            temporary_path.write_text(content, encoding='utf-8')
+            os.replace(temporary_path, output_path)
+        except OSError as e:
+            print(f"⚠️ Aviso: Não foi possível salvar o relatório {output_path}: {e}")
+            return
+    print(f"\n📊 Relatório da execução salvo em {path}")
+
+
+class StageProfiler:
+    """
+    CPU and memory profiler of a run, split by stage.
+
+    Every call of a stage (HTML parsing, playlist handling, yt-dlp, file writes) runs
+    under its own cProfile profiler, on the calling thread, and the results are added to
+    the stage's statistics. tracemalloc traces every allocation; a background thread keeps
+    the snapshot taken at the highest traced memory, and the allocation sites of that
+    snapshot and of the final one are attributed to the stage whose code (or library)
+    allocated them. A call nested inside another stage on the same thread is counted
+    as part of the outer stage.
+    """
+
+    # Allocations made inside these libraries belong to the stage that uses them
+    LIBRARY_STAGES = (
+        ('html_parse', ('bs4', 'lxml', 'soupsieve', os.path.join('html', 'parser.py'))),
+        ('playlist', ('m3u8',)),
+        ('ytdlp', ('yt_dlp',)),
+    )
+
+    def __init__(self, output_dir: pathlib.Path = PROFILE_PATH):
+        self.output_dir = output_dir
+        self._stats = {}
+        self._calls = {}
+        self._code_ranges = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._peak_snapshot = None
+        self._peak_size = 0
+        self._stop_event = threading.Event()
+
+    def register(self, stage: str, function: Callable) -> None:
+        """Attributes the allocations made by the code of 'function' to 'stage'."""
+        code = function.__code__
+        last_line = max((line for _, _, line in code.co_lines() if line), default=code.co_firstlineno)
+        self._code_ranges.setdefault(stage, []).append((code.co_filename, code.co_firstlineno, last_line))
+
+    def start(self) -> None:
+        """Starts tracing allocations and sampling the peak memory snapshot."""
+        tracemalloc.start(PROFILE_TRACEBACK_FRAMES)
+        threading.Thread(target=self._sample_peak, name='profiler', daemon=True).start()
+
+    def _sample_peak(self) -> None:
+        while not self._stop_event.wait(PROFILE_SNAPSHOT_INTERVAL):
+            self._take_peak_snapshot()
+
+    def _take_peak_snapshot(self) -> None:
+        current, _ = tracemalloc.get_traced_memory()
+        if current > self._peak_size:
+            self._peak_size = current
+            self._peak_snapshot = tracemalloc.take_snapshot()
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """Profiles the code run inside the block as part of the stage 'name'."""
+        if getattr(self._local, 'active', False):
+            yield
+            return
+        self._local.active = True
+        import cProfile
+
+        profile = cProfile.Profile()
+        memory_before, _ = tracemalloc.get_traced_memory()
+        start = time.perf_counter()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+ allows a single active profiler per process; time and memory are still counted
+            profile = None
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            elapsed = time.perf_counter() - start
+            memory_after, _ = tracemalloc.get_traced_memory()
+            self._local.active = False
+            with self._lock:
+                if profile is not None and name in self._stats:
+                    self._stats[name].add(profile)
+                elif profile is not None:
+                    import pstats
+
+                    self._stats[name] = pstats.Stats(profile)
+                calls = self._calls.setdefault(name, {'calls': 0, 'seconds': 0.0, 'memory_delta': 0})
+                calls['calls'] += 1
+                calls['seconds'] += elapsed
+                calls['memory_delta'] += memory_after - memory_before
+
+    def _stage_of(self, traceback: tracemalloc.Traceback) -> str:
+        for frame in traceback:
+            for stage, ranges in self._code_ranges.items():
+                if any(frame.filename == filename and first <= frame.lineno <= last for filename, first, last in ranges):
+                    return stage
+        for frame in traceback:
+            for stage, markers in self.LIBRARY_STAGES:
+                if any(f"{os.sep}{marker}" in frame.filename for marker in markers):
+                    return stage
+        return 'other'
+
+    def _allocation_sites(self, snapshot: tracemalloc.Snapshot) -> Dict[str, List[Tuple[str, int, int]]]:
+        """Groups the live allocations of a snapshot by stage and by allocating line."""
+        sites = {}
+        for statistic in snapshot.statistics('traceback'):
+            stage = self._stage_of(statistic.traceback)
+            frame = statistic.traceback[0]
+            key = f"{frame.filename}:{frame.lineno}"
+            stage_sites = sites.setdefault(stage, {})
+            size, count = stage_sites.get(key, (0, 0))
+            stage_sites[key] = (size + statistic.size, count + statistic.count)
+        return {
+            stage: sorted(((key, size, count) for key, (size, count) in stage_sites.items()), key=lambda site: -site[1])
+            for stage, stage_sites in sites.items()
+        }
+
+    def write_report(self) -> pathlib.Path:
+        """
+        Stops profiling and writes the report.
+
+        The text report lists, per stage, the calls, time and net traced memory, the hot
+        functions by cumulative time and the largest allocation sites at the memory peak and
+        at the end of the run. Each stage's raw statistics are also saved as a '.pstats' file.
+
+        Returns:
+            The path of the text report.
+        """
+        self._stop_event.set()
+        self._take_peak_snapshot()
+        final_snapshot = tracemalloc.take_snapshot()
+        _, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        snapshots = [('no pico de memória', self._peak_snapshot or final_snapshot), ('no fim da execução', final_snapshot)]
+        sites = [(label, self._allocation_sites(snapshot)) for label, snapshot in snapshots]
+        report = io.StringIO()
+        report.write(f"Pico de memória rastreada: {traced_peak / 1024 / 1024:.1f} MiB\n")
+        for stage in sorted(set(self._stats) | {stage for _, stage_sites in sites for stage in stage_sites}):
+            report.write(f"\n{'=' * 80}\nEtapa: {stage}\n")
+            calls = self._calls.get(stage)
+            if calls:
+                report.write(f"{calls['calls']} chamadas, {calls['seconds']:.2f} s, "
+                             f"memória líquida {calls['memory_delta'] / 1024:+.0f} KiB\n")
+            if stage in self._stats:
+                self._stats[stage].dump_stats(str(self.output_dir / f"{stage}.pstats"))
+                report.write("\nFunções mais custosas (tempo acumulado):\n")
+                self._stats[stage].stream = report
+                self._stats[stage].sort_stats('cumulative').print_stats(PROFILE_TOP_ENTRIES)
+            for label, stage_sites in sites:
+                report.write(f"\nMaiores alocações {label}:\n")
+                for key, size, count in stage_sites.get(stage, [])[:10]:
+                    report.write(f"  {size / 1024:>10.1f} KiB  {count:>8} blocos  {key}\n")
+
+        report_path = self.output_dir / "profile-report.txt"
+        report_path.write_text(report.getvalue(), encoding='utf-8')
+        return report_path
+
+_profiler = None
+
+def configure_profiler(profiler: Optional[StageProfiler]) -> None:
+    """Sets the stage profiler of the current process; None turns profiling off."""
+    global _profiler
+    _profiler = profiler
+    if profiler is not None:
+        for stage, function in _profiled_functions:
+            profiler.register(stage, function)
+
+@contextlib.contextmanager
+def profile_stage(stage: str):
+    """Profiles a block as part of 'stage' when the run was started with --profile. A no-op otherwise."""
+    if _profiler is None:
+        yield
+        return
+    with _profiler.stage(stage):
+        yield
+
+_profiled_functions = []
 
+def profiled(stage: str) -> Callable:
+    """Decorator that profiles every call of a function as part of 'stage'."""
+    def decorator(function: Callable) -> Callable:
+        _profiled_functions.append((stage, function))
+
+        @functools.wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with profile_stage(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
 
 def request_platform_url() -> str:
     """
@@ -86,6 +605,20 @@ def request_credentials() -> Dict[str, str]:
         'password': password
     }
 
+def credentials_from_environment(email: Optional[str] = None) -> Optional[Dict[str, str]]:
+    """
+    Returns the login credentials given without prompts, or None when any of them is missing.
+
+    The email comes from the 'email' argument (the --email option) or the ASTRO_DL_EMAIL
+    environment variable, and the password always from ASTRO_DL_PASSWORD, so it never
+    shows up in the process list or the shell history.
+    """
+    email = email or os.environ.get('ASTRO_DL_EMAIL')
+    password = os.environ.get('ASTRO_DL_PASSWORD')
+    if not email or not password:
+        return None
+    return {'email': email, 'password': password}
+
 def validate_configuration(platform_url: str, credentials: Dict[str, str]) -> bool:
     """
     Validate the configuration provided by the user.
@@ -105,30 +638,34 @@ def validate_configuration(platform_url: str, credentials: Dict[str, str]) -> bo
     # confirmation = input("\nAs informações estão corretas? (s/n): ").strip().lower()
     return True # confirmation in ['s', 'sim', 'y', 'yes']
 
-def create_authenticated_session(platform_url: str, credentials: Dict[str, str]) -> requests.Session:
-    """
-    Create a session to the platform.
-    
-    Args:
-        platform_url (str): The platform URL
-        credentials (Dict[str, str]): Dictionary containing email and password
-        
-    Returns:
-        requests.Session: A session object for the platform
-    """
+def _new_platform_session(platform_url: str) -> requests.Session:
+    """(Helper Function) Creates a requests session with the headers expected by the platform."""
     session = requests.Session()
     session.headers.update({
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
         'Origin': platform_url.rsplit('/', 1)[0],
         'Referer': platform_url
     })
+    return session
 
-    # Get the login URL from the platform URL
-    session.get(platform_url)
-
+def _login_url(platform_url: str) -> str:
+    """(Helper Function) Returns the login endpoint of the platform."""
     parsed_url = urlparse(platform_url)
-    login_url = f"{parsed_url.scheme}://{parsed_url.netloc}/entrar"
-    
+    return f"{parsed_url.scheme}://{parsed_url.netloc}/entrar"
+
+def login(session: requests.Session, platform_url: str, credentials: Dict[str, str]) -> bool:
+    """
+    Logs an existing session into the platform.
+
+    Args:
+        session: The requests session that receives the login cookies.
+        platform_url: The platform URL.
+        credentials: Dictionary containing email and password.
+
+    Returns:
+        True if the login request succeeded, False otherwise.
+    """
+    login_url = _login_url(platform_url)
     print(f"\nTentando fazer login em {login_url}...")
 
     login_data = {
@@ -138,15 +675,432 @@ def create_authenticated_session(platform_url: str, credentials: Dict[str, str])
     }
 
     try:
+        # Get the login page first, like a browser would, to receive the initial cookies
+        session.get(platform_url)
         response = session.post(login_url, files=login_data)
         response.raise_for_status()
+        return True
 
     except requests.exceptions.RequestException as e:
         print(f"❌ An error occurred during login: {e}")
-        return None
+        return False
+
+@instrumented('login')
+def create_authenticated_session(platform_url: str, credentials: Dict[str, str], account: Optional[str] = None) -> requests.Session:
+    """
+    Create a session to the platform.
     
+    Args:
+        platform_url (str): The platform URL
+        credentials (Dict[str, str]): Dictionary containing email and password
+        account (Optional[str]): Keeps the saved session apart from other accounts of the same host
+        
+    Returns:
+        requests.Session: A session object for the platform
+    """
+    session = _new_platform_session(platform_url)
+    if not login(session, platform_url, credentials):
+        return None
+    save_session_cookies(session, platform_url, account)
     return session
 
+def _session_cache_file(platform_url: str, account: Optional[str] = None) -> pathlib.Path:
+    """(Helper Function) Returns the file where the cookies of a platform host (and account) are saved."""
+    name = sanitize_path_component(urlparse(platform_url).netloc.replace(':', '_'))
+    if account:
+        name += f"-{hashlib.sha1(account.lower().encode('utf-8')).hexdigest()[:12]}"
+    return SESSION_CACHE_PATH / f"{name}.json"
+
+def save_session_cookies(session: requests.Session, platform_url: str, account: Optional[str] = None) -> None:
+    """Saves the cookies of an authenticated session so the next run can skip the login."""
+    cookies = [
+        {
+            'name': cookie.name,
+            'value': cookie.value,
+            'domain': cookie.domain,
+            'path': cookie.path,
+            'expires': cookie.expires,
+            'secure': cookie.secure,
+            'rest': cookie._rest,
+        }
+        for cookie in session.cookies
+    ]
+    cache_file = _session_cache_file(platform_url, account)
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        temporary_file = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+        temporary_file.write_text(json.dumps(cookies), encoding='utf-8')
+        os.replace(temporary_file, cache_file)
+        with contextlib.suppress(OSError):
+            os.chmod(cache_file, 0o600)
+    except OSError as e:
+        print(f"⚠️ Aviso: Não foi possível salvar a sessão: {e}")
+
+def is_login_response(response: requests.Response) -> bool:
+    """Checks whether a response is, or redirects to, the platform login page."""
+    if response.is_redirect:
+        location = response.headers.get('location', '')
+        return urlparse(location).path.rstrip('/').endswith('/entrar')
+    return urlparse(response.url).path.rstrip('/').endswith('/entrar')
+
+def is_session_valid(session: requests.Session, platform_url: str) -> bool:
+    """Checks, with a single request to the dashboard, whether a session is still logged in."""
+    try:
+        response = session.get(urljoin(platform_url, 'dashboard'), allow_redirects=False, timeout=15)
+    except requests.exceptions.RequestException:
+        return False
+    return response.status_code == 200 and not is_login_response(response)
+
+@instrumented('restore_session')
+def restore_authenticated_session(platform_url: str, account: Optional[str] = None) -> Optional[requests.Session]:
+    """
+    Restores the session saved by a previous run, if its cookies are still valid.
+
+    Args:
+        platform_url: The platform URL.
+        account: The account the session was saved for, if it was saved with one.
+
+    Returns:
+        The logged-in session, or None if there is no saved session or it expired.
+    """
+    cache_file = _session_cache_file(platform_url, account)
+    if not cache_file.is_file():
+        return None
+    try:
+        cookies = json.loads(cache_file.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return None
+
+    session = _new_platform_session(platform_url)
+    for cookie in cookies:
+        session.cookies.set(
+            cookie['name'], cookie['value'],
+            domain=cookie['domain'], path=cookie['path'], expires=cookie['expires'],
+            secure=cookie['secure'], rest=cookie.get('rest') or {},
+        )
+    return session if is_session_valid(session, platform_url) else None
+
+class _ReauthenticationHook:
+    """
+    Response hook that logs the session in again when a request is bounced to the login page.
+
+    The original request is sent again once the login succeeds, so an expired session never
+    interrupts a long run. Credentials come from the ones given at startup, from the
+    ASTRO_DL_EMAIL and ASTRO_DL_PASSWORD environment variables or, as a last resort, from
+    an interactive prompt.
+    """
+
+    def __init__(self, session: requests.Session, platform_url: str, credentials: Optional[Dict[str, str]] = None, account: Optional[str] = None):
+        self.session = session
+        self.platform_url = platform_url
+        self.credentials = credentials
+        self.account = account
+        self._lock = threading.Lock()
+        self._last_login = 0.0
+
+    def __getstate__(self) -> dict:
+        # Locks cannot be sent to the worker processes of a multi-course run
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _get_credentials(self) -> Optional[Dict[str, str]]:
+        if self.credentials is None and os.environ.get('ASTRO_DL_EMAIL') and os.environ.get('ASTRO_DL_PASSWORD'):
+            self.credentials = {'email': os.environ['ASTRO_DL_EMAIL'], 'password': os.environ['ASTRO_DL_PASSWORD']}
+        if self.credentials is None and threading.current_thread() is threading.main_thread() and sys.stdin.isatty():
+            self.credentials = request_credentials()
+        return self.credentials
+
+    def __call__(self, response: requests.Response, *args: Any, **kwargs: Any) -> requests.Response:
+        request = response.request
+        if getattr(request, 'reauthenticated', False) or not is_login_response(response):
+            return response
+        if urlparse(request.url).path.rstrip('/').endswith('/entrar'):
+            return response
+
+        with self._lock:
+            # Another thread may have logged in while this request was waiting for the lock
+            if time.time() - self._last_login > 5:
+                credentials = self._get_credentials()
+                if credentials is None:
+                    print("❌ A sessão expirou e não há credenciais para entrar novamente.")
+                    return response
+                print("\n🔑 A sessão expirou, fazendo login novamente...")
+                if not login(self.session, self.platform_url, credentials):
+                    return response
+                self._last_login = time.time()
+                save_session_cookies(self.session, self.platform_url, self.account)
+
+        retried_request = request.copy()
+        retried_request.headers.pop('Cookie', None)
+        retried_request.prepare_cookies(self.session.cookies)
+        retried_request.reauthenticated = True
+        return self.session.send(retried_request, **kwargs)
+
+def enable_reauthentication(session: requests.Session, platform_url: str, credentials: Optional[Dict[str, str]] = None, account: Optional[str] = None) -> None:
+    """Makes a session log in again, transparently, whenever one of its requests hits the login page."""
+    session.hooks['response'].append(_ReauthenticationHook(session, platform_url, credentials, account))
+
+def session_account(session: requests.Session) -> str:
+    """
+    Returns the account (email) a session is logged in with, or '' when unknown.
+
+    It is read from the hook of enable_reauthentication, which travels with the session
+    to the worker processes, unlike any attribute set on the session itself.
+    """
+    for hook in session.hooks.get('response', []):
+        if isinstance(hook, _ReauthenticationHook):
+            return (hook.account or (hook.credentials or {}).get('email') or '').lower()
+    return ''
+
+class HttpPageCache:
+    """
+    On-disk cache for the platform pages fetched with the authenticated session.
+
+    Each entry keeps the body, status, 'ETag' and 'Last-Modified' of a page. Cached pages are
+    revalidated with conditional requests and a 304 answer is served from disk. Entries younger
+    than 'ttl' seconds are served without any request, which allows planning a mirror offline.
+    The cache folder is bounded to 'max_bytes', evicting the least recently used entries first.
+    The bound holds for the folder as a whole, which the worker processes of a multi-course
+    run share: every write scans the folder, and each entry's last use is the modification
+    time of its '.json' file. Processes evicting at the same moment can only remove a few
+    more entries than needed, which are fetched again.
+
+    The pages are private to the logged user, so 'Cache-Control: no-store' is deliberately
+    ignored: the cache never leaves the user's machine. Entries are keyed by account as well
+    (see session_account), since the jobs of a job file share the folder, and a page that
+    is, or redirects to, the login page is never stored.
+    """
+
+    _STORED_HEADERS = ('ETag', 'Last-Modified', 'Location', 'Content-Type')
+
+    def __init__(self, path: pathlib.Path = PAGE_CACHE_PATH, max_bytes: int = DEFAULT_PAGE_CACHE_SIZE_MB * 1024 * 1024, ttl: Optional[float] = None):
+        path.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+    def _key(self, url: str, allow_redirects: bool, account: str) -> str:
+        return hashlib.sha256(f"{account}:{allow_redirects}:{url}".encode('utf-8')).hexdigest()
+
+    def _load(self, key: str) -> Optional[Tuple[dict, bytes]]:
+        try:
+            with open(self.path / f"{key}.json", encoding='utf-8') as f:
+                meta = json.load(f)
+            body = (self.path / f"{key}.body").read_bytes()
+        except (OSError, ValueError):
+            return None
+        return meta, body
+
+    def _touch(self, key: str) -> None:
+        now = time.time()
+        with contextlib.suppress(OSError):
+            os.utime(self.path / f"{key}.json", (now, now))
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        """(Helper Function) Lists the entries on disk as (last access time, size, key), least recently used first."""
+        entries = {}
+        with os.scandir(self.path) as scan:
+            for entry in scan:
+                key, _, suffix = entry.name.partition('.')
+                if suffix not in ('json', 'body'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                # A body whose '.json' is gone keeps the access time 0 and goes first
+                record = entries.setdefault(key, [0.0, 0])
+                record[1] += stat.st_size
+                if suffix == 'json':
+                    record[0] = stat.st_mtime
+        return sorted((access, size, key) for key, (access, size) in entries.items())
+
+    def _store(self, key: str, response: requests.Response) -> None:
+        meta = {
+            'url': response.url,
+            'status_code': response.status_code,
+            'headers': {name: response.headers[name] for name in self._STORED_HEADERS if name in response.headers},
+            'encoding': response.encoding,
+            'stored_at': time.time(),
+        }
+        meta_bytes = json.dumps(meta).encode('utf-8')
+        body = response.content
+        for suffix, data in (('.body', body), ('.json', meta_bytes)):
+            temporary_path = self.path / f"{key}{suffix}.{os.getpid()}.{threading.get_ident()}.tmp"
+            temporary_path.write_bytes(data)
+            os.replace(temporary_path, self.path / f"{key}{suffix}")
+
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, old_key in entries:
+                if total <= self.max_bytes:
+                    break
+                if old_key == key:
+                    continue
+                for suffix in ('.json', '.body'):
+                    with contextlib.suppress(OSError):
+                        (self.path / f"{old_key}{suffix}").unlink()
+                total -= size
+
+    @staticmethod
+    def _build_response(meta: dict, body: bytes) -> requests.Response:
+        response = requests.Response()
+        response.status_code = meta['status_code']
+        response.url = meta['url']
+        response.headers = requests.structures.CaseInsensitiveDict(meta['headers'])
+        response.encoding = meta['encoding']
+        response._content = body
+        response.from_cache = True
+        return response
+
+    def get(self, session: requests.Session, url: str, allow_redirects: bool = True, **kwargs: Any) -> requests.Response:
+        """
+        Fetches a page through the cache.
+
+        Args:
+            session: The authenticated requests session.
+            url: The URL of the page.
+            allow_redirects: Same as in requests.Session.get; redirects are cached as well.
+            **kwargs: Extra arguments forwarded to requests.Session.get.
+
+        Returns:
+            A requests.Response, either fresh or rebuilt from disk. Responses served from
+            disk have their 'from_cache' attribute set to True.
+        """
+        key = self._key(url, allow_redirects, session_account(session))
+        cached = self._load(key)
+
+        if cached:
+            meta, body = cached
+            if self.ttl is not None and time.time() - meta['stored_at'] < self.ttl:
+                self._touch(key)
+                return self._build_response(meta, body)
+
+            headers = dict(kwargs.pop('headers', None) or {})
+            if 'ETag' in meta['headers']:
+                headers['If-None-Match'] = meta['headers']['ETag']
+            if 'Last-Modified' in meta['headers']:
+                headers['If-Modified-Since'] = meta['headers']['Last-Modified']
+            kwargs['headers'] = headers
+
+        response = session.get(url, allow_redirects=allow_redirects, **kwargs)
+
+        if cached and response.status_code == 304:
+            self._touch(key)
+            return self._build_response(cached[0], cached[1])
+
+        if (response.status_code == 200 or (not allow_redirects and response.is_redirect)) and not is_login_response(response):
+            self._store(key, response)
+        response.from_cache = False
+        return response
+
+def configure_page_cache(page_cache: Optional[HttpPageCache]) -> None:
+    """Sets the page cache used by fetch_page in the current process."""
+    global _page_cache
+    _page_cache = page_cache
+
+def fetch_page(session: requests.Session, url: str, **kwargs: Any) -> requests.Response:
+    """
+    Fetches a platform page with the authenticated session, going through the page cache when enabled.
+
+    Args:
+        session: The authenticated requests session.
+        url: The URL of the page.
+        **kwargs: Extra arguments forwarded to requests.Session.get.
+
+    Returns:
+        The requests.Response of the page.
+    """
+    if _page_cache is None:
+        response = session.get(url, **kwargs)
+    else:
+        response = _page_cache.get(session, url, **kwargs)
+    if not getattr(response, 'from_cache', False):
+        _metrics.add_bytes('page', len(response.content))
+    return response
+
+def _has_class(*class_names: str) -> Callable[[Any], bool]:
+    """
+    (Helper Function) Builds a SoupStrainer attribute matcher for tags having any of the given classes.
+
+    While parsing, the 'class' attribute reaches the strainer as a raw string, and as a list
+    afterwards, so both forms are accepted.
+    """
+    def match(value: Any) -> bool:
+        if not value:
+            return False
+        classes = value.split() if isinstance(value, str) else value
+        return any(class_name in classes for class_name in class_names)
+    return match
+
+# The only subtrees read from each kind of page, used by the strainer backends: tag names and classes
+_PAGE_STRAINERS = {
+    'dashboard': ('div', ('box-slider-cursos',)),
+    'course': ('div', ('modulos',)),
+    'lesson': (['iframe', 'div'], ('streaming-video-url', 'aba-descricao', 'aba-anexos')),
+}
+
+@functools.lru_cache(maxsize=None)
+def _page_strainer(page_kind: str) -> SoupStrainer:
+    """(Helper Function) Returns the SoupStrainer of a kind of page, built on first use."""
+    from bs4 import SoupStrainer
+
+    name, class_names = _PAGE_STRAINERS[page_kind]
+    return SoupStrainer(name, class_=_has_class(*class_names))
+
+# The Hotmart embed page is a Next.js page whose only useful content is this JSON blob
+_NEXT_DATA_PATTERN = re.compile(
+    r'<script\b[^>]*\bid\s*=\s*["\']?__NEXT_DATA__["\']?[^>]*>(.*?)</script\s*>',
+    re.IGNORECASE | re.DOTALL,
+)
+
+def configure_html_backend(backend: str) -> None:
+    """
+    Sets the HTML extraction backend used by make_soup in the current process.
+
+    Args:
+        backend: One of HTML_BACKENDS. 'html.parser' and 'lxml' build the full tree with
+            the given parser; 'strainer' and 'lxml-strainer' only build the subtrees listed
+            in _PAGE_STRAINERS. The lxml backends fall back to html.parser when lxml is not installed.
+    """
+    global _html_backend
+    if backend not in HTML_BACKENDS:
+        raise ValueError(f"Unknown HTML backend: {backend}")
+    if backend.startswith('lxml'):
+        try:
+            import lxml  # noqa: F401
+        except ImportError:
+            print("⚠️ Aviso: lxml não está instalado, usando o html.parser.")
+            backend = 'strainer' if backend == 'lxml-strainer' else 'html.parser'
+    _html_backend = backend
+
+def make_soup(html_content: str, page_kind: str, backend: Optional[str] = None) -> BeautifulSoup:
+    """
+    Parses a platform page with the configured extraction backend.
+
+    Args:
+        html_content: The HTML content of the page.
+        page_kind: The kind of page, one of the _PAGE_STRAINERS keys.
+        backend: Overrides the configured backend (used by the benchmarks).
+
+    Returns:
+        The BeautifulSoup tree, limited to the relevant subtrees for the strainer backends.
+    """
+    from bs4 import BeautifulSoup
+
+    backend = backend or _html_backend
+    parser = 'lxml' if backend.startswith('lxml') else 'html.parser'
+    parse_only = _page_strainer(page_kind) if backend.endswith('strainer') else None
+    return BeautifulSoup(html_content, parser, parse_only=parse_only)
+
+@profiled('html_parse')
 def _parse_courses_from_html(html_content: str, base_url: str) -> List[Dict[str, str]]:
     """
     (Helper Function) Parses the dashboard HTML to extract a list of all unique courses,
@@ -159,7 +1113,7 @@ def _parse_courses_from_html(html_content: str, base_url: str) -> List[Dict[str,
     Returns:
         A list of dictionaries, each containing the 'title' and 'url' of a course.
     """
-    soup = BeautifulSoup(html_content, 'html.parser')
+    soup = make_soup(html_content, 'dashboard')
     all_courses = []
     processed_urls = set()
 
@@ -182,6 +1136,7 @@ def _parse_courses_from_html(html_content: str, base_url: str) -> List[Dict[str,
     
     return all_courses
 
+@instrumented('course_list')
 def get_course_list(session: requests.Session, platform_url: str) -> List[Dict[str, str]]:
     """
     Fetches the dashboard page and returns a list of all courses available to the user.
@@ -199,7 +1154,7 @@ def get_course_list(session: requests.Session, platform_url: str) -> List[Dict[s
     dashboard_url = urljoin(platform_url, 'dashboard')
     
     try:
-        response = session.get(dashboard_url)
+        response = fetch_page(session, dashboard_url)
         response.raise_for_status()
 
         # Use the base URL from the final response URL after any redirects
@@ -217,6 +1172,7 @@ def get_course_list(session: requests.Session, platform_url: str) -> List[Dict[s
         print(f"❌ Erro ao buscar a página de cursos: {e}")
         return None
 
+@profiled('html_parse')
 def _parse_course_structure_from_html(html_content: str, base_url: str) -> dict:
     """
     (Helper Function) Parses the course page HTML to extract its full structure,
@@ -229,7 +1185,7 @@ def _parse_course_structure_from_html(html_content: str, base_url: str) -> dict:
     Returns:
         A dictionary representing the course structure.
     """
-    soup = BeautifulSoup(html_content, 'html.parser')
+    soup = make_soup(html_content, 'course')
     course_container = soup.select_one('div.modulos.videos')
     if not course_container:
         return {}
@@ -268,6 +1224,7 @@ def _parse_course_structure_from_html(html_content: str, base_url: str) -> dict:
 
     return course_data
 
+@instrumented('course_details')
 def get_course_details(session: requests.Session, course_url: str) -> dict:
     """
     Fetches the course page by manually handling redirects and returns its 
@@ -283,7 +1240,7 @@ def get_course_details(session: requests.Session, course_url: str) -> dict:
     print(f"\n🔎 Buscando detalhes para o curso em: {course_url}")
     
     try:
-        initial_response = session.get(course_url, allow_redirects=False)
+        initial_response = fetch_page(session, course_url, allow_redirects=False)
         initial_response.raise_for_status()
 
         final_response = None
@@ -292,7 +1249,7 @@ def get_course_details(session: requests.Session, course_url: str) -> dict:
             redirect_url = initial_response.headers['location']
             print(f"Redirect detectado. Acessando: {redirect_url}")
             
-            final_response = session.get(redirect_url)
+            final_response = fetch_page(session, redirect_url)
             final_response.raise_for_status()
         else:
             final_response = initial_response
@@ -311,6 +1268,57 @@ def get_course_details(session: requests.Session, course_url: str) -> dict:
         print(f"❌ Erro ao buscar a página do curso: {e}")
         return None
 
+@profiled('html_parse')
+def _parse_lesson_content_from_html(html_content: str, lesson_url: str) -> Dict[str, Any]:
+    """
+    (Helper Function) Parses a lesson page HTML to extract the video player URL,
+    the description and the attachments.
+
+    Args:
+        html_content: The HTML content of the lesson page.
+        lesson_url: The URL of the lesson page, used to resolve relative links.
+
+    Returns:
+        A dictionary containing 'player_url', 'description', and 'attachments'.
+    """
+    soup = make_soup(html_content, 'lesson')
+
+    player_iframe = soup.select_one('iframe.streaming-video-url')
+    player_url = player_iframe['src'] if player_iframe else None
+
+    description_container = soup.select_one('div.aba-descricao')
+    description = None
+    if description_container:
+        not_found_div = description_container.select_one('div.content-notfound')
+        if not not_found_div:
+            description = description_container.get_text(separator='\n', strip=True)
+
+    attachments = []
+    attachments_container = soup.select_one('div.aba-anexos')
+    if attachments_container:
+        attachment_links = attachments_container.select('div.lista-anexos a')
+        for link in attachment_links:
+            name_tag = link.select_one('p')
+            name = name_tag.get_text(strip=True) if name_tag else "Anexo sem nome"
+            
+            relative_url = link.get('href')
+            if not relative_url:
+                continue
+            
+            absolute_url = urljoin(lesson_url, relative_url)
+            
+            attachments.append({
+                'name': name,
+                'url': absolute_url,
+            })
+
+    return {
+        'player_url': player_url,
+        'description': description,
+        'attachments': attachments
+    }
+
+@instrumented('lesson_content')
 def get_lesson_content(session: requests.Session, lesson_url: str) -> Optional[Dict[str, Any]]:
     """
     Fetches a lesson page and extracts the video player URL, description, and attachments.
@@ -328,86 +1336,324 @@ def get_lesson_content(session: requests.Session, lesson_url: str) -> Optional[D
         Returns None if the request fails or if critical content cannot be parsed.
     """
     try:
-        response = session.get(lesson_url)
+        response = fetch_page(session, lesson_url)
         response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        player_iframe = soup.select_one('iframe.streaming-video-url')
-        player_url = player_iframe['src'] if player_iframe else None
-
-        description_container = soup.select_one('div.aba-descricao')
-        description = None
-        if description_container:
-            not_found_div = description_container.select_one('div.content-notfound')
-            if not not_found_div:
-                description = description_container.get_text(separator='\n', strip=True)
-
-        attachments = []
-        attachments_container = soup.select_one('div.aba-anexos')
-        if attachments_container:
-            attachment_links = attachments_container.select('div.lista-anexos a')
-            for link in attachment_links:
-                name_tag = link.select_one('p')
-                name = name_tag.get_text(strip=True) if name_tag else "Anexo sem nome"
-                
-                relative_url = link.get('href')
-                if not relative_url:
-                    continue
-                
-                absolute_url = urljoin(lesson_url, relative_url)
-                
-                attachments.append({
-                    'name': name,
-                    'url': absolute_url,
-                })
-
-        return {
-            'player_url': player_url,
-            'description': description,
-            'attachments': attachments
-        }
+        return _parse_lesson_content_from_html(response.text, lesson_url)
 
     except requests.exceptions.RequestException as e:
         print(f"❌ Nao foi possivel obter o conteudo da aula. Erro: {e}")
         return None
 
-def convert_panda_video_url(url: str) -> str:
-    """Converts a Panda Video embed URL to its M3U8 playlist format."""
-    parsed_url = urlparse(url)
-    query_params = parse_qs(parsed_url.query)
-    video_id = query_params.get('v', [None])[0]
-    if not video_id:
-        raise ValueError("URL is missing the required 'v' query parameter.")
-    new_netloc = parsed_url.netloc.replace('player', 'b', 1)
-    new_path = f"/{video_id}/playlist.m3u8"
-    new_url_components = (
-        parsed_url.scheme, new_netloc, new_path, '', '', ''
-    )
-    return urlunparse(new_url_components)
-
-def get_highest_quality_stream(embed_url: str, custom_referer: str):
+class VariantPolicy:
     """
-    Fetches the M3U8 playlist and returns the highest quality stream.
+    Chooses which rendition of a video is downloaded, for every player of a run.
 
-    Args:
-        embed_url: The original embed URL from Panda Video.
-        custom_referer: The 'X-Custom-Referer' value required by the server.
+    The same limits apply to the native HLS engine (Panda) and to yt-dlp (Hotmart, YouTube,
+    Vimeo and the Panda fallback), so the size of the whole catalog can be predicted:
 
-    Returns:
-        The m3u8 Playlist object for the highest quality stream, or None if failed.
+    - max_height: the tallest video accepted, in pixels (720 for 720p).
+    - max_bandwidth: the highest peak bitrate accepted, in bits per second (HLS 'BANDWIDTH').
+    - prefer_codec: a video codec ('h264', 'h265', 'vp9' or 'av1') picked over the others
+      whenever a rendition with it fits the limits.
+    - audio_only: downloads only the audio track when the player offers one.
+
+    Among the renditions within the limits, the preferred codec wins, then the tallest and then
+    the highest bitrate. When none fits, the smallest rendition is taken instead of failing.
     """
-    try:
-        m3u8_url = convert_panda_video_url(embed_url)
-        print(f"▶️ Converted to M3U8 URL: {m3u8_url}")
-    except ValueError as e:
-        print(f"❌ Error: {e}")
-        return None
 
-    parsed_m3u8_url = urlparse(m3u8_url)
-    parsed_embed_url = urlparse(embed_url)
+    def __init__(self, max_height: Optional[int] = None, max_bandwidth: Optional[int] = None, prefer_codec: Optional[str] = None, audio_only: bool = False):
+        self.max_height = max_height or None
+        self.max_bandwidth = max_bandwidth or None
+        self.prefer_codec = prefer_codec
+        self.audio_only = audio_only
+
+    @property
+    def is_default(self) -> bool:
+        return not (self.max_height or self.max_bandwidth or self.prefer_codec or self.audio_only)
+
+    def cache_key(self) -> str:
+        """Returns a string that differs between policies which may pick different renditions."""
+        return f"h{self.max_height or 0}-b{self.max_bandwidth or 0}-c{self.prefer_codec or ''}-a{int(self.audio_only)}"
+
+    def describe(self) -> str:
+        """Returns a short human readable description of the policy."""
+        if self.is_default:
+            return "maior qualidade"
+        parts = ["somente áudio"] if self.audio_only else []
+        if self.max_height:
+            parts.append(f"até {self.max_height}p")
+        if self.max_bandwidth:
+            parts.append(f"até {self.max_bandwidth / 1000:.0f} kbps")
+        if self.prefer_codec:
+            parts.append(f"preferindo {self.prefer_codec}")
+        return ", ".join(parts)
+
+    def _fits(self, height: int, bandwidth: int) -> bool:
+        return (not self.max_height or height <= self.max_height) and (not self.max_bandwidth or bandwidth <= self.max_bandwidth)
+
+    def _has_preferred_codec(self, codecs: str) -> bool:
+        prefixes = VIDEO_CODEC_PREFIXES.get(self.prefer_codec, ())
+        return any(codec.strip().startswith(prefixes) for codec in (codecs or '').split(','))
+
+    def select_variant(self, playlists: List[Any]) -> Optional[Any]:
+        """
+        Picks one of the variant streams of an HLS master playlist.
+
+        Args:
+            playlists: The m3u8.Playlist objects of the master playlist.
+
+        Returns:
+            The chosen playlist, or None if there are none.
+        """
+        if not playlists:
+            return None
+
+        def height(playlist) -> int:
+            return playlist.stream_info.resolution[1] if playlist.stream_info.resolution else 0
+
+        def bandwidth(playlist) -> int:
+            return playlist.stream_info.bandwidth or playlist.stream_info.average_bandwidth or 0
+
+        # A variant with codecs but no resolution nor video codec carries only audio
+        audio_variants = [
+            p for p in playlists
+            if p.stream_info.codecs and not p.stream_info.resolution and not self._is_video(p.stream_info.codecs)
+        ]
+        if self.audio_only and audio_variants:
+            return max(audio_variants, key=bandwidth)
+        video_variants = [p for p in playlists if p not in audio_variants] or playlists
+        if self.audio_only:
+            return min(video_variants, key=lambda p: (height(p), bandwidth(p)))
+
+        fitting = [p for p in video_variants if self._fits(height(p), bandwidth(p))]
+        if not fitting:
+            return min(video_variants, key=lambda p: (height(p), bandwidth(p)))
+        return max(fitting, key=lambda p: (self._has_preferred_codec(p.stream_info.codecs), height(p), bandwidth(p)))
+
+    @staticmethod
+    def _is_video(codecs: Optional[str]) -> bool:
+        all_prefixes = tuple(prefix for prefixes in VIDEO_CODEC_PREFIXES.values() for prefix in prefixes)
+        return any(codec.strip().startswith(all_prefixes) for codec in (codecs or '').split(','))
+
+    def select_audio_rendition(self, master_playlist) -> Optional[Any]:
+        """Returns the audio rendition (EXT-X-MEDIA TYPE=AUDIO with its own URI) of a master playlist, if any."""
+        renditions = [media for media in master_playlist.media if media.type == 'AUDIO' and media.uri]
+        if not renditions:
+            return None
+        return next((media for media in renditions if media.default == 'YES'), renditions[0])
+
+    def ytdlp_format(self, can_merge: bool) -> Optional[str]:
+        """
+        Returns the yt-dlp format selector that applies the policy, falling back to the smallest format.
+
+        Args:
+            can_merge: Whether ffmpeg is available to merge separate video and audio formats.
+
+        Returns:
+            The format selector, or None to keep yt-dlp's own default when there are no limits.
+        """
+        if self.audio_only:
+            # 'wa*' is the smallest format with audio, for players that only offer muxed streams
+            return 'bestaudio/wa*'
+        limits = ''
+        if self.max_height:
+            limits += f"[height<=?{self.max_height}]"
+        if self.max_bandwidth:
+            limits += f"[tbr<=?{self.max_bandwidth / 1000:g}]"
+        if not limits:
+            return None
+        if can_merge:
+            return f"bestvideo*{limits}+bestaudio/best{limits}/worst"
+        return f"best{limits}/worst"
+
+    def ytdlp_format_sort(self) -> List[str]:
+        """Returns the yt-dlp format sort order for the preferred codec."""
+        return [f"vcodec:{self.prefer_codec}"] if self.prefer_codec else []
+
+def configure_variant_policy(policy: Optional[VariantPolicy]) -> None:
+    """Sets the rendition choice used by every video download of the current process."""
+    global _variant_policy
+    _variant_policy = policy
+
+def get_variant_policy() -> VariantPolicy:
+    """Returns the run's rendition choice, the highest quality when none was configured."""
+    return _variant_policy or VariantPolicy()
+
+def convert_panda_video_url(url: str, host: Optional[str] = None) -> str:
+    """
+    Converts a Panda Video embed URL to its M3U8 playlist format.
+
+    The playlist is served by the embed host with 'player' replaced by 'b', unless
+    another CDN 'host' (a netloc, see PandaEndpointSelector) is given.
+    """
+    parsed_url = urlparse(url)
+    query_params = parse_qs(parsed_url.query)
+    video_id = query_params.get('v', [None])[0]
+    if not video_id:
+        raise ValueError("URL is missing the required 'v' query parameter.")
+    new_netloc = host or parsed_url.netloc.replace('player', 'b', 1)
+    new_path = f"/{video_id}/playlist.m3u8"
+    new_url_components = (
+        parsed_url.scheme, new_netloc, new_path, '', '', ''
+    )
+    return urlunparse(new_url_components)
+
+class PandaEndpointSelector:
+    """
+    Ranks the Panda CDN hosts that serve the playlists and segments of a video library, once per run.
+
+    The candidates of a library (the embed host, 'player-vz-<library>...') are the usual
+    playlist host ('b-vz-<library>...'), the same host under the other Panda domain
+    (pandavideo.com.br or pandavideo.com) and the hosts given with --panda-hosts. Each one
+    is probed with small timed requests, the master playlist and the first PANDA_PROBE_BYTES
+    of a segment of its lightest rendition, and ranked by how long a segment would take:
+    the playlist latency plus the probe size over the measured throughput. Candidates that
+    fail the probe are left out; when every probe fails the usual host is used unprobed.
+
+    Rankings are cached per library for the rest of the process. A host that keeps failing
+    during a download (see record_error) is moved to the end of every ranking.
+    """
+
+    def __init__(self, extra_hosts: Iterable[str] = ()):
+        self.extra_hosts = [host.strip() for host in extra_hosts if host.strip()]
+        self._rankings = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+        self._library_locks = {}
+
+    def candidates(self, embed_url: str) -> List[str]:
+        """Returns the candidate CDN hosts (netlocs) of the library of an embed URL, the usual one first."""
+        usual_host = urlparse(convert_panda_video_url(embed_url)).netloc
+        hosts = [usual_host]
+        if usual_host.endswith('.pandavideo.com.br'):
+            hosts.append(usual_host[:-len('.br')])
+        elif usual_host.endswith('.pandavideo.com'):
+            hosts.append(f"{usual_host}.br")
+        return list(dict.fromkeys(hosts + self.extra_hosts))
+
+    def _probe(self, embed_url: str, host: str, headers: Dict[str, str]) -> Tuple[float, float]:
+        """
+        (Helper Function) Times the playlists and the first bytes of a segment of one candidate host.
+
+        Returns:
+            The playlist latency in seconds and the segment throughput in bytes per second.
+
+        Raises:
+            requests.exceptions.RequestException or ValueError: If the host cannot serve the video.
+        """
+        import m3u8
+
+        session = _get_hls_session()
+        playlist_url = convert_panda_video_url(embed_url, host)
+        started = time.perf_counter()
+        response = session.get(playlist_url, headers=headers, timeout=PANDA_PROBE_TIMEOUT)
+        response.raise_for_status()
+        latency = time.perf_counter() - started
+        playlist = m3u8.loads(response.text, uri=playlist_url)
+        if playlist.is_variant:
+            if not playlist.playlists:
+                raise ValueError("playlist sem variantes")
+            lightest = min(playlist.playlists, key=lambda variant: variant.stream_info.bandwidth or 0)
+            response = session.get(lightest.absolute_uri, headers=headers, timeout=PANDA_PROBE_TIMEOUT)
+            response.raise_for_status()
+            playlist = m3u8.loads(response.text, uri=lightest.absolute_uri)
+        if not playlist.segments:
+            raise ValueError("playlist sem segmentos")
+
+        segment_headers = dict(headers, Range=f"bytes=0-{PANDA_PROBE_BYTES - 1}")
+        started = time.perf_counter()
+        received = 0
+        with session.get(playlist.segments[0].absolute_uri, headers=segment_headers, timeout=PANDA_PROBE_TIMEOUT, stream=True) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(64 * 1024):
+                received += len(chunk)
+                if received >= PANDA_PROBE_BYTES:
+                    break
+        elapsed = max(time.perf_counter() - started, 1e-6)
+        _metrics.add_bytes('probe', received)
+        return latency, received / elapsed
+
+    def ranked_hosts(self, embed_url: str, custom_referer: str) -> List[str]:
+        """
+        Returns the CDN hosts of the library of an embed URL, best first, probing them on first use.
+
+        Args:
+            embed_url: The Panda embed URL of any video of the library.
+            custom_referer: The 'X-Custom-Referer' value required by the Panda CDN.
+        """
+        library = urlparse(embed_url).netloc
+        with self._lock:
+            library_lock = self._library_locks.setdefault(library, threading.Lock())
+        # Only the first lesson of a library probes; the others wait for its ranking
+        with library_lock:
+            with self._lock:
+                ranking = self._rankings.get(library)
+            if ranking is not None:
+                return list(ranking)
+
+            candidates = self.candidates(embed_url)
+            headers = _panda_stream_headers(embed_url, custom_referer)
+            scores = {}
+            descriptions = []
+            for host in candidates:
+                try:
+                    latency, throughput = self._probe(embed_url, host, headers)
+                except (requests.exceptions.RequestException, ValueError) as e:
+                    descriptions.append(f"{host} (falhou: {e.__class__.__name__})")
+                    continue
+                scores[host] = latency + PANDA_PROBE_BYTES / max(throughput, 1.0)
+                descriptions.append(f"{host} ({latency * 1000:.0f} ms, {format_rate(throughput)})")
+            ranking = sorted(scores, key=scores.get) or candidates[:1]
+            if len(candidates) > 1 or not scores:
+                print(f"🛰️ Servidores do Panda testados: {', '.join(descriptions)}. Usando {ranking[0]}.")
+            with self._lock:
+                self._rankings[library] = ranking
+            return list(ranking)
 
-    headers = {
-        'Host': parsed_m3u8_url.netloc,
+    def record_error(self, host: str) -> bool:
+        """
+        Counts a failed request to a CDN host during a download.
+
+        Returns:
+            True when the host reached PANDA_FAILOVER_ERRORS errors in a row and was moved
+            to the end of the rankings, so the caller should switch to the next host.
+        """
+        with self._lock:
+            self._errors[host] = self._errors.get(host, 0) + 1
+            if self._errors[host] < PANDA_FAILOVER_ERRORS:
+                return False
+            self._errors[host] = 0
+        self.demote(host)
+        return True
+
+    def record_success(self, host: str) -> None:
+        """Resets the error count of a host after a request succeeded."""
+        with self._lock:
+            self._errors.pop(host, None)
+
+    def demote(self, host: str) -> None:
+        """Moves a host to the end of every ranking it is in."""
+        with self._lock:
+            for library, ranking in self._rankings.items():
+                if host in ranking and ranking[-1] != host:
+                    self._rankings[library] = [other for other in ranking if other != host] + [host]
+
+def configure_panda_endpoints(extra_hosts: Iterable[str] = ()) -> None:
+    """Sets the run's Panda CDN host selector, with the extra candidate hosts of --panda-hosts."""
+    global _panda_endpoints
+    _panda_endpoints = PandaEndpointSelector(extra_hosts)
+
+def get_panda_endpoints() -> PandaEndpointSelector:
+    """Returns the run's Panda CDN host selector, creating one without extra hosts on first use."""
+    global _panda_endpoints
+    if _panda_endpoints is None:
+        _panda_endpoints = PandaEndpointSelector()
+    return _panda_endpoints
+
+def _panda_stream_headers(embed_url: str, custom_referer: str) -> Dict[str, str]:
+    """(Helper Function) Returns the headers the Panda CDN expects for playlists and segments."""
+    parsed_embed_url = urlparse(embed_url)
+    return {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:142.0) Gecko/20100101 Firefox/142.0',
         'Accept': '*/*',
         'Accept-Language': 'pt-BR,pt;q=0.8,en-US;q=0.5,en;q=0.3',
@@ -422,36 +1668,445 @@ def get_highest_quality_stream(embed_url: str, custom_referer: str):
         'Pragma': 'no-cache',
         'Cache-Control': 'no-cache',
     }
-    
-    with requests.Session() as session:
-        session.headers.update(headers)
-        try:
-            print("📡 Fetching master playlist...")
-            response = session.get(m3u8_url, timeout=10)
-            response.raise_for_status()
-            print("✅ Playlist fetched successfully.")
-        except requests.exceptions.RequestException as e:
-            print(f"❌ Failed to fetch playlist: {e}")
-            return None
 
-    m3u8_obj = m3u8.loads(response.text, uri=m3u8_url)
+def get_highest_quality_stream(embed_url: str, custom_referer: str):
+    """
+    Fetches the M3U8 playlist and returns the stream chosen by the run's VariantPolicy.
+
+    Without limits the policy picks the highest quality stream. In audio-only mode the
+    audio rendition of the master playlist is returned when there is one. The playlist is
+    fetched from the best ranked CDN host (see PandaEndpointSelector), falling back to the
+    next ones when it fails.
+
+    Args:
+        embed_url: The original embed URL from Panda Video.
+        custom_referer: The 'X-Custom-Referer' value required by the server.
+
+    Returns:
+        The m3u8 Playlist (or audio Media) object for the chosen stream, or None if failed.
+    """
+    import m3u8
+
+    try:
+        hosts = get_panda_endpoints().ranked_hosts(embed_url, custom_referer)
+    except ValueError as e:
+        print(f"❌ Error: {e}")
+        return None
+
+    headers = _panda_stream_headers(embed_url, custom_referer)
+    response = None
+    for host in hosts:
+        m3u8_url = convert_panda_video_url(embed_url, host)
+        print(f"▶️ Converted to M3U8 URL: {m3u8_url}")
+        headers['Host'] = host
+        with requests.Session() as session:
+            session.headers.update(headers)
+            try:
+                print("📡 Fetching master playlist...")
+                response = session.get(m3u8_url, timeout=10)
+                response.raise_for_status()
+                print("✅ Playlist fetched successfully.")
+                break
+            except requests.exceptions.RequestException as e:
+                print(f"❌ Failed to fetch playlist: {e}")
+                get_panda_endpoints().demote(host)
+                response = None
+    if response is None:
+        return None
+
+    with profile_stage('playlist'):
+        m3u8_obj = m3u8.loads(response.text, uri=m3u8_url)
 
     if not m3u8_obj.is_variant:
         print("ℹ️ This is not a variant playlist; it's the only stream available.")
         return m3u8_obj
 
-    sorted_playlists = sorted(
-        m3u8_obj.playlists,
-        key=lambda p: p.stream_info.resolution[1] if p.stream_info.resolution else 0,
-        reverse=True
-    )
+    policy = get_variant_policy()
+    if policy.audio_only:
+        audio_rendition = policy.select_audio_rendition(m3u8_obj)
+        if audio_rendition is not None:
+            return audio_rendition
 
-    if not sorted_playlists:
+    selected_playlist = policy.select_variant(m3u8_obj.playlists)
+    if selected_playlist is None:
         print("❌ No streams could be found in the playlist.")
         return None
 
-    return sorted_playlists[0]
+    stream_info = selected_playlist.stream_info
+    resolution = f"{stream_info.resolution[0]}x{stream_info.resolution[1]}" if stream_info.resolution else "áudio"
+    print(f"🎚️ Variante escolhida ({policy.describe()}): {resolution}, {(stream_info.bandwidth or 0) / 1000:.0f} kbps")
+    return selected_playlist
+
+def _get_hls_session() -> requests.Session:
+    """(Helper Function) Returns the keep-alive session shared by every segment fetch of the process."""
+    global _hls_session
+    with _hls_session_lock:
+        if _hls_session is None:
+            _hls_session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=64)
+            _hls_session.mount('http://', adapter)
+            _hls_session.mount('https://', adapter)
+        return _hls_session
+
+@profiled('playlist')
+def _segment_byte_ranges(segments) -> List[Optional[Tuple[int, int]]]:
+    """
+    (Helper Function) Resolves the EXT-X-BYTERANGE of every segment into (start, end) offsets.
+
+    A byte range without an offset continues where the previous segment of the same file ended.
+    """
+    byte_ranges = []
+    next_offsets = {}
+    for segment in segments:
+        if not segment.byterange:
+            byte_ranges.append(None)
+            continue
+        length, _, offset = segment.byterange.partition('@')
+        start = int(offset) if offset else next_offsets.get(segment.absolute_uri, 0)
+        end = start + int(length) - 1
+        next_offsets[segment.absolute_uri] = end + 1
+        byte_ranges.append((start, end))
+    return byte_ranges
+
+def _init_section_byte_range(init_section) -> Optional[Tuple[int, int]]:
+    """
+    (Helper Function) Resolves the BYTERANGE of an EXT-X-MAP into (start, end) offsets, or None without one.
+
+    Unlike a segment byte range, a map byte range without an offset starts at the beginning of the file.
+    """
+    if not init_section.byterange:
+        return None
+    length, _, offset = init_section.byterange.partition('@')
+    start = int(offset or 0)
+    return start, start + int(length) - 1
+
+def _init_section_key(init_section) -> Optional[Tuple[str, Optional[str]]]:
+    """(Helper Function) Identifies an EXT-X-MAP, whose URI alone is shared by every range of a single-file playlist."""
+    return (init_section.absolute_uri, init_section.byterange) if init_section is not None else None
+
+def download_hls_stream(media_playlist, output_path: pathlib.Path, headers: Dict[str, str], workers: int = DEFAULT_HLS_WORKERS,
+                        mirrors: Optional[List[str]] = None, variant: Optional[Any] = None) -> bool:
+    """
+    Downloads an HLS media playlist by fetching its segments concurrently.
+
+    Segments are fetched over a shared keep-alive session, decrypted when they use AES-128,
+    and written in playlist order straight into the output file. The byte ranges of
+    segments and of EXT-X-MAP initialization sections are fetched with Range requests. At most 'workers * 2'
+    segments are held in memory at any time. The file is written under a hidden '.part'
+    name and only renamed to 'output_path' once every segment was written. A '.progress'
+    file next to it records how many segments were written, so a failed or interrupted
+    download continues from there when the same rendition is downloaded again (see
+    hls_playlist_signature).
+
+    Args:
+        media_playlist: The m3u8.M3U8 media playlist (not a variant playlist).
+        output_path: The final path of the video file.
+        headers: The headers sent with every playlist, key and segment request.
+        workers: How many segments are fetched at the same time.
+        mirrors: Panda CDN hosts serving the same stream, best first. Requests to any of them
+            go to the current one, and after PANDA_FAILOVER_ERRORS errors in a row (counted by
+            the run's PandaEndpointSelector) the rest of the video comes from the next one.
+        variant: The variant playlist 'media_playlist' was chosen from, if any.
+
+    Returns:
+        True if the whole stream was saved, False otherwise.
+    """
+    segments = list(media_playlist.segments)
+    if not segments:
+        print("-----> ❌ A playlist HLS não possui segmentos.")
+        return False
+
+    session = _get_hls_session()
+    byte_ranges = _segment_byte_ranges(segments)
+    keys = {}
+    keys_lock = threading.Lock()
+    mirrors = list(mirrors or [])
+    current_mirror = [0]
+    mirror_lock = threading.Lock()
+
+    def mirrored(url: str) -> str:
+        parsed_url = urlparse(url)
+        if parsed_url.netloc not in mirrors:
+            return url
+        return urlunparse(parsed_url._replace(netloc=mirrors[current_mirror[0]]))
+
+    def fail_over(host: str) -> None:
+        if not get_panda_endpoints().record_error(host):
+            return
+        with mirror_lock:
+            if mirrors[current_mirror[0]] == host and current_mirror[0] + 1 < len(mirrors):
+                current_mirror[0] += 1
+                print(f"-----> 🔀 O servidor {host} está falhando; o restante do vídeo vem de {mirrors[current_mirror[0]]}.")
+
+    def fetch(url: str, byte_range: Optional[Tuple[int, int]] = None) -> bytes:
+        request_headers = dict(headers)
+        if byte_range:
+            request_headers['Range'] = f"bytes={byte_range[0]}-{byte_range[1]}"
+        for attempt in range(1, HLS_SEGMENT_RETRIES + 1):
+            request_url = mirrored(url)
+            try:
+                with host_transfer_slot(request_url):
+                    try:
+                        response = session.get(request_url, headers=request_headers, timeout=30)
+                    except requests.exceptions.RequestException:
+                        record_transfer(request_url, error=True)
+                        raise
+                record_transfer(request_url, response, len(response.content))
+                response.raise_for_status()
+                throttle_transfer(len(response.content))
+                _metrics.add_bytes('video', len(response.content))
+                if urlparse(request_url).netloc in mirrors:
+                    get_panda_endpoints().record_success(urlparse(request_url).netloc)
+                return response.content
+            except requests.exceptions.RequestException:
+                if urlparse(request_url).netloc in mirrors:
+                    fail_over(urlparse(request_url).netloc)
+                if attempt == HLS_SEGMENT_RETRIES:
+                    raise
+                _metrics.add_retry('hls_segment')
+                time.sleep(min(2 ** attempt, 10))
+
+    def get_key(key_url: str) -> bytes:
+        with keys_lock:
+            if key_url not in keys:
+                keys[key_url] = fetch(key_url)
+            return keys[key_url]
+
+    def fetch_segment(index: int) -> bytes:
+        segment = segments[index]
+        data = fetch(segment.absolute_uri, byte_ranges[index])
+        key = segment.key
+        if key is None or key.method in (None, 'NONE'):
+            return data
+        if key.method != 'AES-128':
+            raise ValueError(f"Unsupported HLS encryption method: {key.method}")
+        if key.iv:
+            iv = bytes.fromhex(key.iv[2:] if key.iv.lower().startswith('0x') else key.iv)
+        else:
+            iv = (media_playlist.media_sequence or 0) + index
+            iv = iv.to_bytes(16, 'big')
+        from yt_dlp.aes import aes_cbc_decrypt_bytes, unpad_pkcs7
+
+        return bytes(unpad_pkcs7(aes_cbc_decrypt_bytes(data, get_key(key.absolute_uri), iv)))
+
+    partial_path = output_path.with_name(f".{output_path.name}.part")
+    progress_path = output_path.with_name(f".{output_path.name}.progress")
+    playlist_signature = hls_playlist_signature(media_playlist, variant)
+    next_index, offset = _hls_resume_point(partial_path, progress_path, playlist_signature)
+    if next_index:
+        print(f"-----> ⏯️ Continuando o download HLS a partir do segmento {next_index + 1} de {len(segments)}.")
+    try:
+        with media_transfer_slot(), open(partial_path, 'r+b' if next_index else 'wb') as f, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            f.truncate(offset)
+            f.seek(offset)
+            pending = []
+            current_init_section = _init_section_key(segments[next_index - 1].init_section) if next_index else None
+            while next_index < len(segments) or pending:
+                while next_index < len(segments) and len(pending) < max(1, workers) * 2:
+                    pending.append((next_index, executor.submit(fetch_segment, next_index)))
+                    next_index += 1
+
+                index, future = pending.pop(0)
+                # fMP4 streams need their initialization section before the first media segment
+                init_section = segments[index].init_section
+                if init_section is not None and _init_section_key(init_section) != current_init_section:
+                    init_data = fetch(init_section.absolute_uri, _init_section_byte_range(init_section))
+                    with profile_stage('file_write'):
+                        f.write(init_data)
+                    current_init_section = _init_section_key(init_section)
+                segment_data = future.result()
+                with profile_stage('file_write'):
+                    f.write(segment_data)
+                    f.flush()
+                    _save_hls_progress(progress_path, playlist_signature, index + 1, f.tell())
+        os.replace(partial_path, output_path)
+        with contextlib.suppress(OSError):
+            progress_path.unlink()
+        return True
+    except (requests.exceptions.RequestException, OSError) as e:
+        print(f"-----> ❌ Falha no download HLS (os segmentos já baixados serão reaproveitados): {e}")
+        return False
+    except ValueError as e:
+        print(f"-----> ❌ Falha no download HLS: {e}")
+        for path in (partial_path, progress_path):
+            with contextlib.suppress(OSError):
+                path.unlink()
+        return False
+
+def hls_playlist_signature(media_playlist, variant: Optional[Any] = None) -> list:
+    """
+    (Helper Function) Returns what identifies the rendition of an HLS download, to match its saved progress.
+
+    Every rendition of a video has the same segment count and total duration, so the
+    signature also holds the path of the media playlist (without the host, which changes
+    between mirrors) and the resolution and bandwidth of the variant it was chosen from.
+    """
+    segments = media_playlist.segments
+    stream_info = getattr(variant, 'stream_info', None)
+    playlist_uri = getattr(variant, 'absolute_uri', None) or media_playlist.base_uri or ''
+    return [
+        len(segments),
+        round(sum(segment.duration or 0 for segment in segments), 3),
+        urlparse(playlist_uri).path,
+        list(stream_info.resolution) if stream_info and stream_info.resolution else None,
+        stream_info.bandwidth if stream_info else None,
+    ]
+
+def _hls_resume_point(partial_path: pathlib.Path, progress_path: pathlib.Path, playlist_signature: list) -> Tuple[int, int]:
+    """
+    (Helper Function) Returns the segment index and byte offset where an interrupted HLS download continues.
+
+    The saved progress only counts when it was made from the same rendition (see
+    hls_playlist_signature), and the partial file still holds every byte it mentions.
+    Returns (0, 0) otherwise.
+    """
+    try:
+        with open(progress_path, 'r', encoding='utf-8') as f:
+            progress = json.load(f)
+        if progress['playlist'] == playlist_signature and partial_path.stat().st_size >= progress['offset']:
+            return int(progress['segments']), int(progress['offset'])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return 0, 0
+
+def _save_hls_progress(progress_path: pathlib.Path, playlist_signature: list, segments: int, offset: int) -> None:
+    """(Helper Function) Atomically records how many segments (and bytes) of an HLS download are in its '.part' file."""
+    temporary_path = progress_path.with_name(f"{progress_path.name}.tmp")
+    with open(temporary_path, 'w', encoding='utf-8') as f:
+        json.dump({'playlist': playlist_signature, 'segments': segments, 'offset': offset}, f)
+    os.replace(temporary_path, progress_path)
+
+@instrumented('panda_hls_download')
+def download_panda_video(player_url: str, lesson_path: pathlib.Path, video_title: str, custom_referer: str, workers: int = DEFAULT_HLS_WORKERS) -> bool:
+    """
+    Downloads a Panda Video lesson with the native HLS engine.
+
+    Args:
+        player_url: The Panda embed URL.
+        lesson_path: The folder of the lesson.
+        video_title: The file name of the video, without extension.
+        custom_referer: The 'X-Custom-Referer' value required by the Panda CDN.
+        workers: How many segments are fetched at the same time.
+
+    Returns:
+        True if the video was saved, False if the caller should fall back to yt-dlp.
+    """
+    import m3u8
+
+    stream = get_highest_quality_stream(player_url, custom_referer)
+    if stream is None:
+        return False
+
+    headers = _panda_stream_headers(player_url, custom_referer)
+    headers['Accept-Encoding'] = 'gzip, deflate'
+    media_playlist = stream
+    if not hasattr(stream, 'segments'):
+        try:
+            response = _get_hls_session().get(stream.absolute_uri, headers=headers, timeout=10)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            print(f"-----> ❌ Falha ao buscar a playlist de mídia: {e}")
+            return False
+        with profile_stage('playlist'):
+            media_playlist = m3u8.loads(response.text, uri=stream.absolute_uri)
+
+    is_fragmented_mp4 = any(segment.init_section is not None for segment in media_playlist.segments)
+    output_path = lesson_path / f"{video_title}.{'mp4' if is_fragmented_mp4 else 'ts'}"
+    # The host that served the playlist comes first, then the other ranked Panda hosts
+    stream_host = urlparse(stream.absolute_uri).netloc
+    mirrors = [stream_host] + [host for host in get_panda_endpoints().ranked_hosts(player_url, custom_referer) if host != stream_host]
+    if download_hls_stream(media_playlist, output_path, headers, workers, mirrors=mirrors,
+                           variant=None if stream is media_playlist else stream):
+        # The EXTINF durations tell how long the saved video must be, for find_verified_video
+        get_manifest().record_video(output_path, sum(segment.duration or 0 for segment in media_playlist.segments) or None,
+                                    resumable=False)
+        print("-----> ✅ Download concluído.")
+        return True
+    return False
+
+def probe_hls_size(playlist_url: str, headers: Dict[str, str]) -> Tuple[Optional[int], Optional[float]]:
+    """
+    Estimates the size of an HLS video without downloading its segments.
+
+    The variant is chosen by the run's VariantPolicy, as in a real download, and its size
+    is its 'BANDWIDTH' (bits per second) times the duration of its media playlist. Byte-range
+    playlists give the exact size. A media playlist without any bitrate is sized from the
+    first segment, fetched with a HEAD request.
+
+    Args:
+        playlist_url: The URL of the master or media playlist.
+        headers: The headers sent with the playlist requests.
+
+    Returns:
+        The estimated size in bytes and the duration in seconds, each None when unknown.
+    """
+    import m3u8
+
+    session = _get_hls_session()
+    try:
+        response = session.get(playlist_url, headers=headers, timeout=15)
+        response.raise_for_status()
+        with profile_stage('playlist'):
+            playlist = m3u8.loads(response.text, uri=playlist_url)
+        bandwidth = None
+        if playlist.is_variant:
+            policy = get_variant_policy()
+            selected = policy.select_audio_rendition(playlist) if policy.audio_only else None
+            if selected is None:
+                selected = policy.select_variant(playlist.playlists)
+                if selected is None:
+                    return None, None
+                bandwidth = selected.stream_info.average_bandwidth or selected.stream_info.bandwidth
+            response = session.get(selected.absolute_uri, headers=headers, timeout=15)
+            response.raise_for_status()
+            with profile_stage('playlist'):
+                playlist = m3u8.loads(response.text, uri=selected.absolute_uri)
+    except requests.exceptions.RequestException as e:
+        print(f"-----> ⚠️ Não foi possível ler a playlist {playlist_url}: {e}")
+        return None, None
+
+    segments = list(playlist.segments)
+    duration = sum(segment.duration or 0 for segment in segments)
+    byte_ranges = _segment_byte_ranges(segments)
+    if segments and all(byte_ranges):
+        return sum(end - start + 1 for start, end in byte_ranges), duration
+    if bandwidth:
+        return int(bandwidth / 8 * duration), duration
+    if segments and segments[0].duration:
+        try:
+            response = session.head(segments[0].absolute_uri, headers=headers, timeout=15, allow_redirects=True)
+            first_size = int(response.headers.get('Content-Length') or 0)
+        except (requests.exceptions.RequestException, ValueError):
+            first_size = 0
+        if first_size:
+            return int(first_size / segments[0].duration * duration), duration
+    return None, duration or None
+
+@profiled('html_parse')
+def _parse_hotmart_media_assets_from_html(html_content: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    (Helper Function) Extracts the 'mediaAssets' list from the '__NEXT_DATA__' JSON
+    of a Hotmart embed page.
+
+    Args:
+        html_content: The HTML content of the Hotmart embed page.
+
+    The JSON is cut out of the page with a regular expression, without building a soup:
+    the tag holds raw JSON, which has no markup to parse.
+
+    Returns:
+        The list of media assets (possibly empty), or None if the page has no '__NEXT_DATA__' tag.
+        Raises json.JSONDecodeError if the tag content is not valid JSON.
+    """
+    match = _NEXT_DATA_PATTERN.search(html_content)
+    if not match:
+        return None
+
+    data = json.loads(match.group(1))
+    return data.get('props', {}).get('pageProps', {}).get('applicationData', {}).get('mediaAssets', [])
 
+@instrumented('hotmart_resolve')
 def get_hotmart_video_url(player_url: str, session: requests.Session, course_url: str):
     """
     Extracts the video URL from a Hotmart embed player page.
@@ -485,18 +2140,13 @@ def get_hotmart_video_url(player_url: str, session: requests.Session, course_url
         response.raise_for_status()
         html_content = response.text
 
-        soup = BeautifulSoup(html_content, 'html.parser')
-        next_data_script = soup.find('script', id='__NEXT_DATA__')
-
-        if not next_data_script:
+        media_assets = _parse_hotmart_media_assets_from_html(html_content)
+        if media_assets is None:
             print("-----> ❌ Não foi possível encontrar a tag de dados '__NEXT_DATA__' na página.")
             # with open("hotmart_error_page.html", "w", encoding="utf-8") as f:
             #     f.write(html_content)
             return None
 
-        data = json.loads(next_data_script.string)
-        media_assets = data.get('props', {}).get('pageProps', {}).get('applicationData', {}).get('mediaAssets', [])
-
         if not media_assets:
             print("-----> ❌ 'mediaAssets' não encontrado no JSON extraído da tag '__NEXT_DATA__'.")
             return None
@@ -523,128 +2173,3436 @@ def get_hotmart_video_url(player_url: str, session: requests.Session, course_url
         print(f"❌ Erro ao processar os dados do player: {e}")
         return None
 
-def download_video(video_url: str, lesson_path: pathlib.Path, video_title: str, session: requests.Session, http_headers: dict = None):
-    """
-    Downloads a video from any supported URL using yt-dlp, passing the correct referer.
+@contextlib.contextmanager
+def media_transfer_slot():
     """
-    import tempfile
-    import os
-    
-    ydl_opts = {
-        'outtmpl': str(lesson_path / f'{video_title}.%(ext)s'),
-        'http_headers': http_headers or {},
-        'nocheckcertificate': True,
-        'concurrent_fragment_downloads': 8,
-        'retries': 10,
-        'fragment_retries': 10,
-        'quiet': True,
-        'progress': True,
-        'no_warnings': True,
-    }
-
-    cookie_file_path = None
-    if session.cookies:
-        try:
-            cookie_file = tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False)
-            cookie_file_path = cookie_file.name
-            
-            cookie_file.write("# Netscape HTTP Cookie File\n")
-            for cookie in session.cookies:
-                # Format: domain	flag	path	secure	expiration	name	value
-                domain = cookie.domain or ''
-                if domain.startswith('.'):
-                    flag = 'TRUE'
-                else:
-                    flag = 'FALSE'
-                path = cookie.path or '/'
-                secure = 'TRUE' if cookie.secure else 'FALSE'
-                expires = str(int(cookie.expires)) if cookie.expires else '0'
-                
-                cookie_file.write(f"{domain}\t{flag}\t{path}\t{secure}\t{expires}\t{cookie.name}\t{cookie.value}\n")
-            
-            cookie_file.close()
-            ydl_opts['cookiefile'] = cookie_file_path
-            
-        except Exception as e:
-            print(f"-----> ⚠️ Aviso: Erro ao criar arquivo de cookies: {e}")
+    Holds one of the run-wide media transfer slots while a video or attachment is downloaded.
 
+    The slots are backed by a multiprocessing semaphore, so the cap is shared by every
+    worker process of a multi-course run. Without a configured cap this is a no-op.
+    """
+    semaphore = _media_transfer_semaphore
+    if semaphore is None:
+        yield
+        return
+    semaphore.acquire()
     try:
-        with YoutubeDL(ydl_opts) as ydl:
-            ydl.download([video_url])
-        print("-----> ✅ Download concluído.")
-        return True
-    except Exception as e:
-        print(f"\n❌ Erro durante o download com yt-dlp: {e}")
-        return False
+        yield
     finally:
-        # Clean up the temporary cookie file
-        if cookie_file_path and os.path.exists(cookie_file_path):
-            try:
-                os.unlink(cookie_file_path)
-            except:
-                pass
+        semaphore.release()
 
-def download_attachment(session: requests.Session, url: str, save_path: pathlib.Path, name: str):
-    """Downloads an attachment file."""
-    print(f"      -> Baixando anexo: {name}")
-    try:
-        response = session.get(url, stream=True)
-        response.raise_for_status()
-        
-        sanitized_name = re.sub(r'[\\/*?:"<>|]', "", name).strip()
-        file_extension = pathlib.Path(urlparse(url).path).suffix or '.pdf'
-        file_path = save_path / f"{sanitized_name}{file_extension}"
+def configure_media_transfer_limit(semaphore) -> None:
+    """Sets the semaphore used by media_transfer_slot in the current process."""
+    global _media_transfer_semaphore
+    _media_transfer_semaphore = semaphore
 
-        with open(file_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        print(f"      -> Anexo salvo: {file_path.name}")
-    except requests.exceptions.RequestException as e:
-        print(f"      -> ❌ Falha ao baixar o anexo {name}: {e}")
+def parse_rate(value: str) -> float:
+    """
+    Parses a transfer rate such as '500K', '2M', '1.5MB/s' or '0' into bytes per second.
 
-def main() -> None:
+    Units are binary (K = 1024 bytes). '0' means unlimited.
     """
-    Main function of the astronmembers platform downloader application.
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([kmg]?)(?:i?b)?(?:/s)?\s*', str(value), re.IGNORECASE)
+    if not match:
+        raise argparse.ArgumentTypeError(f"taxa inválida: {value!r} (use, por exemplo, 500K, 2M ou 0)")
+    number, unit = match.groups()
+    return float(number) * 1024 ** ' KMG'.index(unit.upper() or ' ')
+
+def format_rate(bytes_per_second: float) -> str:
+    """Formats a rate in bytes per second for the progress messages."""
+    if bytes_per_second <= 0:
+        return "ilimitado"
+    for unit in ('B', 'KiB', 'MiB'):
+        if bytes_per_second < 1024:
+            return f"{bytes_per_second:.1f} {unit}/s"
+        bytes_per_second /= 1024
+    return f"{bytes_per_second:.1f} GiB/s"
+
+def format_size(byte_count: float) -> str:
+    """Formats a size in bytes for the plan summary."""
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if byte_count < 1024:
+            return f"{byte_count:.1f} {unit}"
+        byte_count /= 1024
+    return f"{byte_count:.2f} TiB"
+
+def format_duration(seconds: float) -> str:
+    """Formats a duration in seconds as days, hours and minutes for the plan summary."""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    if days:
+        return f"{days}d {hours:02d}h{minutes:02d}m"
+    return f"{hours:02d}h{minutes:02d}m{seconds:02d}s"
+
+def parse_bitrate(value: str) -> int:
     """
-    print("🚀 === Kurseduka-dl ===")
-    print('Este é um aplicativo mínimo para download de cursos da plataforma Astronmembers (https://www.astronmembers.com.br)')
-    print('Seu autor é o @katomaro (Telegram e Discord), seu guia de uso (altamente recomendado visitar) pode ser encontrado em: https://katomart.com/astrok.html')
-    print('Lembrando, todos os aplicativos mínimos dispostos em katomart.com são melhor elaborados na suíte completa que está em construção.')
-    print("=" * 60)
-    
-    platform_url = request_platform_url()
-    base_url = platform_url.rsplit('/', 1)[0]
-    
-    credentials = request_credentials()
-    
-    if not validate_configuration(platform_url, credentials):
-        print("\n❌ Configuração cancelada pelo usuário.")
-        return
-    
-    print("\n✅ Configuração concluída! Iniciando processo de download...")
-    
-    download_session = create_authenticated_session(platform_url, credentials)
-    if not download_session:
-        print("\n❌ Falha ao criar sessão de download.")
-        return
-    
-    print("\n✅ Sessão de download criada com sucesso! Listando cursos...")
+    Parses a video bitrate such as '1500k', '2M', '2.5Mbps' or '800000' into bits per second.
 
-    courses = get_course_list(download_session, base_url)
-    if courses is None or not courses:
-        print("\n❌ Nenhum curso encontrado ou falha ao buscar a lista de cursos.")
-        return
-        
-    print("\n--- Cursos Disponíveis ---")
-    print("0. Baixar Todos os Cursos")
-    for i, course in enumerate(courses, 1):
-        print(f"{i}. {course['title']}")
-    
-    courses_to_process = []
-    while True:
-        try:
-            course_index_str = input("\nDigite o número do curso que deseja processar (ou 0 para TODOS): ")
-            course_index = int(course_index_str)
+    Units are decimal (k = 1000 bits), as in the BANDWIDTH attribute of HLS playlists.
+    """
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([kmg]?)(?:bps|b/s|b)?\s*', str(value), re.IGNORECASE)
+    if not match:
+        raise argparse.ArgumentTypeError(f"taxa de bits inválida: {value!r} (use, por exemplo, 1500k ou 2M)")
+    number, unit = match.groups()
+    return int(float(number) * 1000 ** ' KMG'.index(unit.upper() or ' '))
+
+class TransferGovernor:
+    """
+    Run-wide transfer settings shared by every process of a run.
+
+    Holds a token bucket that caps the bytes per second of all video, segment and
+    attachment transfers together, and the ceiling of concurrent connections per host
+    used by the HostConcurrencyController of each process. Everything lives in shared
+    memory, so a change made in the main process (from the control file) is seen by
+    the worker processes of a multi-course run at once.
+    """
+
+    def __init__(self, rate_limit: float = 0, max_host_connections: int = DEFAULT_MAX_HOST_CONNECTIONS, adaptive: bool = True):
+        self._rate = _process_context.Value('d', max(0.0, rate_limit), lock=False)
+        self._tokens = _process_context.Value('d', 0.0, lock=False)
+        self._updated = _process_context.Value('d', time.monotonic(), lock=False)
+        self._max_host_connections = _process_context.Value('i', max(1, max_host_connections), lock=False)
+        self._adaptive = _process_context.Value('b', adaptive, lock=False)
+        self._lock = _process_context.Lock()
+
+    @property
+    def rate_limit(self) -> float:
+        return self._rate.value
+
+    @property
+    def max_host_connections(self) -> int:
+        return self._max_host_connections.value
+
+    @property
+    def adaptive(self) -> bool:
+        return bool(self._adaptive.value)
+
+    def update(self, rate_limit: Optional[float] = None, max_host_connections: Optional[int] = None, adaptive: Optional[bool] = None) -> None:
+        """Changes the settings of the running transfers; None keeps the current value."""
+        with self._lock:
+            if rate_limit is not None:
+                self._rate.value = max(0.0, rate_limit)
+                self._tokens.value = min(self._tokens.value, self._rate.value)
+            if max_host_connections is not None:
+                self._max_host_connections.value = max(1, max_host_connections)
+            if adaptive is not None:
+                self._adaptive.value = adaptive
+
+    def throttle(self, byte_count: int) -> None:
+        """
+        Accounts for 'byte_count' transferred bytes, sleeping as long as needed to keep the rate.
+
+        The bucket holds at most one second worth of bytes, so short bursts are allowed but
+        the average stays at the limit. Each caller reserves its bytes under the lock and
+        sleeps outside of it, so transfers are served in arrival order.
+        """
+        rate = self._rate.value
+        if rate <= 0 or byte_count <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            tokens = min(rate, self._tokens.value + (now - self._updated.value) * rate)
+            tokens -= byte_count
+            self._tokens.value = tokens
+            self._updated.value = now
+        if tokens < 0:
+            time.sleep(-tokens / rate)
+
+class HostConcurrencyController:
+    """
+    Adapts, per host, how many requests of the current process run at the same time.
+
+    It is an additive-increase / multiplicative-decrease controller: the limit of a host
+    grows by one after each window in which every slot was busy and the throughput did
+    not drop, is halved on a 429 (or 503) answer and shrinks by one on other 5xx answers
+    and connection errors. The limit never exceeds the governor's 'max_host_connections',
+    and stays fixed at it when adaptation is turned off.
+
+    429 and 503 answers and connection errors also put the host in backoff, for its
+    'Retry-After' or HOST_BACKOFF_SECONDS doubled per consecutive throttle, which the
+    HostScheduler of the download stage uses to start lessons of other hosts meanwhile.
+    """
+
+    def __init__(self, governor: TransferGovernor):
+        self.governor = governor
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _state(self, host: str) -> Dict[str, Any]:
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None:
+                state = {
+                    'limit': float(max(1, self.governor.max_host_connections // 2)),
+                    'active': 0,
+                    'condition': threading.Condition(),
+                    'window_start': time.monotonic(),
+                    'window_bytes': 0,
+                    'saturated': False,
+                    'throughput': None,
+                    'last_decrease': 0.0,
+                    'backoff_until': 0.0,
+                    'throttles': 0,
+                }
+                self._hosts[host] = state
+            return state
+
+    def limit(self, url: str) -> int:
+        """Returns the current connection limit of the host of 'url'."""
+        state = self._state(urlparse(url).netloc)
+        ceiling = self.governor.max_host_connections
+        if not self.governor.adaptive:
+            return ceiling
+        return max(1, min(ceiling, int(state['limit'])))
+
+    def backoff_remaining(self, host: str) -> float:
+        """Returns how many seconds the host (a URL netloc) stays in backoff, 0 when it is not."""
+        state = self._state(host)
+        return max(0.0, state['backoff_until'] - time.monotonic())
+
+    @contextlib.contextmanager
+    def slot(self, url: str):
+        """Holds one connection slot of the host of 'url' while a request runs."""
+        state = self._state(urlparse(url).netloc)
+        with state['condition']:
+            while state['active'] >= self.limit(url):
+                state['condition'].wait(timeout=1)
+            state['active'] += 1
+            if state['active'] >= self.limit(url):
+                state['saturated'] = True
+        try:
+            yield
+        finally:
+            with state['condition']:
+                state['active'] -= 1
+                state['condition'].notify()
+
+    def record(self, url: str, status: Optional[int] = None, byte_count: int = 0, error: bool = False,
+               retry_after: Optional[float] = None) -> None:
+        """
+        Feeds the outcome of one request to the controller.
+
+        Args:
+            url: The URL of the request.
+            status: The HTTP status of the answer, None when the request failed without one.
+            byte_count: How many bytes were transferred.
+            error: Whether the request failed with a connection error or timeout.
+            retry_after: The seconds asked by a 'Retry-After' header, if any.
+        """
+        host = urlparse(url).netloc
+        state = self._state(host)
+        now = time.monotonic()
+        with state['condition']:
+            if status in (429, 503) or error:
+                # Concurrent requests failing together count as one throttle, not one per request
+                if now >= state['backoff_until']:
+                    state['throttles'] += 1
+                backoff = retry_after if retry_after is not None else min(
+                    HOST_BACKOFF_MAX, HOST_BACKOFF_SECONDS * 2 ** (state['throttles'] - 1))
+                if now + backoff > state['backoff_until'] + 1:
+                    print(f"-----> ⏸️ {host} pediu uma pausa: novas aulas deste servidor aguardam {backoff:.0f}s.")
+                state['backoff_until'] = max(state['backoff_until'], now + backoff)
+            elif status is not None and status < 400:
+                state['throttles'] = 0
+        if not self.governor.adaptive:
+            return
+        ceiling = self.governor.max_host_connections
+        with state['condition']:
+            limit = min(state['limit'], ceiling)
+            if status in (429, 503) or (status is not None and status >= 500) or error:
+                if now - state['last_decrease'] >= ADAPTIVE_DECREASE_COOLDOWN:
+                    limit = limit / 2 if status in (429, 503) else limit - 1
+                    state['last_decrease'] = now
+                    state['throughput'] = None
+            else:
+                state['window_bytes'] += byte_count
+                elapsed = now - state['window_start']
+                if elapsed >= ADAPTIVE_WINDOW:
+                    throughput = state['window_bytes'] / elapsed
+                    if state['throughput'] and throughput < state['throughput'] * 0.75:
+                        # The last increase made the host slower: step back
+                        limit -= 1
+                    elif state['saturated'] and (not state['throughput'] or throughput >= state['throughput'] * 0.95):
+                        limit += 1
+                    state.update(window_start=now, window_bytes=0, saturated=False, throughput=throughput)
+            state['limit'] = max(1.0, min(float(ceiling), limit))
+            state['condition'].notify_all()
+
+    def record_response(self, response: requests.Response, byte_count: int = 0) -> None:
+        """Records a response, including the answers that urllib3 retried before it."""
+        retries = getattr(response.raw, 'retries', None)
+        for attempt in getattr(retries, 'history', ()) or ():
+            self.record(attempt.url or response.url, status=attempt.status, error=attempt.error is not None)
+        retry_after = None
+        if response.status_code in (429, 503) and response.headers.get('Retry-After'):
+            with contextlib.suppress(Exception):
+                retry_after = requests.adapters.Retry().parse_retry_after(response.headers['Retry-After'])
+        self.record(response.url, status=response.status_code, byte_count=byte_count, retry_after=retry_after)
+
+_transfer_governor = None
+_host_concurrency = None
+
+def configure_transfer_governor(governor: Optional[TransferGovernor]) -> None:
+    """Sets the run-wide transfer governor in the current process, with a fresh per-host controller."""
+    global _transfer_governor, _host_concurrency
+    _transfer_governor = governor
+    _host_concurrency = HostConcurrencyController(governor) if governor else None
+
+def throttle_transfer(byte_count: int) -> None:
+    """Waits as needed to keep all transfers of the run under the configured rate limit."""
+    if _transfer_governor is not None:
+        _transfer_governor.throttle(byte_count)
+
+@contextlib.contextmanager
+def host_transfer_slot(url: str):
+    """Holds one of the adaptive connection slots of the host of 'url'. A no-op without a governor."""
+    if _host_concurrency is None:
+        yield
+        return
+    with _host_concurrency.slot(url):
+        yield
+
+def record_transfer(url: str, response: Optional[requests.Response] = None, byte_count: int = 0, error: bool = False,
+                    status: Optional[int] = None) -> None:
+    """Reports the outcome of a transfer request (or only its HTTP status) to the adaptive per-host controller."""
+    if _host_concurrency is None:
+        return
+    if response is not None:
+        _host_concurrency.record_response(response, byte_count)
+    else:
+        _host_concurrency.record(url, status=status, error=error)
+
+def host_backoff_remaining(host: str) -> float:
+    """Returns how many seconds a host (a URL netloc) stays in backoff, 0 without a governor."""
+    if _host_concurrency is None:
+        return 0.0
+    return _host_concurrency.backoff_remaining(host)
+
+def host_connection_limit(url: str, default: int) -> int:
+    """Returns the current adaptive connection limit of the host of 'url', or 'default' without a governor."""
+    if _host_concurrency is None:
+        return default
+    return _host_concurrency.limit(url)
+
+def watch_control_file(path: pathlib.Path, governor: TransferGovernor, interval: float = CONTROL_FILE_INTERVAL) -> threading.Event:
+    """
+    Applies the settings of a JSON control file to a running download, whenever it changes.
+
+    The file may hold 'rate_limit' (such as "2M" or 0), 'max_host_connections' and
+    'adaptive'. Missing keys keep their current value.
+
+    Args:
+        path: The control file; it does not need to exist when the run starts.
+        governor: The run-wide transfer governor to update.
+        interval: How often, in seconds, the file is checked.
+
+    Returns:
+        An event that stops the watcher when set.
+    """
+    stop_event = threading.Event()
+
+    def watch() -> None:
+        last_mtime = None
+        while not stop_event.wait(interval):
+            try:
+                mtime = path.stat().st_mtime
+                if mtime == last_mtime:
+                    continue
+                last_mtime = mtime
+                settings = json.loads(path.read_text(encoding='utf-8'))
+                rate_limit = settings.get('rate_limit')
+                governor.update(
+                    rate_limit=parse_rate(rate_limit) if rate_limit is not None else None,
+                    max_host_connections=settings.get('max_host_connections'),
+                    adaptive=settings.get('adaptive'),
+                )
+                print(f"\n⚙️ Configuração de transferência atualizada: limite {format_rate(governor.rate_limit)}, "
+                      f"até {governor.max_host_connections} conexões por servidor"
+                      f"{' (adaptativo)' if governor.adaptive else ''}.")
+            except FileNotFoundError:
+                last_mtime = None
+            except (OSError, ValueError, TypeError, AttributeError, argparse.ArgumentTypeError) as e:
+                print(f"\n⚠️ Aviso: Arquivo de controle {path} ignorado: {e}")
+
+    threading.Thread(target=watch, name='arquivo-de-controle', daemon=True).start()
+    return stop_event
+
+class YtDlpDownloader:
+    """
+    Long-lived yt-dlp service shared by every video download of a run.
+
+    Each download thread gets its own YoutubeDL instance, created on its first video and
+    reused afterwards, because a YoutubeDL object cannot be used by several threads at once.
+    The extractor setup is therefore paid once per download worker, not once per lesson,
+    while lessons still reach the workers one at a time through the HostScheduler.
+    Cookies are copied in memory from the authenticated requests session into the instance's
+    cookie jar, and only when they changed, so no temporary cookie file is ever written.
+    Output template and headers are set per call, and so is the number of concurrent
+    fragments, which follows the adaptive connection limit of the video host, and the format
+    selection, which follows the run's VariantPolicy. A progress hook feeds the downloaded
+    bytes to the run-wide rate limit.
+    """
+
+    _BASE_OPTIONS = {
+        'nocheckcertificate': True,
+        'concurrent_fragment_downloads': DEFAULT_MAX_HOST_CONNECTIONS,
+        'retries': 10,
+        'fragment_retries': 10,
+        'quiet': True,
+        'progress': True,
+        'no_warnings': True,
+    }
+
+    def __init__(self, session: requests.Session):
+        self.session = session
+        self._local = threading.local()
+        self._instances = []
+        self._instances_lock = threading.Lock()
+        self._progress = {}
+        self._progress_lock = threading.Lock()
+        self._can_merge = shutil.which('ffmpeg') is not None
+
+    def _throttle_progress(self, status: Dict[str, Any]) -> None:
+        # 'downloaded_bytes' is a running total per file; only the growth since the last call is new
+        key = status.get('filename')
+        downloaded = status.get('downloaded_bytes') or 0
+        with self._progress_lock:
+            previous = self._progress.get(key, 0)
+            self._progress[key] = downloaded
+            if status.get('status') != 'downloading':
+                self._progress.pop(key, None)
+        transferred = downloaded - previous if downloaded >= previous else downloaded
+        throttle_transfer(transferred)
+        _metrics.add_bytes('video', transferred)
+
+    def _get_instance(self) -> YoutubeDL:
+        ydl = getattr(self._local, 'ydl', None)
+        if ydl is None:
+            from yt_dlp import YoutubeDL
+            from yt_dlp.utils.networking import HTTPHeaderDict
+
+            ydl = YoutubeDL(dict(self._BASE_OPTIONS))
+            ydl.add_progress_hook(self._throttle_progress)
+            self._local.ydl = ydl
+            self._local.base_headers = HTTPHeaderDict(ydl.params['http_headers'])
+            self._local.cookie_signature = None
+            self._local.format_spec = None
+            with self._instances_lock:
+                self._instances.append(ydl)
+        return ydl
+
+    def _sync_cookies(self, ydl: YoutubeDL) -> None:
+        cookies = list(self.session.cookies)
+        signature = tuple((c.domain, c.path, c.name, c.value) for c in cookies)
+        if signature == self._local.cookie_signature:
+            return
+        for cookie in cookies:
+            ydl.cookiejar.set_cookie(copy.copy(cookie))
+        self._local.cookie_signature = signature
+
+    def _prepare(self, video_url: str, http_headers: Optional[dict]) -> YoutubeDL:
+        from yt_dlp.utils.networking import HTTPHeaderDict
+
+        ydl = self._get_instance()
+        self._sync_cookies(ydl)
+        ydl.params['http_headers'] = HTTPHeaderDict(self._local.base_headers, http_headers or {})
+        ydl.params['concurrent_fragment_downloads'] = host_connection_limit(video_url, DEFAULT_MAX_HOST_CONNECTIONS)
+        policy = get_variant_policy()
+        format_spec = policy.ytdlp_format(can_merge=self._can_merge)
+        if format_spec != self._local.format_spec:
+            # YoutubeDL compiles 'format' into its format_selector once, when it is created
+            ydl.params['format'] = format_spec
+            ydl.format_selector = ydl.build_format_selector(format_spec) if format_spec else None
+            self._local.format_spec = format_spec
+        ydl.params['format_sort'] = policy.ytdlp_format_sort()
+        return ydl
+
+    def probe(self, video_url: str, http_headers: Optional[dict] = None) -> Tuple[Optional[int], Optional[float]]:
+        """
+        Estimates the size of a video from its yt-dlp metadata, without downloading it.
+
+        The formats picked are the ones download() would pick. Their exact or approximate
+        size is used when the extractor knows it, otherwise their bitrate times the duration.
+
+        Returns:
+            The estimated size in bytes and the duration in seconds, each None when unknown.
+        """
+        ydl = self._prepare(video_url, http_headers)
+        try:
+            info = ydl.extract_info(video_url, download=False)
+        except Exception as e:
+            print(f"-----> ⚠️ Não foi possível ler os metadados do vídeo: {e}")
+            return None, None
+        duration = info.get('duration')
+        size = 0
+        for selected_format in info.get('requested_formats') or [info]:
+            format_size = selected_format.get('filesize') or selected_format.get('filesize_approx')
+            if not format_size and selected_format.get('tbr') and duration:
+                format_size = selected_format['tbr'] * 1000 / 8 * duration
+            if not format_size:
+                return None, duration
+            size += int(format_size)
+        return size, duration
+
+    def download(self, video_url: str, lesson_path: pathlib.Path, video_title: str, http_headers: Optional[dict] = None) -> bool:
+        """
+        Downloads one video with the calling thread's YoutubeDL instance.
+
+        Args:
+            video_url: The URL of the video.
+            lesson_path: The folder where the video is saved.
+            video_title: The file name of the video, without extension.
+            http_headers: The extra headers required by the video host.
+
+        Returns:
+            True if the download finished, False otherwise.
+
+        The duration from the info dict is recorded in the manifest as the expected
+        duration of the saved file, for find_verified_video, along with whether a
+        truncated copy of it can be resumed.
+        """
+        ydl = self._prepare(video_url, http_headers)
+        ydl.params['outtmpl']['default'] = str(lesson_path / f'{video_title}.%(ext)s')
+        try:
+            with media_transfer_slot(), profile_stage('ytdlp'):
+                info = ydl.extract_info(video_url)
+            for requested_download in (info or {}).get('requested_downloads') or []:
+                if requested_download.get('filepath'):
+                    video_path = lesson_path / pathlib.Path(requested_download['filepath']).name
+                    # Only a single stream fetched over plain HTTP can be continued from its bytes;
+                    # fragmented (HLS/DASH) and merged downloads are rewritten from the start
+                    get_manifest().record_video(video_path, requested_download.get('duration') or info.get('duration'),
+                                                resumable=requested_download.get('protocol') in ('http', 'https'))
+            print("-----> ✅ Download concluído.")
+            return True
+        except Exception as e:
+            print(f"\n❌ Erro durante o download com yt-dlp: {e}")
+            throttled = re.search(r'HTTP Error (429|503)', str(e))
+            if throttled:
+                # yt-dlp gave up on a throttled host; let the download scheduler back off from it
+                record_transfer(video_url, status=int(throttled.group(1)))
+            return False
+
+    def close(self) -> None:
+        """Closes every YoutubeDL instance created by the service."""
+        with self._instances_lock:
+            for ydl in self._instances:
+                ydl.close()
+            self._instances.clear()
+
+_ytdlp_downloaders = {}
+_ytdlp_downloaders_lock = threading.Lock()
+
+def get_ytdlp_downloader(session: requests.Session) -> YtDlpDownloader:
+    """Returns the yt-dlp service of a session, creating it on first use."""
+    with _ytdlp_downloaders_lock:
+        downloader = _ytdlp_downloaders.get(id(session))
+        if downloader is None or downloader.session is not session:
+            downloader = YtDlpDownloader(session)
+            _ytdlp_downloaders[id(session)] = downloader
+        return downloader
+
+def close_ytdlp_downloaders() -> None:
+    """Closes the yt-dlp services of the current process, at the end of a run."""
+    with _ytdlp_downloaders_lock:
+        for downloader in _ytdlp_downloaders.values():
+            downloader.close()
+        _ytdlp_downloaders.clear()
+
+@instrumented('ytdlp_download')
+def download_video(video_url: str, lesson_path: pathlib.Path, video_title: str, session: requests.Session, http_headers: dict = None):
+    """
+    Downloads a video from any supported URL using yt-dlp, passing the correct referer.
+
+    The run-wide YtDlpDownloader of the session is reused, so yt-dlp and the cookie jar
+    are only set up once per download thread.
+    """
+    return get_ytdlp_downloader(session).download(video_url, lesson_path, video_title, http_headers)
+
+def lesson_video_files(lesson_path: pathlib.Path, video_title: str = 'Aula') -> List[pathlib.Path]:
+    """
+    Returns the finished video files of a lesson folder.
+
+    Partial files of an interrupted download ('Aula.mp4.part', 'Aula.mp4.ytdl', the hidden
+    '.Aula.ts.part' of the native HLS engine) and the separate formats yt-dlp saves before
+    merging them ('Aula.f137.mp4') never count.
+    """
+    return sorted(
+        path for path in lesson_path.glob(f"{video_title}.*")
+        if path.stem == video_title and path.suffix not in PARTIAL_FILE_SUFFIXES and path.is_file()
+    )
+
+def discard_video_files(lesson_path: pathlib.Path, video_title: str = 'Aula', keep: Optional[pathlib.Path] = None) -> None:
+    """Deletes the video files and download leftovers of a lesson, except 'keep'."""
+    for path in [*lesson_path.glob(f"{video_title}.*"), *lesson_path.glob(f".{video_title}.*")]:
+        if path != keep and path.is_file():
+            with contextlib.suppress(OSError):
+                path.unlink()
+            get_manifest().forget_video(path)
+
+def _mp4_boxes(f, start: int, end: int) -> Iterable[Tuple[bytes, int, int]]:
+    """
+    (Helper Function) Yields the type, payload offset and end offset of the MP4 boxes between two offsets.
+
+    Raises:
+        ValueError: If a box header is cut short or a box ends past 'end'.
+    """
+    offset = start
+    while offset < end:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            raise ValueError("cabeçalho MP4 incompleto no fim do arquivo")
+        box_size, box_type = struct.unpack('>I4s', header)
+        header_size = 8
+        if box_size == 1:
+            extended = f.read(8)
+            if len(extended) < 8:
+                raise ValueError("cabeçalho MP4 incompleto no fim do arquivo")
+            box_size, header_size = struct.unpack('>Q', extended)[0], 16
+        elif box_size == 0:
+            box_size = end - offset
+        if box_size < header_size or offset + box_size > end:
+            raise ValueError(f"a box '{box_type.decode('latin-1')}' termina depois do fim do arquivo")
+        yield box_type, offset + header_size, offset + box_size
+        offset += box_size
+
+def _mp4_movie_duration(f, start: int, end: int) -> Optional[float]:
+    """(Helper Function) Reads the duration of an MP4 'moov' box from its 'mvhd' or, for fragmented files, 'mehd'."""
+    timescale = duration = fragment_duration = None
+    for box_type, payload, box_end in _mp4_boxes(f, start, end):
+        if box_type == b'mvhd':
+            f.seek(payload)
+            data = f.read(32)
+            if data[0] == 1:
+                timescale, duration = struct.unpack('>IQ', data[20:32])
+            else:
+                timescale, duration = struct.unpack('>II', data[12:20])
+        elif box_type == b'mvex':
+            for child_type, child_payload, _ in _mp4_boxes(f, payload, box_end):
+                if child_type == b'mehd':
+                    f.seek(child_payload)
+                    data = f.read(12)
+                    fragment_duration = struct.unpack('>Q', data[4:12])[0] if data[0] == 1 else struct.unpack('>I', data[4:8])[0]
+    # Fragmented files keep a zero (or all-ones) duration in 'mvhd'
+    if duration in (0, 0xFFFFFFFF, 0xFFFFFFFFFFFFFFFF):
+        duration = fragment_duration
+    return duration / timescale if timescale and duration else None
+
+def _probe_mp4(f, file_size: int) -> Optional[float]:
+    """(Helper Function) Checks that the top-level MP4 boxes fill the file exactly and returns the movie duration."""
+    duration = None
+    has_movie = False
+    for box_type, payload, box_end in _mp4_boxes(f, 0, file_size):
+        if box_type == b'moov':
+            has_movie = True
+            duration = _mp4_movie_duration(f, payload, box_end)
+    if not has_movie:
+        raise ValueError("o arquivo MP4 não possui a box 'moov'")
+    return duration
+
+def _ts_presentation_times(data: bytes) -> Dict[int, List[int]]:
+    """(Helper Function) Returns the PES presentation timestamps (90 kHz) of the audio and video packets, per PID."""
+    timestamps = {}
+    for offset in range(0, len(data) - TS_PACKET_SIZE + 1, TS_PACKET_SIZE):
+        packet = data[offset:offset + TS_PACKET_SIZE]
+        adaptation_field = packet[3] >> 4 & 0x3
+        if not packet[1] & 0x40 or not adaptation_field & 0x1:
+            # Not the first packet of a PES, or a packet without payload
+            continue
+        pes_start = 4 + (1 + packet[4] if adaptation_field & 0x2 else 0)
+        pes = packet[pes_start:pes_start + 14]
+        if len(pes) < 14 or pes[:3] != b'\x00\x00\x01' or not 0xC0 <= pes[3] <= 0xEF or not pes[7] & 0x80:
+            continue
+        pts = (pes[9] >> 1 & 0x07) << 30 | pes[10] << 22 | (pes[11] >> 1) << 15 | pes[12] << 7 | pes[13] >> 1
+        timestamps.setdefault((packet[1] & 0x1F) << 8 | packet[2], []).append(pts)
+    return timestamps
+
+def _probe_mpeg_ts(f, file_size: int) -> Optional[float]:
+    """
+    (Helper Function) Checks the packets at both ends of an MPEG-TS file and returns its duration.
+
+    Only the first and last MEDIA_PROBE_BYTES are read. The duration is the span between
+    the first and last presentation timestamps of the longest audio or video stream.
+    """
+    if file_size % TS_PACKET_SIZE:
+        raise ValueError(f"o último pacote MPEG-TS está incompleto ({file_size % TS_PACKET_SIZE} de {TS_PACKET_SIZE} bytes)")
+    head = f.read(min(file_size, MEDIA_PROBE_BYTES))
+    f.seek(file_size - len(head))
+    tail = f.read()
+    for data in (head, tail):
+        if any(data[offset] != 0x47 for offset in range(0, len(data), TS_PACKET_SIZE)):
+            raise ValueError("pacote MPEG-TS sem o byte de sincronização")
+    first_times, last_times = _ts_presentation_times(head), _ts_presentation_times(tail)
+    spans = [
+        (last_times[pid][-1] - first_times[pid][0]) % (1 << 33) / 90000
+        for pid in first_times.keys() & last_times.keys()
+    ]
+    return max(spans) if spans else None
+
+def _read_ebml_size(data: bytes, offset: int) -> Tuple[Optional[int], int]:
+    """(Helper Function) Reads an EBML variable-size integer. Returns its value (None for 'unknown') and its length."""
+    first = data[offset]
+    if not first:
+        raise ValueError("tamanho EBML inválido")
+    length = 9 - first.bit_length()
+    value = first & (0xFF >> length)
+    for byte in data[offset + 1:offset + length]:
+        value = value << 8 | byte
+    return (None if value == (1 << 7 * length) - 1 else value), length
+
+def _probe_matroska(f, file_size: int) -> None:
+    """(Helper Function) Checks that the Segment of a Matroska/WebM file, when its size is written, fits in the file."""
+    data = f.read(256)
+    header_size, length = _read_ebml_size(data, 4)
+    segment = 4 + length + (header_size or 0)
+    if data[segment:segment + 4] != b'\x18\x53\x80\x67':
+        raise ValueError("o arquivo Matroska não possui o elemento 'Segment'")
+    segment_size, length = _read_ebml_size(data, segment + 4)
+    if segment_size is not None and segment + 4 + length + segment_size > file_size:
+        raise ValueError("o elemento 'Segment' do arquivo Matroska termina depois do fim do arquivo")
+    return None
+
+def probe_video_file(video_path: pathlib.Path) -> Optional[float]:
+    """
+    Checks the container of a video file from its headers, without decoding it.
+
+    The container is recognized by its content, since yt-dlp may save an MPEG-TS stream
+    under '.mp4': MP4 files must be a complete chain of boxes with a 'moov', MPEG-TS
+    files a whole number of packets with their sync bytes, and Matroska/WebM files must
+    hold their whole Segment. Other formats are not checked.
+
+    Returns:
+        The duration in seconds when the headers tell it, otherwise None.
+
+    Raises:
+        ValueError: If the file is empty, truncated or not the container it claims to be.
+    """
+    file_size = video_path.stat().st_size
+    if not file_size:
+        raise ValueError("o arquivo está vazio")
+    with open(video_path, 'rb') as f:
+        container = video_container(f.read(TS_PACKET_SIZE + 1))
+        f.seek(0)
+        try:
+            if container == 'mpegts':
+                return _probe_mpeg_ts(f, file_size)
+            if container == 'matroska':
+                return _probe_matroska(f, file_size)
+            if container == 'mp4':
+                return _probe_mp4(f, file_size)
+        except (struct.error, IndexError):
+            raise ValueError("cabeçalho do contêiner incompleto")
+    return None
+
+def video_container(head: bytes) -> Optional[str]:
+    """Recognizes the container of a video from its first TS_PACKET_SIZE + 1 bytes: 'mpegts', 'matroska', 'mp4' or None."""
+    if head[:1] == b'\x47' and (len(head) <= TS_PACKET_SIZE or head[TS_PACKET_SIZE] == 0x47):
+        return 'mpegts'
+    if head[:4] == b'\x1a\x45\xdf\xa3':
+        return 'matroska'
+    if head[4:8] in MP4_TOP_LEVEL_BOXES:
+        return 'mp4'
+    return None
+
+def mp4_has_faststart(video_path: pathlib.Path) -> bool:
+    """Checks whether the 'moov' box of an MP4 file comes before its media data, so players can start it before reading it all."""
+    with open(video_path, 'rb') as f:
+        for box_type, _, _ in _mp4_boxes(f, 0, video_path.stat().st_size):
+            if box_type == b'moov':
+                return True
+            if box_type == b'mdat':
+                return False
+    return True
+
+def video_mismatch(video_path: pathlib.Path, duration: Optional[float], expected: Optional[Dict[str, Any]]) -> Optional[str]:
+    """
+    Compares a video file with what the manifest expects of it.
+
+    Args:
+        video_path: The video file.
+        duration: Its duration, from probe_video_file.
+        expected: The 'duration' and 'size' the file should have (see DownloadManifest.get_video),
+            each ignored when unknown. The duration may differ by VIDEO_DURATION_TOLERANCE
+            seconds or VIDEO_DURATION_TOLERANCE_RATIO of it, whichever is larger.
+
+    Returns:
+        None if the file matches, otherwise a description of the difference.
+    """
+    expected = expected or {}
+    size = video_path.stat().st_size
+    if expected.get('size') and size != expected['size']:
+        return f"{size} bytes em vez de {expected['size']}"
+    if expected.get('duration') and duration is not None:
+        tolerance = max(VIDEO_DURATION_TOLERANCE, expected['duration'] * VIDEO_DURATION_TOLERANCE_RATIO)
+        if abs(duration - expected['duration']) > tolerance:
+            return f"duração de {format_duration(duration)} em vez de {format_duration(expected['duration'])}"
+    return None
+
+def find_verified_video(lesson_path: pathlib.Path, video_title: str = 'Aula', repair: bool = True) -> Optional[pathlib.Path]:
+    """
+    Returns the finished video of a lesson whose container and expected size and duration check out.
+
+    Args:
+        lesson_path: The folder of the lesson.
+        video_title: The file name of the video, without extension.
+        repair: Whether the files that fail are sent back to the downloaders. A truncated
+            file from a yt-dlp direct HTTP download (see DownloadManifest.record_video) is
+            renamed to its '.part' name, which yt-dlp resumes with a range request, unless
+            it is linked from other lessons. Any other file is deleted, since nothing would
+            resume it and its bytes may belong to another format.
+    """
+    manifest = get_manifest()
+    for video_path in lesson_video_files(lesson_path, video_title):
+        truncated = False
+        expected_video = manifest.get_video(video_path)
+        try:
+            problem = video_mismatch(video_path, probe_video_file(video_path), expected_video)
+        except (OSError, ValueError) as e:
+            problem, truncated = str(e), True
+        if problem is None:
+            return video_path
+        if not repair:
+            continue
+        print(f"-----> ⚠️ O vídeo {video_path.name} está incompleto ({problem}) e será baixado novamente.")
+        manifest.forget_video(video_path)
+        with contextlib.suppress(OSError):
+            if truncated and expected_video and expected_video['resumable'] and video_path.stat().st_nlink == 1:
+                os.replace(video_path, video_path.with_name(f"{video_path.name}.part"))
+            else:
+                video_path.unlink()
+    return None
+
+def is_encoded_response(response: requests.Response) -> bool:
+    """Returns True if the body of a response has a content encoding, such as gzip, that requests decodes."""
+    return response.headers.get('Content-Encoding', 'identity').strip().lower() not in ('', 'identity')
+
+def attachment_file_path(save_path: pathlib.Path, url: str, name: str) -> pathlib.Path:
+    """Returns the path where an attachment is saved, from its name and the extension of its URL."""
+    file_extension = pathlib.Path(urlparse(url).path).suffix or '.pdf'
+    return save_path / f"{sanitize_path_component(name)}{file_extension}"
+
+def is_attachment_complete(file_path: pathlib.Path) -> bool:
+    """
+    Checks whether an attachment was fully saved.
+
+    The file must exist and, when the manifest knows its size from a previous download,
+    have that exact size. Partial downloads live in '.part' files and never count.
+    """
+    if not file_path.is_file():
+        return False
+    record = get_manifest().get_file(file_path)
+    return record is None or record['size'] == file_path.stat().st_size
+
+@instrumented('attachment_download')
+def download_attachment(session: requests.Session, url: str, save_path: pathlib.Path, name: str) -> bool:
+    """
+    Downloads an attachment file. Returns True if the file was saved.
+
+    The file is written to a '.part' file first. An existing '.part' file left by an
+    interrupted run is resumed with an HTTP Range request, and a connection dropped
+    mid-transfer is resumed the same way. Once complete, the size is checked against
+    'Content-Length' before the file is atomically renamed into place. A file the server
+    did not vouch for in full (a resumed or refused range, or a body without a length) is
+    checked against the size and SHA-256 stored in the manifest instead, and a mismatch
+    starts it over from scratch; a full body that matches 'Content-Length' replaces the
+    stored record, so an attachment updated on the platform is saved again.
+
+    The body is requested without content encoding. A server that compresses it anyway
+    is never resumed with a Range request, and its 'Content-Length' is checked against
+    the encoded bytes received rather than the decoded file.
+
+    An attachment whose normalized URL was downloaded before, for another lesson or
+    course, is linked from the saved copy instead (see reuse_stored_content).
+    """
+    file_path = attachment_file_path(save_path, url, name)
+    content_key = attachment_content_key(url)
+    if reuse_stored_content(content_key, file_path.with_suffix(''), url):
+        print(f"      -> Anexo salvo: {file_path.name}")
+        return True
+
+    print(f"      -> Baixando anexo: {name}")
+    partial_path = file_path.with_name(f"{file_path.name}.part")
+    stored = get_manifest().get_file(file_path)
+
+    for attempt in range(1, ATTACHMENT_RETRIES + 1):
+        try:
+            with media_transfer_slot(), host_transfer_slot(url):
+                offset = partial_path.stat().st_size if partial_path.exists() else 0
+                headers = {'Accept-Encoding': 'identity', **({'Range': f"bytes={offset}-"} if offset else {})}
+                response = session.get(url, stream=True, headers=headers, timeout=ATTACHMENT_TIMEOUT)
+                total_size = response.headers.get('Content-Range', '').rpartition('/')[2]
+                if offset and ((response.status_code == 206 and is_encoded_response(response))
+                               or (response.status_code == 416 and not total_size.isdigit())):
+                    # An encoded range counts encoded bytes, which do not line up with the decoded
+                    # '.part', and a refused range without the total size tells nothing about it
+                    response.close()
+                    offset = 0
+                    response = session.get(url, stream=True, headers={'Accept-Encoding': 'identity'},
+                                            timeout=ATTACHMENT_TIMEOUT)
+                transferred = 0
+                # Whether the server vouched for the whole body, rather than for a range of it
+                validated = False
+
+                if response.status_code == 416 and offset:
+                    # Nothing left to fetch: the partial file may already hold the whole attachment
+                    expected_size = int(total_size)
+                else:
+                    if not response.ok:
+                        record_transfer(url, response)
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        offset = 0
+                    content_length = response.headers.get('Content-Length')
+                    expected_size = offset + int(content_length) if content_length and content_length.isdigit() else None
+                    validated = not offset and expected_size is not None
+
+                    with open(partial_path, 'ab' if offset else 'wb') as f:
+                        for chunk in response.iter_content(chunk_size=ATTACHMENT_CHUNK_SIZE):
+                            with profile_stage('file_write'):
+                                f.write(chunk)
+                            transferred += len(chunk)
+                            throttle_transfer(len(chunk))
+                    if is_encoded_response(response):
+                        # 'Content-Length' counts the encoded body, so it checks the bytes received
+                        # instead of the decoded file, whose size is only known from the manifest
+                        received = response.raw.tell()
+                        if expected_size is not None and received != expected_size:
+                            raise IOError(f"resposta compactada incompleta ({received} de {expected_size} bytes)")
+                        expected_size = None
+                record_transfer(url, response, transferred)
+                _metrics.add_bytes('attachment', transferred)
+                urllib3_retries = getattr(response.raw, 'retries', None)
+                if urllib3_retries and urllib3_retries.history:
+                    _metrics.add_retry('attachment_http', len(urllib3_retries.history))
+
+            if expected_size is None and stored and not validated:
+                expected_size = stored['size']
+            actual_size = partial_path.stat().st_size
+            if expected_size is not None and actual_size != expected_size:
+                if actual_size > expected_size:
+                    partial_path.unlink()
+                raise IOError(f"tamanho incorreto ({actual_size} de {expected_size} bytes)")
+
+            sha256 = hashlib.sha256()
+            with open(partial_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(ATTACHMENT_CHUNK_SIZE), b''):
+                    sha256.update(chunk)
+            if not validated and stored and stored['size'] == actual_size and stored['sha256'] and stored['sha256'] != sha256.hexdigest():
+                # Same size as before but different content, possibly a range of a newer version: start over
+                partial_path.unlink()
+                raise IOError("o conteúdo não confere com o hash salvo")
+
+            os.replace(partial_path, file_path)
+            get_manifest().record_file(file_path, url=url, size=actual_size, sha256=sha256.hexdigest())
+            store_content(content_key, file_path, url, sha256.hexdigest())
+            print(f"      -> Anexo salvo: {file_path.name}")
+            return True
+
+        except (requests.exceptions.RequestException, IOError) as e:
+            if isinstance(e, requests.exceptions.RequestException) and not isinstance(e, requests.exceptions.HTTPError):
+                record_transfer(url, error=True)
+            if attempt == ATTACHMENT_RETRIES:
+                print(f"      -> ❌ Falha ao baixar o anexo {name}: {e}")
+                return False
+            print(f"      -> ⚠️ Falha ao baixar o anexo {name} ({e}), retomando...")
+            _metrics.add_retry('attachment_download')
+            time.sleep(min(2 ** attempt, 10))
+    return False
+
+def probe_attachment_size(session: requests.Session, url: str) -> Optional[int]:
+    """
+    Returns the size of an attachment without downloading it, or None when the server does not tell.
+
+    A HEAD request is tried first. Servers that do not answer HEAD, or answer it without a
+    'Content-Length', get a one-byte range request whose 'Content-Range' holds the full size.
+    """
+    try:
+        with host_transfer_slot(url):
+            response = session.head(url, allow_redirects=True, headers={'Accept-Encoding': 'identity'},
+                                    timeout=ATTACHMENT_TIMEOUT)
+            if response.ok and response.headers.get('Content-Length', '').isdigit() and not is_encoded_response(response):
+                return int(response.headers['Content-Length'])
+            with session.get(url, headers={'Range': 'bytes=0-0', 'Accept-Encoding': 'identity'}, stream=True,
+                             timeout=ATTACHMENT_TIMEOUT) as response:
+                if is_encoded_response(response):
+                    return None
+                content_range = response.headers.get('Content-Range', '')
+                if response.status_code == 206 and content_range.rsplit('/', 1)[-1].isdigit():
+                    return int(content_range.rsplit('/', 1)[-1])
+                if response.ok and response.headers.get('Content-Length', '').isdigit():
+                    return int(response.headers['Content-Length'])
+    except requests.exceptions.RequestException as e:
+        print(f"      -> ⚠️ Não foi possível consultar o tamanho de {url}: {e}")
+    return None
+
+class AttachmentDownloader:
+    """
+    Shared downloader that fetches the attachments of every lesson in parallel.
+
+    Transfers use a session that shares the cookies and headers of the authenticated one,
+    with a connection pool per host and automatic retries, with exponential backoff, on
+    5xx answers and connection resets. At most 'host_connections' attachments are
+    fetched from the same host at once, and at most 'workers' in total.
+    """
+
+    def __init__(self, session: requests.Session, workers: int = DEFAULT_ATTACHMENT_WORKERS, host_connections: int = DEFAULT_ATTACHMENT_HOST_CONNECTIONS):
+        self.session = session
+        self.host_connections = max(1, host_connections)
+        self.transfer_session = requests.Session()
+        self.transfer_session.headers.update(session.headers)
+        self.transfer_session.cookies = session.cookies
+        self.transfer_session.hooks = session.hooks
+        retry = requests.adapters.Retry(
+            total=5, connect=5, read=5, status=5,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset({'GET', 'HEAD'}),
+            raise_on_status=False,
+        )
+        adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=self.host_connections, max_retries=retry)
+        self.transfer_session.mount('http://', adapter)
+        self.transfer_session.mount('https://', adapter)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='anexos')
+        self._host_slots = {}
+        self._host_slots_lock = threading.Lock()
+
+    def _host_slot(self, url: str) -> threading.BoundedSemaphore:
+        host = urlparse(url).netloc
+        with self._host_slots_lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.host_connections)
+            return self._host_slots[host]
+
+    def _download(self, url: str, save_path: pathlib.Path, name: str) -> bool:
+        with self._host_slot(url):
+            return download_attachment(self.transfer_session, url, save_path, name)
+
+    def submit(self, url: str, save_path: pathlib.Path, name: str) -> concurrent.futures.Future:
+        """Queues one attachment; the future resolves to download_attachment's result."""
+        return self._executor.submit(self._download, url, save_path, name)
+
+    def download_all(self, attachments: List[Dict[str, str]], save_path: pathlib.Path) -> List[bool]:
+        """
+        Downloads a list of attachments in parallel and waits for all of them.
+
+        Args:
+            attachments: The attachments as returned by get_lesson_content ('name' and 'url').
+            save_path: The folder where the attachments are saved.
+
+        Returns:
+            One result per attachment, in the same order.
+        """
+        futures = [self.submit(attachment['url'], save_path, attachment['name']) for attachment in attachments]
+        return [future.result() for future in futures]
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        self.transfer_session.close()
+
+_attachment_downloaders = {}
+_attachment_downloaders_lock = threading.Lock()
+_attachment_settings = {'workers': DEFAULT_ATTACHMENT_WORKERS, 'host_connections': DEFAULT_ATTACHMENT_HOST_CONNECTIONS}
+
+def configure_attachment_downloads(workers: int, host_connections: int) -> None:
+    """Sets the parallelism of the attachment downloaders created in the current process."""
+    _attachment_settings.update(workers=workers, host_connections=host_connections)
+
+def get_attachment_downloader(session: requests.Session) -> AttachmentDownloader:
+    """Returns the attachment downloader of a session, creating it on first use."""
+    with _attachment_downloaders_lock:
+        downloader = _attachment_downloaders.get(id(session))
+        if downloader is None or downloader.session is not session:
+            downloader = AttachmentDownloader(session, **_attachment_settings)
+            _attachment_downloaders[id(session)] = downloader
+        return downloader
+
+def close_download_services() -> None:
+    """Closes the yt-dlp and attachment downloaders and the post-processing pool of the current process, at the end of a run."""
+    close_postprocessor()
+    close_ytdlp_downloaders()
+    with _attachment_downloaders_lock:
+        for downloader in _attachment_downloaders.values():
+            downloader.close()
+        _attachment_downloaders.clear()
+
+class DownloadManifest:
+    """
+    Persistent record of every lesson seen by the downloader, stored in a SQLite database.
+
+    Lessons are keyed by course URL and lesson 'data-aulaid'. Each row keeps the resolved
+    player URL, the attachment list, the size of every saved file and whether the lesson
+    was fully downloaded, so finished lessons can be skipped without any request. Players
+    that need a request to resolve (Hotmart) keep their resolved URL until it expires.
+
+    The 'files' and 'content_keys' tables also make up the content-addressed store: every
+    saved file is a reference to its SHA-256, and normalized URLs and video ids point to
+    the SHA-256 they downloaded, so a file seen before is linked instead of downloaded.
+    The 'videos' table keeps the expected duration and size of every video file.
+    """
+
+    def __init__(self, path: pathlib.Path = MANIFEST_PATH):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(path), timeout=30, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS lessons (
+                    course_url TEXT NOT NULL,
+                    lesson_id TEXT NOT NULL,
+                    lesson_url TEXT,
+                    lesson_path TEXT,
+                    player_url TEXT,
+                    video_url TEXT,
+                    attachments TEXT,
+                    file_sizes TEXT,
+                    completed INTEGER NOT NULL DEFAULT 0,
+                    updated_at REAL,
+                    PRIMARY KEY (course_url, lesson_id)
+                )
+            """)
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    url TEXT,
+                    size INTEGER NOT NULL,
+                    sha256 TEXT,
+                    updated_at REAL
+                )
+            """)
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS course_snapshots (
+                    course_url TEXT PRIMARY KEY,
+                    structure TEXT NOT NULL,
+                    updated_at REAL
+                )
+            """)
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS resolved_players (
+                    player_url TEXT PRIMARY KEY,
+                    video_url TEXT NOT NULL,
+                    headers TEXT,
+                    expires_at REAL NOT NULL,
+                    updated_at REAL
+                )
+            """)
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS content_keys (
+                    key TEXT PRIMARY KEY,
+                    sha256 TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    suffix TEXT,
+                    updated_at REAL
+                )
+            """)
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS videos (
+                    path TEXT PRIMARY KEY,
+                    duration REAL,
+                    size INTEGER,
+                    resumable INTEGER,
+                    updated_at REAL
+                )
+            """)
+            # Manifests written before videos had a 'resumable' column
+            if 'resumable' not in {row[1] for row in self._connection.execute("PRAGMA table_info(videos)")}:
+                self._connection.execute("ALTER TABLE videos ADD COLUMN resumable INTEGER")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256)")
+
+    _JSON_COLUMNS = ('attachments', 'file_sizes')
+    _COLUMNS = ('lesson_url', 'lesson_path', 'player_url', 'video_url', 'attachments', 'file_sizes', 'completed')
+
+    def get_lesson(self, course_url: str, lesson_id: str) -> Optional[Dict[str, Any]]:
+        """Returns the manifest entry of a lesson, or None if it was never recorded."""
+        with self._lock:
+            cursor = self._connection.execute(
+                f"SELECT {', '.join(self._COLUMNS)} FROM lessons WHERE course_url = ? AND lesson_id = ?",
+                (course_url, lesson_id),
+            )
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        entry = dict(zip(self._COLUMNS, row))
+        for column in self._JSON_COLUMNS:
+            entry[column] = json.loads(entry[column]) if entry[column] else None
+        entry['completed'] = bool(entry['completed'])
+        return entry
+
+    def update_lesson(self, course_url: str, lesson_id: str, **fields: Any) -> None:
+        """
+        Creates or updates the manifest entry of a lesson.
+
+        Args:
+            course_url: The URL of the course page.
+            lesson_id: The lesson 'data-aulaid' (or its URL when the id is missing).
+            **fields: The columns to set, any of DownloadManifest._COLUMNS.
+        """
+        values = {}
+        for column, value in fields.items():
+            if column not in self._COLUMNS:
+                raise ValueError(f"Unknown manifest column: {column}")
+            if column in self._JSON_COLUMNS and value is not None:
+                value = json.dumps(value, ensure_ascii=False)
+            elif isinstance(value, pathlib.Path):
+                value = str(value)
+            values[column] = value
+        values['updated_at'] = time.time()
+
+        columns = ', '.join(values)
+        placeholders = ', '.join('?' for _ in values)
+        updates = ', '.join(f"{column} = excluded.{column}" for column in values)
+        with self._lock, self._connection:
+            self._connection.execute(
+                f"INSERT INTO lessons (course_url, lesson_id, {columns}) VALUES (?, ?, {placeholders}) "
+                f"ON CONFLICT (course_url, lesson_id) DO UPDATE SET {updates}",
+                (course_url, lesson_id, *values.values()),
+            )
+
+    def is_lesson_complete(self, course_url: str, lesson_id: str, lesson_path: pathlib.Path) -> bool:
+        """
+        Checks whether a lesson was fully downloaded and its files are still on disk.
+
+        Only file sizes are compared, so the check never touches the network.
+        """
+        entry = self.get_lesson(course_url, lesson_id)
+        if not entry or not entry['completed']:
+            return False
+        for file_name, size in (entry['file_sizes'] or {}).items():
+            file_path = lesson_path / file_name
+            if not file_path.is_file() or file_path.stat().st_size != size:
+                return False
+        return True
+
+    def get_file(self, file_path: pathlib.Path) -> Optional[Dict[str, Any]]:
+        """Returns the recorded URL, size and SHA-256 of a downloaded file, if any."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT url, size, sha256 FROM files WHERE path = ?", (str(file_path),)
+            ).fetchone()
+        return dict(zip(('url', 'size', 'sha256'), row)) if row else None
+
+    def record_file(self, file_path: pathlib.Path, url: Optional[str], size: int, sha256: Optional[str]) -> None:
+        """Records the size and SHA-256 of a fully downloaded file."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO files (path, url, size, sha256, updated_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (path) DO UPDATE SET url = excluded.url, size = excluded.size, "
+                "sha256 = excluded.sha256, updated_at = excluded.updated_at",
+                (str(file_path), url, size, sha256, time.time()),
+            )
+
+    def get_video(self, video_path: pathlib.Path) -> Optional[Dict[str, Any]]:
+        """
+        Returns the expected duration (seconds) and size (bytes) recorded for a video file, if any,
+        and whether a truncated copy of it can be resumed ('resumable').
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT duration, size, resumable FROM videos WHERE path = ?", (str(video_path),)
+            ).fetchone()
+        return dict(zip(('duration', 'size', 'resumable'), row)) if row else None
+
+    def record_video(self, video_path: pathlib.Path, duration: Optional[float] = None, size: Optional[int] = None,
+                     resumable: Optional[bool] = None) -> None:
+        """
+        Records the duration and size a video file is expected to have, each None when unknown.
+
+        'resumable' tells whether the file is the single stream of a yt-dlp direct HTTP
+        download, which yt-dlp continues with a range request from its '.part' name.
+        None keeps what was recorded before.
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO videos (path, duration, size, resumable, updated_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (path) DO UPDATE SET duration = excluded.duration, size = excluded.size, "
+                "resumable = COALESCE(excluded.resumable, videos.resumable), updated_at = excluded.updated_at",
+                (str(video_path), duration, size, resumable, time.time()),
+            )
+
+    def forget_video(self, video_path: pathlib.Path) -> None:
+        """Removes the expectations of a video file that is downloaded again."""
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM videos WHERE path = ?", (str(video_path),))
+
+    def get_course_snapshot(self, course_url: str) -> Optional[dict]:
+        """Returns the course structure saved by the previous run, if any."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT structure FROM course_snapshots WHERE course_url = ?", (course_url,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_course_snapshot(self, course_url: str, course_structure: dict) -> None:
+        """Saves the course structure so the next sync can tell what changed."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO course_snapshots (course_url, structure, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (course_url) DO UPDATE SET structure = excluded.structure, updated_at = excluded.updated_at",
+                (course_url, json.dumps(course_structure, ensure_ascii=False), time.time()),
+            )
+
+    def course_summaries(self) -> List[Dict[str, Any]]:
+        """
+        Summarizes every course recorded in the manifest, for the 'status' command.
+
+        Returns:
+            One dictionary per course, ordered by title, with its 'url', 'title', 'lessons'
+            (from the saved structure, or the recorded lessons when there is none), 'completed'
+            lessons, saved 'bytes' and the time it was last 'updated_at'.
+        """
+        with self._lock:
+            snapshots = self._connection.execute("SELECT course_url, structure, updated_at FROM course_snapshots").fetchall()
+            lessons = self._connection.execute("SELECT course_url, completed, file_sizes, updated_at FROM lessons").fetchall()
+        courses = {}
+        for course_url, structure, updated_at in snapshots:
+            structure = json.loads(structure)
+            courses[course_url] = {
+                'url': course_url,
+                'title': structure.get('course_title') or course_url,
+                'lessons': sum(len(module.get('lessons', [])) for module in structure.get('modules', [])),
+                'completed': 0,
+                'bytes': 0,
+                'updated_at': updated_at or 0,
+            }
+        for course_url, completed, file_sizes, updated_at in lessons:
+            summary = courses.get(course_url)
+            if summary is None:
+                summary = courses[course_url] = {
+                    'url': course_url, 'title': course_url, 'lessons': 0, 'completed': 0, 'bytes': 0, 'updated_at': 0,
+                }
+            summary['completed'] += bool(completed)
+            summary['bytes'] += sum((json.loads(file_sizes) if file_sizes else {}).values())
+            summary['updated_at'] = max(summary['updated_at'], updated_at or 0)
+        for summary in courses.values():
+            # Courses downloaded before snapshots were saved only know their recorded lessons
+            summary['lessons'] = max(summary['lessons'], summary['completed'])
+        return sorted(courses.values(), key=lambda summary: summary['title'])
+
+    def get_resolved_player(self, player_url: str) -> Optional[Dict[str, Any]]:
+        """Returns the cached video URL, headers and expiry of a player, unless it expires within RESOLVED_URL_EXPIRY_MARGIN."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT video_url, headers, expires_at FROM resolved_players WHERE player_url = ? AND expires_at > ?",
+                (player_url, time.time() + RESOLVED_URL_EXPIRY_MARGIN),
+            ).fetchone()
+        if row is None:
+            return None
+        return {'video_url': row[0], 'headers': json.loads(row[1]) if row[1] else None, 'expires_at': row[2]}
+
+    def save_resolved_player(self, player_url: str, video_url: str, headers: Optional[dict], expires_at: float) -> None:
+        """Caches the video URL a player resolved to, until 'expires_at' (a Unix timestamp)."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO resolved_players (player_url, video_url, headers, expires_at, updated_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (player_url) DO UPDATE SET video_url = excluded.video_url, headers = excluded.headers, "
+                "expires_at = excluded.expires_at, updated_at = excluded.updated_at",
+                (player_url, video_url, json.dumps(headers) if headers else None, expires_at, time.time()),
+            )
+
+    def forget_resolved_player(self, player_url: str) -> None:
+        """Drops the cached resolution of a player, so the next lookup resolves it again."""
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM resolved_players WHERE player_url = ?", (player_url,))
+
+    def get_content(self, key: str) -> Optional[Dict[str, Any]]:
+        """Returns the SHA-256, size and file suffix of the content known by a key (normalized URL or video id)."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT sha256, size, suffix FROM content_keys WHERE key = ?", (key,)
+            ).fetchone()
+        return dict(zip(('sha256', 'size', 'suffix'), row)) if row else None
+
+    def save_content(self, key: str, sha256: str, size: int, suffix: str) -> None:
+        """Records which content a key (normalized URL or video id) points to."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO content_keys (key, sha256, size, suffix, updated_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET sha256 = excluded.sha256, size = excluded.size, "
+                "suffix = excluded.suffix, updated_at = excluded.updated_at",
+                (key, sha256, size, suffix, time.time()),
+            )
+
+    def get_file_references(self, sha256: str) -> List[pathlib.Path]:
+        """Returns every saved file recorded with a SHA-256, in the order they were recorded."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT path FROM files WHERE sha256 = ? ORDER BY updated_at", (sha256,)
+            ).fetchall()
+        return [pathlib.Path(row[0]) for row in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+_manifest = None
+_manifest_pid = None
+
+def get_manifest() -> DownloadManifest:
+    """Returns the download manifest of the current process, opening it on first use."""
+    global _manifest, _manifest_pid
+    # SQLite connections must not be shared across forked worker processes
+    if _manifest is None or _manifest_pid != os.getpid():
+        _manifest = DownloadManifest()
+        _manifest_pid = os.getpid()
+    return _manifest
+
+def normalize_media_url(url: str) -> str:
+    """
+    Returns the URL without what changes between two requests for the same file.
+
+    The scheme and host are lowercased, the fragment is dropped, and signing and tracking
+    query parameters (VOLATILE_QUERY_PARAMETERS) are removed. The other parameters are sorted.
+    """
+    parsed_url = urlparse(url)
+    query = sorted(
+        (key, value) for key, values in parse_qs(parsed_url.query, keep_blank_values=True).items()
+        if key.lower() not in VOLATILE_QUERY_PARAMETERS for value in values
+    )
+    return urlunparse((
+        parsed_url.scheme.lower(), parsed_url.netloc.lower(), parsed_url.path, '',
+        '&'.join(f"{key}={value}" for key, value in query), '',
+    ))
+
+def attachment_content_key(url: str) -> str:
+    """Returns the content-addressed store key of an attachment URL."""
+    return f"url:{normalize_media_url(url)}"
+
+def video_content_key(player_url: str) -> str:
+    """
+    Returns the content-addressed store key of a lesson video.
+
+    Panda videos are keyed by their video id, whatever embed host or lesson they appear in,
+    and every key includes the VariantPolicy, since another policy saves another rendition.
+    """
+    if player_type(player_url) == 'panda':
+        video_id = parse_qs(urlparse(player_url).query).get('v', [None])[0]
+        if video_id:
+            return f"panda:{video_id}:{get_variant_policy().cache_key()}"
+    return f"player:{normalize_media_url(player_url)}:{get_variant_policy().cache_key()}"
+
+def configure_deduplication(method: str) -> None:
+    """Sets how duplicated files are placed into lesson folders, one of DEDUPE_METHODS."""
+    global _dedupe_method
+    _dedupe_method = method
+
+def file_sha256(path: pathlib.Path) -> str:
+    """Returns the SHA-256 of a file, read in ATTACHMENT_CHUNK_SIZE chunks."""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(ATTACHMENT_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def _reflink(source: pathlib.Path, target: pathlib.Path) -> None:
+    """(Helper Function) Clones a file with the Linux FICLONE ioctl (Btrfs, XFS, bcachefs), sharing its blocks."""
+    import fcntl
+    ficlone = 0x40049409
+    with open(source, 'rb') as source_file, open(target, 'wb') as target_file:
+        fcntl.ioctl(target_file.fileno(), ficlone, source_file.fileno())
+
+def link_file(source: pathlib.Path, target: pathlib.Path, method: str = 'auto', allow_copy: bool = True) -> str:
+    """
+    Places a copy of 'source' at 'target' without storing the content twice when possible.
+
+    Args:
+        source: An existing file.
+        target: The path to create or replace.
+        method: 'hardlink', 'reflink', 'copy' or 'auto', which tries them in that order.
+            Hardlinks fail across drives and on some file systems (FAT/exFAT), and reflinks
+            need a copy-on-write file system.
+        allow_copy: Whether 'auto' may fall back to a plain copy.
+
+    Returns:
+        The method that worked.
+
+    Raises:
+        OSError: If no method could create the file.
+    """
+    methods = ('hardlink', 'reflink', 'copy') if method == 'auto' else (method,)
+    if not allow_copy:
+        methods = tuple(candidate for candidate in methods if candidate != 'copy')
+    temporary_path = target.with_name(f".{target.name}.{os.getpid()}.{threading.get_ident()}.link")
+    last_error = None
+    for candidate in methods:
+        try:
+            if candidate == 'hardlink':
+                os.link(source, temporary_path)
+            elif candidate == 'reflink':
+                _reflink(source, temporary_path)
+            else:
+                shutil.copy2(source, temporary_path)
+            os.replace(temporary_path, target)
+            return candidate
+        except (OSError, ImportError) as e:
+            last_error = e
+            with contextlib.suppress(OSError):
+                temporary_path.unlink()
+    raise OSError(f"não foi possível criar {target}: {last_error}")
+
+def _stored_source(sha256: str, size: int, exclude: Optional[pathlib.Path] = None) -> Optional[pathlib.Path]:
+    """(Helper Function) Returns a saved file that still holds a content, checked by its size."""
+    for path in get_manifest().get_file_references(sha256):
+        if path != exclude and path.is_file() and path.stat().st_size == size:
+            return path
+    return None
+
+def has_stored_content(key: str) -> bool:
+    """Checks whether the content of a key is already saved somewhere and can be linked."""
+    if _dedupe_method == 'off':
+        return False
+    content = get_manifest().get_content(key)
+    return bool(content and _stored_source(content['sha256'], content['size']))
+
+def reuse_stored_content(key: str, target_stem: pathlib.Path, url: Optional[str] = None) -> Optional[pathlib.Path]:
+    """
+    Links the content of a key into place, if it was saved before.
+
+    Args:
+        key: The store key (see attachment_content_key and video_content_key).
+        target_stem: The path to create, without the file suffix, which comes from the store.
+        url: The URL recorded for the new reference.
+
+    Returns:
+        The created file, or None when the content is unknown or no saved copy is left.
+    """
+    if _dedupe_method == 'off':
+        return None
+    content = get_manifest().get_content(key)
+    if not content:
+        return None
+    source = _stored_source(content['sha256'], content['size'])
+    if source is None:
+        return None
+    target = target_stem.with_name(target_stem.name + (content['suffix'] or ''))
+    if source.resolve() == target.resolve():
+        return target
+    try:
+        method = link_file(source, target, _dedupe_method)
+    except OSError as e:
+        print(f"      -> ⚠️ Não foi possível reaproveitar {source}: {e}")
+        return None
+    get_manifest().record_file(target, url=url, size=content['size'], sha256=content['sha256'])
+    expected_video = get_manifest().get_video(source)
+    if expected_video:
+        get_manifest().record_video(target, expected_video['duration'], expected_video['size'])
+    _metrics.add_bytes('deduplicated', content['size'])
+    print(f"      -> ♻️ Reaproveitado ({method}) de {source}")
+    return target
+
+def store_content(key: str, file_path: pathlib.Path, url: Optional[str] = None, sha256: Optional[str] = None) -> None:
+    """
+    Records a downloaded file in the content-addressed store under 'key'.
+
+    When the same content was already saved under another name, a different URL or
+    another video id, the new file is replaced by a link to the saved one, so the disk
+    holds a single copy.
+    """
+    if _dedupe_method == 'off':
+        return
+    size = file_path.stat().st_size
+    sha256 = sha256 or file_sha256(file_path)
+    manifest = get_manifest()
+    manifest.record_file(file_path, url=url, size=size, sha256=sha256)
+    manifest.save_content(key, sha256, size, file_path.suffix)
+
+    source = _stored_source(sha256, size, exclude=file_path)
+    if source is not None and _dedupe_method != 'copy' and not os.path.samefile(source, file_path):
+        # Copying over a file that was just downloaded would not save anything
+        with contextlib.suppress(OSError):
+            link_file(source, file_path, _dedupe_method, allow_copy=False)
+            _metrics.add_bytes('deduplicated_on_disk', size)
+
+def record_lesson_files(lesson_path: pathlib.Path) -> Dict[str, int]:
+    """Returns the size of every finished file saved in a lesson folder."""
+    return {
+        file_path.name: file_path.stat().st_size
+        for file_path in lesson_path.iterdir()
+        if file_path.is_file() and file_path.suffix not in PARTIAL_FILE_SUFFIXES and not file_path.name.startswith('.')
+    }
+
+def sanitize_path_component(name: str) -> str:
+    """Removes the characters that are not allowed in file and folder names."""
+    return re.sub(r'[\\/*?:"<>|]', "", name).strip()
+
+class HostScheduler:
+    """
+    A pipeline queue that hands out items by origin host instead of in arrival order.
+
+    Items wait in one FIFO queue per host, given by 'host_of'. A worker asking for an item
+    gets the oldest item of the host with the fewest running items, among the hosts below
+    'host_limit' and not in backoff (see HostConcurrencyController.backoff_remaining). A
+    throttled or slow CDN therefore only holds back its own lessons while the other hosts
+    keep every worker busy. Items of the empty host '' (nothing to download from a CDN) are
+    never limited. Each host queue holds at most 'maxsize' items, so 'put' only blocks the
+    producers of a host that is already full.
+
+    It has the 'put' and 'get' of queue.Queue, plus 'finish', which run_pipeline calls once
+    the stage is done with an item to free its host slot. 'host_of' is called outside the
+    scheduler's lock, so a slow lookup only delays the producer that asked for it.
+    """
+
+    def __init__(self, host_of: Callable[[Any], str], host_limit: int, maxsize: int = DEFAULT_QUEUE_SIZE):
+        self._host_of = host_of
+        self.host_limit = max(1, host_limit)
+        self.maxsize = max(1, maxsize)
+        self._queues = {}
+        self._active = {}
+        self._running = {}
+        self._sentinels = 0
+        self._sequence = 0
+        self._condition = threading.Condition()
+
+    def put(self, item: Any) -> None:
+        # 'host_of' may probe the network (see download_host), so it runs before taking the lock
+        host = None if item is _PIPELINE_SENTINEL else self._host_of(item)
+        with self._condition:
+            if item is _PIPELINE_SENTINEL:
+                self._sentinels += 1
+            else:
+                pending = self._queues.setdefault(host, collections.deque())
+                while len(pending) >= self.maxsize:
+                    self._condition.wait()
+                self._sequence += 1
+                pending.append((self._sequence, item))
+            self._condition.notify_all()
+
+    def _pick_host(self) -> Tuple[Optional[str], float]:
+        """(Helper Function) Returns the host to serve next, or None and how long to wait before looking again."""
+        best_rank, best_host, wait = None, None, 1.0
+        for host, pending in self._queues.items():
+            if not pending:
+                continue
+            active = self._active.get(host, 0)
+            if host and active >= self.host_limit:
+                continue
+            backoff = host_backoff_remaining(host) if host else 0.0
+            if backoff > 0:
+                wait = min(wait, backoff)
+                continue
+            rank = (active, pending[0][0])
+            if best_rank is None or rank < best_rank:
+                best_rank, best_host = rank, host
+        return best_host, wait
+
+    def get(self) -> Any:
+        with self._condition:
+            while True:
+                host, wait = self._pick_host()
+                if host is not None:
+                    _, item = self._queues[host].popleft()
+                    self._active[host] = self._active.get(host, 0) + 1
+                    self._running[id(item)] = host
+                    self._condition.notify_all()
+                    return item
+                if self._sentinels and not any(self._queues.values()):
+                    self._sentinels -= 1
+                    return _PIPELINE_SENTINEL
+                self._condition.wait(timeout=wait)
+
+    def finish(self, item: Any) -> None:
+        """Frees the host slot taken by an item handed out by 'get'."""
+        with self._condition:
+            host = self._running.pop(id(item), None)
+            if host is not None:
+                self._active[host] -= 1
+            self._condition.notify_all()
+
+def download_host(job: Dict[str, Any]) -> str:
+    """
+    Returns the origin host of the resolved video of a lesson job, or '' when no video is left to download.
+
+    Panda videos are downloaded from the best ranked CDN host at download time, whatever
+    host they were resolved with, so that host is the one returned.
+    """
+    if not job.get('video_url'):
+        return ''
+    player_url = (job.get('content') or {}).get('player_url') or ''
+    if 'pandavideo' in player_url:
+        return get_panda_endpoints().ranked_hosts(player_url, job['lesson']['url'])[0]
+    return urlparse(job['video_url']).netloc
+
+def run_pipeline(items: Iterable[Any], stages: List[Tuple], queue_size: int = DEFAULT_QUEUE_SIZE) -> List[Any]:
+    """
+    Runs items through a sequence of stages, each one backed by its own pool of worker threads.
+
+    Stages are connected by bounded queues, so a slow stage holds back the ones before it
+    instead of letting work pile up in memory. A stage function receives an item and returns
+    the item to hand over to the next stage, or None to drop it.
+
+    Args:
+        items: The work items fed into the first stage.
+        stages: A list of (function, worker_count) tuples, in execution order. A third
+            element replaces the FIFO queue in front of the stage with a HostScheduler.
+        queue_size: The maximum number of items waiting in front of each stage.
+
+    Returns:
+        The items returned by the last stage, in completion order.
+    """
+    queues = [stage[2] if len(stage) > 2 else queue.Queue(maxsize=max(1, queue_size)) for stage in stages]
+    stages = [(stage[0], max(1, stage[1])) for stage in stages]
+    remaining_workers = [worker_count for _, worker_count in stages]
+    counters_lock = threading.Lock()
+    results = []
+
+    def worker(stage_index: int) -> None:
+        stage_function = stages[stage_index][0]
+        is_last_stage = stage_index == len(stages) - 1
+        while True:
+            item = queues[stage_index].get()
+            if item is _PIPELINE_SENTINEL:
+                break
+            try:
+                output = stage_function(item)
+            except Exception as e:
+                print(f"❌ Erro inesperado durante o processamento: {e}")
+                output = None
+            finally:
+                if isinstance(queues[stage_index], HostScheduler):
+                    queues[stage_index].finish(item)
+            if output is None:
+                continue
+            if is_last_stage:
+                with counters_lock:
+                    results.append(output)
+            else:
+                queues[stage_index + 1].put(output)
+
+        # The last worker leaving a stage tells every worker of the next stage to stop
+        with counters_lock:
+            remaining_workers[stage_index] -= 1
+            stage_finished = remaining_workers[stage_index] == 0
+        if stage_finished and not is_last_stage:
+            for _ in range(stages[stage_index + 1][1]):
+                queues[stage_index + 1].put(_PIPELINE_SENTINEL)
+
+    threads = []
+    for stage_index, (_, worker_count) in enumerate(stages):
+        for _ in range(worker_count):
+            thread = threading.Thread(target=worker, args=(stage_index,), daemon=True)
+            thread.start()
+            threads.append(thread)
+
+    for item in items:
+        queues[0].put(item)
+    for _ in range(stages[0][1]):
+        queues[0].put(_PIPELINE_SENTINEL)
+
+    for thread in threads:
+        # Joining with a timeout keeps the main thread responsive to Ctrl+C
+        while thread.is_alive():
+            thread.join(0.5)
+
+    return results
+
+def build_lesson_jobs(course_structure: dict, download_path: pathlib.Path, course_url: str) -> List[Dict[str, Any]]:
+    """
+    Creates the folder layout of a course and returns one job per lesson.
+
+    Args:
+        course_structure: The course structure returned by get_course_details.
+        download_path: The folder where the course is saved.
+        course_url: The URL of the course page.
+
+    Returns:
+        A list of job dictionaries, in course order, each one describing a lesson
+        and the folder ('NN. Module/NNN. Lesson') where its files are saved.
+    """
+    jobs = []
+    for m_idx, module in enumerate(course_structure['modules'], 1):
+        module_path = download_path / f"{m_idx:02d}. {sanitize_path_component(module['module_title'])}"
+        module_path.mkdir(parents=True, exist_ok=True)
+        print(f'--> Módulo {m_idx}: {module["module_title"]}')
+
+        for l_idx, lesson in enumerate(module['lessons'], 1):
+            lesson_path = module_path / f"{l_idx:03d}. {sanitize_path_component(lesson['title'])}"
+            lesson_path.mkdir(parents=True, exist_ok=True)
+            jobs.append({
+                'label': f"{m_idx:02d}.{l_idx:03d}",
+                'course_url': course_url,
+                'lesson_id': lesson.get('id') or lesson['url'],
+                'module_index': m_idx,
+                'module_title': module['module_title'],
+                'lesson_index': l_idx,
+                'lesson': lesson,
+                'lesson_path': lesson_path,
+                'content': None,
+                'video_url': None,
+                'download_headers': None,
+                'video_expires_at': None,
+                'video_ok': True,
+                'status': None,
+            })
+    return jobs
+
+def _index_course_lessons(course_structure: dict) -> Dict[str, Dict[str, Any]]:
+    """(Helper Function) Maps every lesson id of a course structure to its position and content."""
+    lessons = {}
+    for m_idx, module in enumerate(course_structure.get('modules', []), 1):
+        for l_idx, lesson in enumerate(module['lessons'], 1):
+            lessons[lesson.get('id') or lesson['url']] = {
+                'module_index': m_idx,
+                'module_title': module['module_title'],
+                'lesson_index': l_idx,
+                'title': lesson['title'],
+                'url': lesson['url'],
+            }
+    return lessons
+
+def diff_course_structure(previous: Optional[dict], current: dict) -> Dict[str, str]:
+    """
+    Compares two course structures, lesson by lesson, keyed by 'data-aulaid'.
+
+    Args:
+        previous: The structure saved by the previous run, or None.
+        current: The freshly parsed structure from get_course_details.
+
+    Returns:
+        A dictionary mapping each lesson id of 'current' to its status:
+        'new' when it did not exist before, 'changed' when its title or URL changed,
+        'moved' when only its module title or position changed, 'unchanged' otherwise.
+    """
+    previous_lessons = _index_course_lessons(previous or {})
+    statuses = {}
+    for lesson_id, lesson in _index_course_lessons(current).items():
+        old_lesson = previous_lessons.get(lesson_id)
+        if old_lesson is None:
+            statuses[lesson_id] = 'new'
+        elif (old_lesson['title'], old_lesson['url']) != (lesson['title'], lesson['url']):
+            statuses[lesson_id] = 'changed'
+        elif any(old_lesson[key] != lesson[key] for key in ('module_index', 'module_title', 'lesson_index')):
+            statuses[lesson_id] = 'moved'
+        else:
+            statuses[lesson_id] = 'unchanged'
+    return statuses
+
+def recover_sync_folders(download_path: pathlib.Path) -> None:
+    """
+    (Helper Function) Puts back the lesson folders left in '.sync-*' folders by an interrupted relocate_lesson_folders.
+
+    Each temporary folder holds the lesson folder and a SYNC_ORIGIN_FILE naming where it came
+    from. A folder is moved back there when that place is free, and reported otherwise.
+    """
+    manifest = get_manifest()
+    for sync_path in sorted(download_path.glob(f"{SYNC_FOLDER_PREFIX}*")):
+        try:
+            with open(sync_path / SYNC_ORIGIN_FILE, 'r', encoding='utf-8') as f:
+                origin = json.load(f)
+            origin_path = pathlib.Path(origin['path'])
+            held_path = sync_path / origin_path.name
+            if held_path.is_dir():
+                if origin_path.exists():
+                    print(f"⚠️ A pasta {held_path} ficou de uma sincronização interrompida e {origin_path} já existe; "
+                          f"verifique os arquivos manualmente.")
+                    continue
+                os.replace(held_path, origin_path)
+                manifest.update_lesson(origin['course_url'], origin['lesson_id'], lesson_path=origin_path)
+                print(f"📁 Pasta restaurada de uma sincronização interrompida: {origin_path}")
+            (sync_path / SYNC_ORIGIN_FILE).unlink()
+            sync_path.rmdir()
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"⚠️ Não foi possível restaurar a pasta de sincronização {sync_path}: {e}")
+
+def relocate_lesson_folders(jobs: List[Dict[str, Any]], download_path: pathlib.Path) -> int:
+    """
+    Moves the folders of renamed or reordered lessons to their new place instead of downloading them again.
+
+    The previous folder of each lesson comes from the manifest. Folders are first moved into
+    their own uniquely named '.sync-*' folder, so lessons that swapped places do not overwrite
+    each other, and folders left there by an interrupted run are put back first (see
+    recover_sync_folders). A folder that cannot reach its new place goes back to the old
+    one, or stays in its temporary folder, recorded in the manifest, when that is taken too.
+
+    Args:
+        jobs: The lesson jobs of the course, as returned by build_lesson_jobs.
+        download_path: The folder where the course is saved.
+
+    Returns:
+        The number of lesson folders moved.
+    """
+    import tempfile
+
+    recover_sync_folders(download_path)
+    manifest = get_manifest()
+    pending_moves = []
+    for job in jobs:
+        entry = manifest.get_lesson(job['course_url'], job['lesson_id'])
+        if not entry or not entry['lesson_path']:
+            continue
+        old_path = pathlib.Path(entry['lesson_path'])
+        if old_path == job['lesson_path'] or not old_path.is_dir():
+            continue
+        sync_path = None
+        try:
+            sync_path = pathlib.Path(tempfile.mkdtemp(prefix=SYNC_FOLDER_PREFIX, dir=download_path))
+            with open(sync_path / SYNC_ORIGIN_FILE, 'w', encoding='utf-8') as f:
+                json.dump({'course_url': job['course_url'], 'lesson_id': job['lesson_id'], 'path': str(old_path)}, f,
+                          ensure_ascii=False)
+            temporary_path = sync_path / old_path.name
+            os.replace(old_path, temporary_path)
+        except OSError as e:
+            print(f"---> [{job['label']}] ⚠️ Não foi possível mover a pasta {old_path}: {e}")
+            if sync_path is not None:
+                shutil.rmtree(sync_path, ignore_errors=True)
+            continue
+        pending_moves.append((job, old_path, temporary_path))
+
+    moved = 0
+    for job, old_path, temporary_path in pending_moves:
+        new_path = job['lesson_path']
+        try:
+            if new_path.is_dir() and not any(new_path.iterdir()):
+                new_path.rmdir()
+            if new_path.exists():
+                raise FileExistsError(f"a pasta {new_path} já existe")
+            new_path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(temporary_path, new_path)
+        except OSError as e:
+            try:
+                os.replace(temporary_path, old_path)
+                print(f"---> [{job['label']}] ⚠️ Não foi possível mover a aula para {new_path} ({e}); mantida em {old_path}")
+            except OSError:
+                manifest.update_lesson(job['course_url'], job['lesson_id'], lesson_path=temporary_path)
+                print(f"---> [{job['label']}] ⚠️ Não foi possível mover a aula para {new_path} ({e}); "
+                      f"os arquivos antigos ficaram em {temporary_path}")
+                continue
+        else:
+            manifest.update_lesson(job['course_url'], job['lesson_id'], lesson_path=new_path)
+            print(f"---> [{job['label']}] 📁 Aula movida: {old_path} -> {new_path}")
+            moved += 1
+        with contextlib.suppress(OSError):
+            (temporary_path.parent / SYNC_ORIGIN_FILE).unlink()
+            temporary_path.parent.rmdir()
+        # Drops the old module folder once all of its lessons have moved away
+        with contextlib.suppress(OSError):
+            if old_path.parent.is_dir() and not any(old_path.parent.iterdir()):
+                old_path.parent.rmdir()
+
+    return moved
+
+def player_type(player_url: str) -> str:
+    """Returns the kind of player of a lesson ('panda', 'hotmart', 'youtube', 'vimeo' or 'other')."""
+    for name, marker in (('panda', 'pandavideo'), ('hotmart', 'play.hotmart.com'), ('youtube', 'youtube.com'), ('vimeo', 'vimeo.com')):
+        if marker in player_url:
+            return name
+    return 'other'
+
+def resolve_player_url(player_url: str, session: requests.Session, lesson_url: str, base_url: str) -> Tuple[Optional[str], Optional[dict]]:
+    """
+    Resolves a lesson player URL into a URL that yt-dlp can download.
+
+    Args:
+        player_url: The URL of the embedded player (Panda, Hotmart, YouTube or Vimeo).
+        session: The authenticated requests session.
+        lesson_url: The URL of the lesson page, used as Referer for Hotmart.
+        base_url: The base URL of the platform, used as Referer for YouTube and Vimeo.
+
+    Returns:
+        A tuple with the video URL and the headers required to download it.
+        The URL is None when the player is not supported or resolution fails.
+    """
+    if 'pandavideo' in player_url:
+        try:
+            best_host = get_panda_endpoints().ranked_hosts(player_url, lesson_url)[0]
+            return convert_panda_video_url(player_url, best_host), {'Referer': player_url}
+        except ValueError as e:
+            print(f"-----> ❌ Erro ao converter URL do Panda: {e}")
+            return None, None
+
+    if 'play.hotmart.com' in player_url:
+        video_url = get_hotmart_video_url(player_url, session, lesson_url)
+        return video_url, {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:142.0) Gecko/20100101 Firefox/142.0',
+            'Accept': '*/*',
+            'Accept-Language': 'pt-BR,pt;q=0.8,en-US;q=0.5,en;q=0.3',
+            'Origin': 'https://cf-embed.play.hotmart.com',
+            'Referer': player_url,
+            'Connection': 'keep-alive',
+            'Sec-Fetch-Dest': 'empty',
+            'Sec-Fetch-Mode': 'cors',
+            'Sec-Fetch-Site': 'same-site',
+        }
+
+    if 'youtube.com' in player_url or 'vimeo.com' in player_url:
+        return player_url, {'Referer': base_url}
+
+    return None, None
+
+def signed_url_expiry(url: str) -> Optional[float]:
+    """
+    Returns when a signed media URL stops working, as a Unix timestamp, if the URL says so.
+
+    Understands the usual CDN signatures: an epoch 'Expires'/'exp' query parameter, Akamai
+    tokens ('hdnts=exp=...~acl=...~hmac=...', also found in the path), AWS SigV4 'X-Amz-Date'
+    plus 'X-Amz-Expires', and CloudFront custom policies. Returns None for unsigned URLs.
+    """
+    parsed_url = urlparse(url)
+    query = {key.lower(): values[0] for key, values in parse_qs(parsed_url.query).items()}
+    candidates = []
+    for key in ('expires', 'exp', 'e'):
+        if query.get(key, '').isdigit() and len(query[key]) >= 9:
+            candidates.append(float(query[key]))
+    # Akamai edge tokens, in the query string or embedded in the path
+    candidates.extend(float(value) for value in re.findall(r'(?:^|[=~/&?])exp=(\d{9,11})\b', requests.utils.unquote(url)))
+    if 'x-amz-date' in query and query.get('x-amz-expires', '').isdigit():
+        with contextlib.suppress(ValueError):
+            signed_at = calendar.timegm(time.strptime(query['x-amz-date'], '%Y%m%dT%H%M%SZ'))
+            candidates.append(float(signed_at + int(query['x-amz-expires'])))
+    if 'policy' in query:
+        with contextlib.suppress(ValueError, KeyError, IndexError, TypeError):
+            policy = query['policy'].replace('-', '+').replace('_', '=').replace('~', '/')
+            statement = json.loads(base64.b64decode(policy))['Statement'][0]
+            candidates.append(float(statement['Condition']['DateLessThan']['AWS:EpochTime']))
+    return min(candidates) if candidates else None
+
+def resolve_player(player_url: str, session: requests.Session, lesson_url: str, base_url: str, refresh: bool = False) -> Tuple[Optional[str], Optional[dict], Optional[float]]:
+    """
+    Resolves a lesson player with resolve_player_url, caching the players that need a request.
+
+    Hotmart resolutions are kept in the manifest per player URL until the signed URL expires
+    (or for RESOLVED_URL_TTL when it carries no expiry), so retries and later runs reuse them.
+
+    Args:
+        refresh: Ignores and replaces the cached resolution.
+
+    Returns:
+        A tuple with the video URL, its headers and when the URL expires (None if it does not).
+    """
+    cacheable = player_type(player_url) == 'hotmart'
+    if cacheable and not refresh:
+        cached = get_manifest().get_resolved_player(player_url)
+        if cached:
+            return cached['video_url'], cached['headers'], cached['expires_at']
+
+    video_url, download_headers = resolve_player_url(player_url, session, lesson_url, base_url)
+    if not video_url:
+        return None, None, None
+    expires_at = signed_url_expiry(video_url)
+    if cacheable:
+        get_manifest().save_resolved_player(player_url, video_url, download_headers, expires_at or time.time() + RESOLVED_URL_TTL)
+    return video_url, download_headers, expires_at
+
+def scrape_lesson_stage(job: Dict[str, Any], session: requests.Session) -> Optional[Dict[str, Any]]:
+    """(Pipeline Stage) Fetches the lesson page, unless a plan already holds it, and saves its description."""
+    lesson = job['lesson']
+    print(f'---> [{job["label"]}] Aula {job["lesson_index"]}: {lesson["title"]} ({lesson["url"]})')
+
+    lesson_content = job['content'] or get_lesson_content(session, lesson['url'])
+    if not lesson_content:
+        print(f'-----> [{job["label"]}] ❌ Nao foi possivel obter o conteudo da aula.')
+        return None
+    job['content'] = lesson_content
+
+    if job['status'] == 'changed':
+        # The lesson was edited on the platform, so a different video replaces the saved one
+        entry = get_manifest().get_lesson(job['course_url'], job['lesson_id'])
+        if entry and entry['player_url'] and entry['player_url'] != lesson_content.get('player_url'):
+            discard_video_files(job['lesson_path'])
+            with contextlib.suppress(OSError):
+                (job['lesson_path'] / THUMBNAIL_FILE_NAME).unlink()
+            print(f'-----> [{job["label"]}] 🔄 O vídeo da aula mudou e será baixado novamente.')
+
+    get_manifest().update_lesson(
+        job['course_url'], job['lesson_id'],
+        lesson_url=lesson['url'],
+        lesson_path=job['lesson_path'],
+        player_url=lesson_content.get('player_url'),
+        attachments=lesson_content.get('attachments'),
+        completed=False,
+    )
+
+    if lesson_content.get('description'):
+        description_path = job['lesson_path'] / DESCRIPTION_FILE_NAME
+        with open(description_path, 'w', encoding='utf-8') as f:
+            f.write(lesson_content['description'])
+        print(f'-----> [{job["label"]}] ✅ Descrição da aula salva.')
+
+    return job
+
+def resolve_lesson_stage(job: Dict[str, Any], session: requests.Session, base_url: str) -> Dict[str, Any]:
+    """(Pipeline Stage) Resolves the lesson player into a downloadable video URL."""
+    player_url = job['content'].get('player_url')
+    if not player_url:
+        print(f'-----> [{job["label"]}] ℹ️ Nenhum player de vídeo encontrado nesta aula.')
+        return job
+
+    existing_video = find_verified_video(job['lesson_path'])
+    if existing_video:
+        print(f"-----> [{job['label']}] ⏭️ Vídeo já existe, pulando: {existing_video.name}")
+        return job
+
+    reused_video = reuse_stored_content(video_content_key(player_url), job['lesson_path'] / "Aula", player_url)
+    if reused_video:
+        print(f"-----> [{job['label']}] ⏭️ Vídeo já baixado em outra aula, reaproveitado.")
+        discard_video_files(job['lesson_path'], keep=reused_video)
+        job['video_url'] = None
+        return job
+
+    if job['video_url']:
+        # Resolved by the plan; the download stage resolves it again if it expired
+        return job
+
+    video_url, download_headers, expires_at = resolve_player(player_url, session, job['lesson']['url'], base_url)
+    if video_url:
+        job['video_url'] = video_url
+        job['download_headers'] = download_headers
+        job['video_expires_at'] = expires_at
+        get_manifest().update_lesson(job['course_url'], job['lesson_id'], video_url=video_url)
+    else:
+        job['video_ok'] = False
+        print(f"-----> [{job['label']}] ⚠️ Player não suportado ou falha ao extrair URL de: {player_url}")
+    return job
+
+def download_lesson_stage(job: Dict[str, Any], session: requests.Session, hls_workers: int = 0, base_url: str = '') -> Dict[str, Any]:
+    """
+    (Pipeline Stage) Downloads the lesson video and its attachments.
+
+    Panda videos go through the native HLS engine when 'hls_workers' is set,
+    falling back to yt-dlp if it fails. A signed video URL that expired while the
+    lesson waited in the queue is resolved again first. A video only counts as saved
+    once find_verified_video accepts it; its size is then recorded, leftovers of other
+    attempts are removed, and it is added to the content-addressed store, for other
+    lessons that embed the same video.
+    """
+    lesson_path = job['lesson_path']
+    lesson_complete = job['video_ok']
+
+    player_url = job['content']['player_url'] if job['content'] else None
+    if job['video_url'] and job['video_expires_at'] and job['video_expires_at'] - RESOLVED_URL_EXPIRY_MARGIN < time.time():
+        print(f"-----> [{job['label']}] 🔁 O link do vídeo expirou, resolvendo o player novamente...")
+        job['video_url'], job['download_headers'], job['video_expires_at'] = resolve_player(
+            player_url, session, job['lesson']['url'], base_url, refresh=True)
+        if not job['video_url']:
+            lesson_complete = False
+
+    if job['video_url']:
+        print(f"-----> [{job['label']}] 🎬 Baixando vídeo...")
+        started = time.perf_counter()
+        video_path = None
+        if hls_workers and 'pandavideo' in player_url:
+            if download_panda_video(player_url, lesson_path, 'Aula', job['lesson']['url'], hls_workers):
+                video_path = find_verified_video(lesson_path)
+            if video_path is None:
+                print(f"-----> [{job['label']}] ↩️ Tentando novamente com o yt-dlp...")
+        if video_path is None:
+            video_urls = [job['video_url']]
+            if 'pandavideo' in player_url:
+                # Every ranked Panda host, best first: after yt-dlp gives up on one, the next is tried
+                video_urls = [
+                    convert_panda_video_url(player_url, host)
+                    for host in get_panda_endpoints().ranked_hosts(player_url, job['lesson']['url'])
+                ]
+            for attempt, video_url in enumerate(video_urls):
+                if attempt:
+                    get_panda_endpoints().demote(urlparse(video_urls[attempt - 1]).netloc)
+                    print(f"-----> [{job['label']}] 🔀 Tentando outro servidor do Panda: {urlparse(video_url).netloc}")
+                if download_video(video_url, lesson_path, 'Aula', session, http_headers=job['download_headers']):
+                    video_path = find_verified_video(lesson_path)
+                if video_path is not None:
+                    break
+        video_size = video_path.stat().st_size if video_path else 0
+        _metrics.add_video(player_type(player_url), video_size, time.perf_counter() - started, video_path is not None)
+        if video_path is None:
+            lesson_complete = False
+        else:
+            expected_video = get_manifest().get_video(video_path) or {}
+            get_manifest().record_video(video_path, expected_video.get('duration'), video_size)
+            discard_video_files(lesson_path, keep=video_path)
+            store_content(video_content_key(player_url), video_path, job['video_url'])
+
+    if job['content'].get('attachments'):
+        print(f'-----> [{job["label"]}] 📎 Verificando anexos...')
+        pending_attachments = []
+        for attachment in job['content']['attachments']:
+            attachment_path = attachment_file_path(lesson_path, attachment['url'], attachment['name'])
+
+            if is_attachment_complete(attachment_path):
+                print(f"      -> ⏭️ Anexo já existe, pulando: {attachment_path.name}")
+            else:
+                pending_attachments.append(attachment)
+
+        if not all(get_attachment_downloader(session).download_all(pending_attachments, lesson_path)):
+            lesson_complete = False
+
+    if lesson_complete:
+        get_manifest().update_lesson(
+            job['course_url'], job['lesson_id'],
+            file_sizes=record_lesson_files(lesson_path),
+            completed=True,
+        )
+    job['completed'] = lesson_complete
+    return job
+
+_DESCRIPTION_URL_PATTERN = re.compile(r'https?://[^\s<>"\']+[^\s<>"\'.,;:!?)]')
+
+DESCRIPTION_PAGE_TEMPLATE = """<!DOCTYPE html>
+<html lang="pt-BR">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>body {{ font-family: sans-serif; max-width: 48em; margin: 2em auto; padding: 0 1em; line-height: 1.5; }}</style>
+</head>
+<body>
+<h1>{title}</h1>
+{body}
+</body>
+</html>
+"""
+
+def _run_ffmpeg(ffmpeg: str, arguments: List[str]) -> Optional[str]:
+    """(Helper Function) Runs ffmpeg without any prompt. Returns None on success, otherwise the last line of its errors."""
+    import subprocess
+
+    try:
+        completed = subprocess.run(
+            [ffmpeg, '-nostdin', '-hide_banner', '-loglevel', 'error', '-y', *arguments],
+            capture_output=True, text=True, errors='replace', timeout=POSTPROCESS_FFMPEG_TIMEOUT,
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        return str(e)
+    if completed.returncode:
+        lines = completed.stderr.strip().splitlines()
+        return lines[-1] if lines else f"código de saída {completed.returncode}"
+    return None
+
+def remux_video(video_path: pathlib.Path, ffmpeg: str) -> Optional[pathlib.Path]:
+    """
+    Rewrites a video as an MP4 with its 'moov' box first (faststart), copying the streams without re-encoding.
+
+    Only MPEG-TS files (the native HLS engine's 'Aula.ts', or an '.mp4' saved by yt-dlp
+    without ffmpeg) and MP4 files whose 'moov' comes after the media data are rewritten.
+    The new file replaces the original once its container and duration check out.
+
+    Returns:
+        The MP4 file, or None when the video was left as it was.
+
+    Raises:
+        ValueError: If ffmpeg fails or its output does not match the original.
+    """
+    with open(video_path, 'rb') as f:
+        container = video_container(f.read(TS_PACKET_SIZE + 1))
+    if container not in ('mpegts', 'mp4') or (container == 'mp4' and mp4_has_faststart(video_path)):
+        return None
+    source_duration = probe_video_file(video_path)
+    target = video_path.with_suffix('.mp4')
+    temporary_path = target.with_name(f".{target.name}.remux")
+    try:
+        error = _run_ffmpeg(ffmpeg, [
+            '-i', str(video_path), '-map', '0:v?', '-map', '0:a?', '-c', 'copy',
+            '-movflags', '+faststart', '-f', 'mp4', str(temporary_path),
+        ])
+        if error:
+            raise ValueError(error)
+        problem = video_mismatch(temporary_path, probe_video_file(temporary_path), {'duration': source_duration})
+        if problem:
+            raise ValueError(problem)
+    except (OSError, ValueError):
+        with contextlib.suppress(OSError):
+            temporary_path.unlink()
+        raise
+    os.replace(temporary_path, target)
+    if video_path != target:
+        video_path.unlink()
+    return target
+
+def extract_thumbnail(video_path: pathlib.Path, ffmpeg: str, duration: Optional[float]) -> pathlib.Path:
+    """
+    Saves one frame of a video as THUMBNAIL_FILE_NAME, next to it, at most THUMBNAIL_WIDTH pixels wide.
+
+    Raises:
+        ValueError: If ffmpeg fails, for example because the file only holds audio.
+    """
+    target = video_path.with_name(THUMBNAIL_FILE_NAME)
+    temporary_path = target.with_name(f".{target.name}.part")
+    position = min(duration * THUMBNAIL_POSITION_RATIO, THUMBNAIL_MAX_POSITION) if duration else 0
+    error = _run_ffmpeg(ffmpeg, [
+        '-ss', f"{position:.3f}", '-i', str(video_path), '-frames:v', '1',
+        '-vf', f"scale='min({THUMBNAIL_WIDTH},iw)':-2", '-q:v', '3', '-f', 'image2', str(temporary_path),
+    ])
+    if error or not temporary_path.is_file():
+        with contextlib.suppress(OSError):
+            temporary_path.unlink()
+        raise ValueError(error or "nenhum quadro de vídeo")
+    os.replace(temporary_path, target)
+    return target
+
+def render_description(description_path: pathlib.Path, title: str) -> bool:
+    """
+    Turns the saved description of a lesson into a standalone HTML page.
+
+    The scrape stage saves the plain text of the description, which a browser shows as a
+    single line and, without a declared charset, with broken accents. Every line becomes a
+    paragraph of a UTF-8 page titled after the lesson, and its links become clickable.
+
+    Returns:
+        False if the file was already rendered, True otherwise.
+    """
+    import html
+
+    text = description_path.read_text(encoding='utf-8')
+    if text.startswith('<!DOCTYPE html>'):
+        return False
+    paragraphs = []
+    for line in text.splitlines():
+        if line.strip():
+            # The pattern stops at quotes, so the escaped links can go into 'href' as they are
+            escaped = html.escape(line.strip(), quote=False)
+            paragraphs.append('<p>' + _DESCRIPTION_URL_PATTERN.sub(
+                lambda match: f'<a href="{match.group(0)}">{match.group(0)}</a>', escaped) + '</p>')
+    page = DESCRIPTION_PAGE_TEMPLATE.format(title=html.escape(title), body='\n'.join(paragraphs))
+    temporary_path = description_path.with_name(f".{description_path.name}.part")
+    temporary_path.write_text(page, encoding='utf-8')
+    os.replace(temporary_path, description_path)
+    return True
+
+def postprocess_lesson(lesson_path: str, tasks: Tuple[str, ...], ffmpeg: Optional[str], title: str) -> Dict[str, Any]:
+    """
+    (Process Pool Task) Runs the post-processing tasks over the files of a finished lesson.
+
+    It only touches the lesson folder; the changes are recorded in the manifest by the
+    calling process (see PostProcessor). Every task skips work that is already done, so a
+    lesson can be post-processed again safely.
+
+    Args:
+        lesson_path: The folder of the lesson.
+        tasks: Some of POSTPROCESS_TASKS. 'remux' and 'thumbnail' need 'ffmpeg'.
+        ffmpeg: The path of the ffmpeg executable.
+        title: The lesson title, for the description page.
+
+    Returns:
+        A dictionary with the 'source' and 'target' names, 'duration' and 'size' of the remuxed
+        'video' (None if it was not remuxed), the 'messages' to print, whether any task
+        'failed' and the 'seconds' it took.
+    """
+    started = time.perf_counter()
+    lesson_path = pathlib.Path(lesson_path)
+    result = {'video': None, 'messages': [], 'failed': False}
+    video_files = lesson_video_files(lesson_path)
+    video_path = video_files[0] if video_files else None
+
+    if 'remux' in tasks and video_path:
+        try:
+            target = remux_video(video_path, ffmpeg)
+            if target:
+                result['video'] = {
+                    'source': video_path.name, 'target': target.name,
+                    'duration': probe_video_file(target), 'size': target.stat().st_size,
+                }
+                if target == video_path:
+                    result['messages'].append(f"🎞️ {target.name} reorganizado com faststart, sem recodificar.")
+                else:
+                    result['messages'].append(f"🎞️ {video_path.name} convertido para {target.name} com faststart, sem recodificar.")
+                video_path = target
+        except (OSError, ValueError) as e:
+            result['failed'] = True
+            result['messages'].append(f"⚠️ Não foi possível converter {video_path.name}: {e}")
+
+    if 'thumbnail' in tasks and video_path and not (lesson_path / THUMBNAIL_FILE_NAME).exists():
+        try:
+            extract_thumbnail(video_path, ffmpeg, probe_video_file(video_path))
+            result['messages'].append("🖼️ Miniatura do vídeo salva.")
+        except (OSError, ValueError) as e:
+            result['failed'] = True
+            result['messages'].append(f"⚠️ Não foi possível salvar a miniatura: {e}")
+
+    description_path = lesson_path / DESCRIPTION_FILE_NAME
+    if 'description' in tasks and description_path.is_file():
+        try:
+            if render_description(description_path, title):
+                result['messages'].append("📝 Descrição convertida em página HTML.")
+        except (OSError, UnicodeDecodeError) as e:
+            result['failed'] = True
+            result['messages'].append(f"⚠️ Não foi possível converter a descrição: {e}")
+
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+class PostProcessor:
+    """
+    Post-processes finished lessons on a process pool while the downloads go on.
+
+    At most 'backlog' lessons are handed to the pool at once; the others wait in a list
+    and are handed over as lessons finish, so 'submit' never blocks the download workers
+    and the CPU work catches up on its own. Like the course pool, it spawns its workers
+    instead of forking them (see _process_context).
+
+    The results are applied in the calling process: a remuxed video replaces the old one
+    in the manifest and in the content-addressed store, and the lesson's file sizes are
+    recorded again, so the next run still recognizes the lesson as complete.
+
+    The pool is shared by every course of the process, including the jobs of a job file,
+    which run as threads, so 'pending' and 'drain' can be limited to the lessons of one course.
+    """
+
+    def __init__(self, tasks: Iterable[str], workers: int = DEFAULT_POSTPROCESS_WORKERS, backlog: int = DEFAULT_QUEUE_SIZE):
+        self.ffmpeg = shutil.which('ffmpeg')
+        self.tasks = tuple(tasks)
+        if not self.ffmpeg and {'remux', 'thumbnail'} & set(self.tasks):
+            print("⚠️ Aviso: ffmpeg não encontrado, a conversão dos vídeos e as miniaturas não serão feitas.")
+            self.tasks = tuple(task for task in self.tasks if task not in ('remux', 'thumbnail'))
+        self.backlog = max(1, backlog)
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=max(1, workers), mp_context=_process_context)
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._running = 0
+        self._waiting = collections.deque()
+        # id() of every submitted job not yet post-processed
+        self._unfinished = set()
+
+    def submit(self, job: Dict[str, Any]) -> None:
+        """Queues a finished lesson job for post-processing, without waiting for it."""
+        with self._lock:
+            self._unfinished.add(id(job))
+            if self._running >= self.backlog:
+                self._waiting.append(job)
+                return
+            self._running += 1
+        self._start(job)
+
+    def _start(self, job: Dict[str, Any]) -> None:
+        try:
+            future = self._executor.submit(
+                postprocess_lesson, str(job['lesson_path']), self.tasks, self.ffmpeg, job['lesson']['title'])
+        except RuntimeError as e:
+            # A broken or closed pool: the lesson keeps its files as downloaded
+            print(f"-----> [{job['label']}] ⚠️ Pós-processamento indisponível: {e}")
+            self._next(job)
+            return
+        future.add_done_callback(functools.partial(self._finished, job))
+
+    def _finished(self, job: Dict[str, Any], future: concurrent.futures.Future) -> None:
+        try:
+            self._apply(job, future.result())
+        except Exception as e:
+            _metrics.observe('postprocess', 0.0, ok=False)
+            print(f"-----> [{job['label']}] ⚠️ Falha no pós-processamento: {e}")
+        self._next(job)
+
+    def _next(self, finished_job: Dict[str, Any]) -> None:
+        """Marks a lesson as done and hands the oldest waiting lesson to the slot it freed, if any."""
+        with self._lock:
+            self._unfinished.discard(id(finished_job))
+            job = self._waiting.popleft() if self._waiting else None
+            if job is None:
+                self._running -= 1
+            self._idle.notify_all()
+        if job is not None:
+            self._start(job)
+
+    def _apply(self, job: Dict[str, Any], result: Dict[str, Any]) -> None:
+        """Prints the messages of a post-processed lesson and records its new files."""
+        lesson_path = job['lesson_path']
+        for message in result['messages']:
+            print(f"-----> [{job['label']}] {message}")
+        manifest = get_manifest()
+        video = result['video']
+        if video:
+            source, target = lesson_path / video['source'], lesson_path / video['target']
+            if source != target:
+                manifest.forget_video(source)
+            manifest.record_video(target, video['duration'], video['size'], resumable=False)
+            player_url = (job.get('content') or {}).get('player_url')
+            if player_url:
+                store_content(video_content_key(player_url), target, job.get('video_url'))
+        manifest.update_lesson(job['course_url'], job['lesson_id'], file_sizes=record_lesson_files(lesson_path))
+        _metrics.observe('postprocess', result['seconds'], ok=not result['failed'])
+
+    def pending(self, jobs: Optional[Iterable[Dict[str, Any]]] = None) -> int:
+        """Returns how many lessons, among 'jobs' when given, are being post-processed or waiting for it."""
+        with self._lock:
+            if jobs is None:
+                return len(self._unfinished)
+            return len(self._unfinished & {id(job) for job in jobs})
+
+    def drain(self, jobs: Optional[Iterable[Dict[str, Any]]] = None) -> None:
+        """Waits until every submitted lesson, or every one among 'jobs' when given, was post-processed."""
+        job_ids = None if jobs is None else {id(job) for job in jobs}
+        with self._lock:
+            while self._unfinished if job_ids is None else self._unfinished & job_ids:
+                self._idle.wait()
+
+    def close(self) -> None:
+        """Waits for the submitted lessons and stops the worker processes."""
+        self.drain()
+        self._executor.shutdown(wait=True)
+
+_postprocess_settings = {'tasks': (), 'workers': DEFAULT_POSTPROCESS_WORKERS, 'backlog': DEFAULT_QUEUE_SIZE}
+_postprocessor = None
+_postprocessor_lock = threading.Lock()
+
+def configure_postprocessing(tasks: Iterable[str], workers: int, backlog: int) -> None:
+    """Sets the post-processing tasks and pool of the current process; no task disables the stage."""
+    _postprocess_settings.update(tasks=tuple(tasks), workers=workers, backlog=backlog)
+
+def get_postprocessor() -> Optional[PostProcessor]:
+    """Returns the post-processing pool of the current process, starting it on first use, or None when disabled."""
+    global _postprocessor
+    with _postprocessor_lock:
+        if _postprocessor is None and _postprocess_settings['tasks']:
+            _postprocessor = PostProcessor(**_postprocess_settings)
+        return _postprocessor
+
+def close_postprocessor() -> None:
+    """Waits for the pending post-processing of the current process and stops its pool."""
+    global _postprocessor
+    with _postprocessor_lock:
+        postprocessor, _postprocessor = _postprocessor, None
+    if postprocessor is not None:
+        postprocessor.close()
+
+def postprocess_lesson_stage(job: Dict[str, Any]) -> Dict[str, Any]:
+    """(Pipeline Stage) Hands a fully downloaded lesson to the post-processing pool, without waiting for it."""
+    postprocessor = get_postprocessor()
+    if job.get('completed') and postprocessor is not None:
+        postprocessor.submit(job)
+    return job
+
+def download_course(session: requests.Session, course: Dict[str, str], course_structure: dict, base_url: str, options: argparse.Namespace, planned_lessons: Optional[Dict[str, dict]] = None) -> int:
+    """
+    Downloads a whole course through the scrape, resolve and download pipeline.
+
+    Args:
+        session: An authenticated requests.Session object.
+        course: The course dictionary ('title' and 'url') from get_course_list.
+        course_structure: The course structure returned by get_course_details.
+        base_url: The base URL of the platform.
+        options: The parsed command line options, holding the worker pool sizes.
+        planned_lessons: The lessons of the course in a plan file, by lesson id. Their page
+            content and resolved video URL are reused instead of fetched again.
+
+    Returns:
+        How many lessons could not be fully downloaded.
+    """
+    download_path = options.output_dir / sanitize_path_component(course['title'])
+    print(f'-> Baixando o curso "{course["title"]}" para a pasta "{download_path}"')
+    download_path.mkdir(parents=True, exist_ok=True)
+
+    manifest = get_manifest()
+    all_jobs = build_lesson_jobs(course_structure, download_path, course['url'])
+    for job in all_jobs:
+        planned = (planned_lessons or {}).get(job['lesson_id'])
+        if planned:
+            job['content'] = planned['content']
+            job['video_url'] = planned['video_url']
+            job['download_headers'] = planned['download_headers']
+            job['video_expires_at'] = planned['video_expires_at']
+
+    if options.command == 'sync':
+        statuses = diff_course_structure(manifest.get_course_snapshot(course['url']), course_structure)
+        for job in all_jobs:
+            job['status'] = statuses.get(job['lesson_id'])
+        moved_count = relocate_lesson_folders(all_jobs, download_path)
+        counts = {status: list(statuses.values()).count(status) for status in ('new', 'changed', 'moved', 'unchanged')}
+        print(f"🔄 Sincronização: {counts['new']} novas, {counts['changed']} alteradas, "
+              f"{counts['moved']} movidas ({moved_count} pastas), {counts['unchanged']} sem alterações.")
+
+    jobs = []
+    for job in all_jobs:
+        if job['status'] != 'changed' and manifest.is_lesson_complete(job['course_url'], job['lesson_id'], job['lesson_path']):
+            print(f'---> [{job["label"]}] ⏭️ Aula já concluída, pulando: {job["lesson"]["title"]}')
+            continue
+        jobs.append(job)
+    # Lessons are started per video host, so a throttled CDN does not hold back the others
+    download_scheduler = HostScheduler(download_host, options.host_downloads or options.download_workers, options.queue_size)
+    stages = [
+        (functools.partial(scrape_lesson_stage, session=session), options.scrape_workers),
+        (functools.partial(resolve_lesson_stage, session=session, base_url=base_url), options.resolve_workers),
+        (functools.partial(download_lesson_stage, session=session, hls_workers=options.hls_workers, base_url=base_url),
+         options.download_workers, download_scheduler),
+    ]
+    postprocessor = get_postprocessor() if jobs else None
+    if postprocessor is not None:
+        # The stage only hands lessons to the pool, so a single thread never holds back the downloads
+        stages.append((postprocess_lesson_stage, 1))
+    finished_jobs = run_pipeline(jobs, stages, queue_size=options.queue_size)
+    if postprocessor is not None and postprocessor.pending(jobs):
+        print(f"⏳ Aguardando o pós-processamento de {postprocessor.pending(jobs)} aula(s)...")
+        postprocessor.drain(jobs)
+    manifest.save_course_snapshot(course['url'], course_structure)
+    return len(jobs) - sum(1 for job in finished_jobs if job.get('completed'))
+
+def process_course(session: requests.Session, course: Dict[str, str], base_url: str, options: argparse.Namespace) -> bool:
+    """
+    Fetches the structure of a course and downloads it.
+
+    Args:
+        session: An authenticated requests.Session object.
+        course: The course dictionary ('title' and 'url') from get_course_list.
+        base_url: The base URL of the platform.
+        options: The parsed command line options.
+
+    Returns:
+        True if every lesson of the course was downloaded, False otherwise.
+    """
+    print("-" * 60)
+    print(f"🚀 Iniciando processamento para o curso: {course['title']}")
+
+    course_structure = get_course_details(session, course['url'])
+    if not course_structure:
+        print(f"\n❌ Não foi possível obter a estrutura do curso: {course['title']}")
+        return False
+
+    return download_course(session, course, course_structure, base_url, options) == 0
+
+def fetch_course_structures(session: requests.Session, courses: List[Dict[str, str]], workers: int) -> List[Tuple[Dict[str, str], Optional[dict]]]:
+    """
+    Fetches and parses the structure of several courses concurrently.
+
+    Args:
+        session: An authenticated requests.Session object.
+        courses: The courses to fetch, as returned by get_course_list.
+        workers: How many course pages are fetched at the same time.
+
+    Returns:
+        A list of (course, structure) tuples in the same order as 'courses'.
+        The structure is None for the courses that could not be fetched.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        structures = list(executor.map(lambda course: get_course_details(session, course['url']), courses))
+    return list(zip(courses, structures))
+
+def configure_runtime(options: argparse.Namespace) -> None:
+    """
+    Sets up the per-process services of a run from the command line options.
+
+    Called once by main() and once by every worker process of a multi-course run.
+    """
+    configure_attachment_downloads(options.attachment_workers, options.attachment_host_connections)
+    configure_html_backend(options.html_backend)
+    configure_deduplication(options.dedupe)
+    configure_panda_endpoints(options.panda_hosts)
+    # '--postprocess' without any task selects all of them
+    configure_postprocessing(
+        POSTPROCESS_TASKS if options.postprocess == [] else options.postprocess or (),
+        options.postprocess_workers,
+        options.queue_size,
+    )
+    configure_variant_policy(VariantPolicy(
+        max_height=options.max_height,
+        max_bandwidth=options.max_bandwidth,
+        prefer_codec=options.prefer_codec,
+        audio_only=options.audio_only,
+    ))
+    if options.no_page_cache:
+        configure_page_cache(None)
+    else:
+        configure_page_cache(HttpPageCache(
+            max_bytes=int(options.page_cache_size * 1024 * 1024),
+            ttl=options.page_cache_ttl,
+        ))
+
+def _init_course_worker(transfer_semaphore, transfer_governor, options: argparse.Namespace) -> None:
+    """(Process Pool Initializer) Shares the run-wide transfer cap, governor and settings with a worker process."""
+    configure_media_transfer_limit(transfer_semaphore)
+    configure_transfer_governor(transfer_governor)
+    configure_runtime(options)
+
+def _download_course_in_worker(session: requests.Session, course: Dict[str, str], course_structure: dict, base_url: str, options: argparse.Namespace, planned_lessons: Optional[Dict[str, dict]] = None) -> Tuple[int, dict]:
+    """
+    Downloads one course; returns the failed lessons and the metrics it collected.
+
+    The download services of the process are left open: in the main process they are shared
+    with the other jobs of a job file and closed once by main (see _download_course_in_pool).
+    """
+    print("-" * 60)
+    print(f"🚀 Iniciando processamento para o curso: {course['title']}")
+    failed_lessons = download_course(session, course, course_structure, base_url, options, planned_lessons)
+    return failed_lessons, get_metrics().snapshot(reset=True)
+
+def _download_course_in_pool(*args: Any) -> Tuple[int, dict]:
+    """(Process Pool Task) Runs _download_course_in_worker in a worker process, then closes the download services it started."""
+    try:
+        return _download_course_in_worker(*args)
+    finally:
+        close_download_services()
+
+def download_all_courses(session: requests.Session, courses: List[Dict[str, str]], base_url: str, options: argparse.Namespace, transfer_semaphore=None, transfer_governor: Optional[TransferGovernor] = None, plan: Optional[dict] = None) -> int:
+    """
+    Downloads several courses at once, spreading them across a pool of processes.
+
+    Every course structure is fetched up front, concurrently, and each course is then
+    downloaded by its own worker process, so a slow course does not hold up the others.
+    The workers are spawned rather than forked (see _process_context), since the jobs of
+    a job file run as threads and may be downloading while another job starts its pool.
+    The total number of concurrent media transfers stays capped by 'transfer_semaphore',
+    and the rate limit and per-host ceiling of 'transfer_governor' apply to every process.
+
+    Args:
+        session: An authenticated requests.Session object.
+        courses: The courses to download, as returned by get_course_list.
+        base_url: The base URL of the platform.
+        options: The parsed command line options.
+        transfer_semaphore: The multiprocessing semaphore capping media transfers, if any.
+        transfer_governor: The run-wide rate limit and connection ceiling, if any.
+        plan: A plan built by build_plan. The course structures, lesson pages and resolved
+            video URLs it holds are used instead of scraping the platform again.
+
+    Returns:
+        How many courses were not fully downloaded.
+    """
+    course_structures = []
+    failed_courses = 0
+    planned_courses = {planned['url']: planned for planned in plan['courses']} if plan else {}
+    if plan:
+        course_structures = [(course, planned_courses[course['url']]['structure']) for course in courses]
+    else:
+        print(f"\n🔎 Buscando a estrutura de {len(courses)} cursos...")
+        for course, course_structure in fetch_course_structures(session, courses, options.scrape_workers):
+            if course_structure:
+                course_structures.append((course, course_structure))
+            else:
+                failed_courses += 1
+                print(f"\n❌ Não foi possível obter a estrutura do curso: {course['title']}")
+
+    def planned_lessons(course: Dict[str, str]) -> Optional[Dict[str, dict]]:
+        return planned_courses[course['url']]['lessons'] if plan else None
+
+    if options.course_processes <= 1 or len(course_structures) <= 1:
+        for course, course_structure in course_structures:
+            failed_lessons, metrics = _download_course_in_worker(session, course, course_structure, base_url, options, planned_lessons(course))
+            get_metrics().merge(metrics)
+            failed_courses += failed_lessons > 0
+        return failed_courses
+
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=options.course_processes,
+        mp_context=_process_context,
+        initializer=_init_course_worker,
+        initargs=(transfer_semaphore, transfer_governor, options),
+    ) as executor:
+        futures = {
+            executor.submit(_download_course_in_pool, session, course, course_structure, base_url, options, planned_lessons(course)): course
+            for course, course_structure in course_structures
+        }
+        for future in concurrent.futures.as_completed(futures):
+            course = futures[future]
+            try:
+                failed_lessons, metrics = future.result()
+                get_metrics().merge(metrics)
+                failed_courses += failed_lessons > 0
+                print(f"\n✅ Curso finalizado: {course['title']}")
+            except Exception as e:
+                failed_courses += 1
+                print(f"\n❌ Erro ao processar o curso {course['title']}: {e}")
+    return failed_courses
+
+def plan_scrape_stage(job: Dict[str, Any], session: requests.Session) -> Optional[Dict[str, Any]]:
+    """(Plan Stage) Fetches the lesson page. Lessons already downloaded are sized from the manifest instead."""
+    job['planned_video'] = {'bytes': None, 'seconds': None, 'pending': False}
+    job['planned_attachments'] = []
+    entry = get_manifest().get_lesson(job['course_url'], job['lesson_id'])
+    if entry and entry['completed'] and get_manifest().is_lesson_complete(job['course_url'], job['lesson_id'], job['lesson_path']):
+        file_sizes = entry['file_sizes'] or {}
+        job['planned_video']['bytes'] = sum(size for name, size in file_sizes.items() if name.startswith('Aula.'))
+        job['planned_attachments'] = [
+            {'name': name, 'url': None, 'bytes': size, 'pending': False}
+            for name, size in file_sizes.items()
+            if not name.startswith('Aula.') and name not in (DESCRIPTION_FILE_NAME, THUMBNAIL_FILE_NAME)
+        ]
+        job['content'] = None
+        return job
+
+    job['content'] = get_lesson_content(session, job['lesson']['url'])
+    if not job['content']:
+        print(f'-----> [{job["label"]}] ❌ Nao foi possivel obter o conteudo da aula.')
+        return None
+    return job
+
+def plan_resolve_stage(job: Dict[str, Any], session: requests.Session, base_url: str) -> Dict[str, Any]:
+    """(Plan Stage) Resolves the lesson player and estimates the size of its video without downloading it."""
+    player_url = job['content'].get('player_url') if job['content'] else None
+    if not player_url:
+        if job['content']:
+            job['planned_video']['bytes'] = 0
+        return job
+
+    existing_video = find_verified_video(job['lesson_path'], repair=False)
+    if existing_video:
+        job['planned_video']['bytes'] = existing_video.stat().st_size
+        return job
+    if has_stored_content(video_content_key(player_url)):
+        # Linked from another lesson at download time, without any transfer
+        job['planned_video']['bytes'] = get_manifest().get_content(video_content_key(player_url))['size']
+        return job
+
+    video_url, download_headers, expires_at = resolve_player(player_url, session, job['lesson']['url'], base_url)
+    if not video_url:
+        job['planned_video']['pending'] = True
+        return job
+    job['video_url'], job['download_headers'], job['video_expires_at'] = video_url, download_headers, expires_at
+
+    if player_type(player_url) == 'panda':
+        panda_headers = _panda_stream_headers(player_url, job['lesson']['url'])
+        panda_headers['Accept-Encoding'] = 'gzip, deflate'
+        size, duration = probe_hls_size(video_url, panda_headers)
+    elif urlparse(video_url).path.endswith('.m3u8'):
+        size, duration = probe_hls_size(video_url, download_headers or {})
+    else:
+        size, duration = get_ytdlp_downloader(session).probe(video_url, download_headers)
+    job['planned_video'] = {'bytes': size, 'seconds': duration, 'pending': True}
+    return job
+
+def plan_probe_stage(job: Dict[str, Any], session: requests.Session) -> Dict[str, Any]:
+    """(Plan Stage) Sizes the lesson attachments, with HEAD requests for the ones not downloaded yet."""
+    for attachment in (job['content'] or {}).get('attachments') or []:
+        attachment_path = attachment_file_path(job['lesson_path'], attachment['url'], attachment['name'])
+        if is_attachment_complete(attachment_path):
+            size, pending = attachment_path.stat().st_size, False
+        elif has_stored_content(attachment_content_key(attachment['url'])):
+            size, pending = get_manifest().get_content(attachment_content_key(attachment['url']))['size'], False
+        else:
+            size, pending = probe_attachment_size(session, attachment['url']), True
+        job['planned_attachments'].append({'name': attachment['name'], 'url': attachment['url'], 'bytes': size, 'pending': pending})
+    return job
+
+def _summarize_plan_lessons(lessons: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """(Helper Function) Adds up the sizes of planned lessons."""
+    summary = {'lessons': 0, 'video_bytes': 0, 'video_seconds': 0.0, 'attachment_bytes': 0, 'pending_bytes': 0, 'unknown_sizes': 0}
+    for lesson in lessons:
+        summary['lessons'] += 1
+        files = [('video_bytes', lesson['video'])] + [('attachment_bytes', attachment) for attachment in lesson['attachments']]
+        for key, planned_file in files:
+            if planned_file['bytes'] is None:
+                summary['unknown_sizes'] += 1
+                continue
+            summary[key] += planned_file['bytes']
+            if planned_file['pending']:
+                summary['pending_bytes'] += planned_file['bytes']
+        summary['video_seconds'] += lesson['video'].get('seconds') or 0
+    return summary
+
+def estimate_throughput(options: argparse.Namespace) -> Tuple[float, str]:
+    """
+    Returns the download speed the plan estimates are based on, and where it came from.
+
+    The average speed of the previous run (from its --report file) is used when that run
+    downloaded enough to be meaningful, capped by --rate-limit. --plan-throughput overrides both.
+    """
+    if options.plan_throughput:
+        return options.plan_throughput, "--plan-throughput"
+    throughput, source = PLAN_DEFAULT_THROUGHPUT, "padrão"
+    try:
+        report = json.loads(options.report.read_text(encoding='utf-8'))
+        downloaded = sum(report.get('bytes', {}).get(kind, 0) for kind in ('page', 'video', 'attachment'))
+        if downloaded >= PLAN_MIN_MEASURED_BYTES and report.get('duration_seconds'):
+            throughput, source = downloaded / report['duration_seconds'], f"última execução ({options.report})"
+    except (OSError, ValueError, TypeError, AttributeError):
+        pass
+    if options.rate_limit and options.rate_limit < throughput:
+        throughput, source = options.rate_limit, "--rate-limit"
+    return throughput, source
+
+def build_plan(session: requests.Session, courses: List[Dict[str, str]], platform_url: str, base_url: str, options: argparse.Namespace) -> dict:
+    """
+    Walks the selected courses without downloading anything, to size the mirror.
+
+    The lesson pages of every course go through one pipeline: pages are fetched by
+    'scrape_workers' threads, players are resolved and their videos sized by 'resolve_workers'
+    threads (HLS variant bandwidth times duration, or yt-dlp metadata), and attachments are
+    sized with HEAD requests by 'attachment_workers' threads.
+
+    Returns:
+        The plan: every course structure, lesson content and resolved video URL, so that
+        a later run can execute it with --from-plan, plus the size per lesson, module and
+        course, and the estimated download time.
+    """
+    print(f"\n🔎 Buscando a estrutura de {len(courses)} cursos...")
+    planned_courses = []
+    jobs = []
+    for course, course_structure in fetch_course_structures(session, courses, options.scrape_workers):
+        if not course_structure:
+            print(f"\n❌ Não foi possível obter a estrutura do curso: {course['title']}")
+            continue
+        download_path = options.output_dir / sanitize_path_component(course['title'])
+        course_jobs = build_lesson_jobs(course_structure, download_path, course['url'])
+        planned_courses.append({'course': course, 'title': course['title'], 'url': course['url'], 'structure': course_structure, 'jobs': course_jobs})
+        jobs.extend(course_jobs)
+
+    print(f"\n📐 Planejando {len(jobs)} aulas...")
+    planned_jobs = {id(job) for job in run_pipeline(jobs, [
+        (functools.partial(plan_scrape_stage, session=session), options.scrape_workers),
+        (functools.partial(plan_resolve_stage, session=session, base_url=base_url), options.resolve_workers),
+        (functools.partial(plan_probe_stage, session=session), options.attachment_workers),
+    ], queue_size=options.queue_size)}
+
+    throughput, throughput_source = estimate_throughput(options)
+    plan = {
+        'version': PLAN_VERSION,
+        'created_at': time.time(),
+        'platform_url': platform_url,
+        'variant_policy': get_variant_policy().describe(),
+        'throughput': throughput,
+        'throughput_source': throughput_source,
+        'courses': [],
+    }
+    for planned_course in planned_courses:
+        lessons = {}
+        modules = []
+        for job in planned_course.pop('jobs'):
+            if id(job) not in planned_jobs:
+                plan.setdefault('unplanned_lessons', 0)
+                plan['unplanned_lessons'] += 1
+                continue
+            lessons[job['lesson_id']] = {
+                'label': job['label'],
+                'module_index': job['module_index'],
+                'title': job['lesson']['title'],
+                'content': job['content'],
+                'video_url': job['video_url'],
+                'download_headers': job['download_headers'],
+                'video_expires_at': job['video_expires_at'],
+                'video': job['planned_video'],
+                'attachments': job['planned_attachments'],
+            }
+        for m_idx, module in enumerate(planned_course['structure'].get('modules', []), 1):
+            summary = _summarize_plan_lessons(lesson for lesson in lessons.values() if lesson['module_index'] == m_idx)
+            summary['estimated_seconds'] = summary['pending_bytes'] / throughput
+            modules.append({'title': module['module_title'], **summary})
+        totals = _summarize_plan_lessons(lessons.values())
+        totals['estimated_seconds'] = totals['pending_bytes'] / throughput
+        plan['courses'].append({**planned_course, 'lessons': lessons, 'modules': modules, 'totals': totals})
+
+    totals = _summarize_plan_lessons(lesson for planned_course in plan['courses'] for lesson in planned_course['lessons'].values())
+    totals['estimated_seconds'] = totals['pending_bytes'] / throughput
+    plan['totals'] = totals
+    return plan
+
+def print_plan_summary(plan: dict) -> None:
+    """Prints the size and time estimate of a plan, per course and per module."""
+    def describe(summary: dict) -> str:
+        text = f"{summary['lessons']} aulas, vídeos {format_size(summary['video_bytes'])}"
+        if summary['video_seconds']:
+            text += f" ({format_duration(summary['video_seconds'])} de vídeo)"
+        text += (f", anexos {format_size(summary['attachment_bytes'])}, "
+                 f"a baixar {format_size(summary['pending_bytes'])} em ~{format_duration(summary['estimated_seconds'])}")
+        if summary['unknown_sizes']:
+            text += f", {summary['unknown_sizes']} arquivo(s) de tamanho desconhecido"
+        return text
+
+    print("\n--- Plano de download ---")
+    print(f"Qualidade dos vídeos: {plan['variant_policy']}")
+    print(f"Velocidade considerada: {format_rate(plan['throughput'])} ({plan['throughput_source']})")
+    for planned_course in plan['courses']:
+        print(f"\n📚 {planned_course['title']}: {describe(planned_course['totals'])}")
+        for m_idx, module in enumerate(planned_course['modules'], 1):
+            print(f"   {m_idx:02d}. {module['title']}: {describe(module)}")
+    print(f"\nTotal: {describe(plan['totals'])}")
+    if plan.get('unplanned_lessons'):
+        print(f"⚠️ {plan['unplanned_lessons']} aula(s) não puderam ser lidas e serão buscadas novamente ao executar o plano.")
+
+def save_plan(plan: dict, path: pathlib.Path) -> None:
+    """Writes a plan file, through a temporary file so a half-written plan is never executed."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    temporary_path.write_text(json.dumps(plan, ensure_ascii=False, indent=1), encoding='utf-8')
+    os.replace(temporary_path, path)
+
+def load_plan(path: pathlib.Path) -> dict:
+    """
+    Reads a plan file written by save_plan.
+
+    Raises:
+        ValueError: If the file cannot be read or was written by an incompatible version.
+    """
+    try:
+        plan = json.loads(path.read_text(encoding='utf-8'))
+    except (OSError, ValueError) as e:
+        raise ValueError(f"não foi possível ler {path}: {e}") from e
+    if not isinstance(plan, dict) or plan.get('version') != PLAN_VERSION or not isinstance(plan.get('courses'), list):
+        raise ValueError(f"{path} não é um plano compatível com esta versão")
+    return plan
+
+def run_plan(session: requests.Session, courses: List[Dict[str, str]], platform_url: str, base_url: str, options: argparse.Namespace) -> int:
+    """Builds, saves and prints the plan of the selected courses. Returns the exit status."""
+    plan = build_plan(session, courses, platform_url, base_url, options)
+    print_plan_summary(plan)
+    try:
+        save_plan(plan, options.plan_file)
+    except OSError as e:
+        print(f"\n❌ Não foi possível salvar o plano em {options.plan_file}: {e}")
+        return EXIT_INCOMPLETE
+    print(f"\n💾 Plano salvo em {options.plan_file}. Execute-o com: python main.py --from-plan {options.plan_file}")
+    return EXIT_INCOMPLETE if plan.get('unplanned_lessons') or len(plan['courses']) < len(courses) else EXIT_OK
+
+def execute_plan(session: requests.Session, plan: dict, base_url: str, options: argparse.Namespace, transfer_semaphore=None, transfer_governor: Optional[TransferGovernor] = None) -> int:
+    """Downloads every course of a plan without scraping the platform again. Returns the exit status."""
+    courses = [planned_course['course'] for planned_course in plan['courses']]
+    print(f"\n📋 Executando o plano de {format_duration(time.time() - plan['created_at'])} atrás: "
+          f"{len(courses)} curso(s), {format_size(plan['totals']['pending_bytes'])} a baixar.")
+    failed_courses = download_all_courses(session, courses, base_url, options, transfer_semaphore, transfer_governor, plan=plan)
+    return EXIT_INCOMPLETE if failed_courses else EXIT_OK
+
+def load_job_file(path: pathlib.Path) -> Tuple[int, List[Dict[str, Any]]]:
+    """
+    Reads and validates a job file for the headless batch mode.
+
+    The file is a JSON object such as:
+
+        {
+            "concurrency": 2,
+            "jobs": [
+                {
+                    "name": "escola-a",
+                    "platform_url": "https://escola-a.astronmembers.com/entrar",
+                    "email_env": "ESCOLA_A_EMAIL",
+                    "password_env": "ESCOLA_A_PASSWORD",
+                    "courses": [1, "curso-de-redacao", "re:^Matemática"],
+                    "command": "sync"
+                }
+            ]
+        }
+
+    The email is given directly ('email') or through an environment variable ('email_env'),
+    and the password only by reference: an environment variable ('password_env') or a file
+    holding it ('password_file'), so the job file itself carries no secrets. Courses are
+    selected by their number in the course list, by the slug of their URL, by a regular
+    expression on their title ('re:' prefix) or all of them ('*', the default). 'command',
+    'output_dir', 'plan_file' (where 'plan' saves the plan) and 'from_plan' (a plan to
+    execute instead of selecting courses) are optional.
+
+    Args:
+        path: The job file.
+
+    Returns:
+        How many jobs run at the same time, and the list of jobs.
+
+    Raises:
+        ValueError: If the file cannot be read or describes an invalid job.
+    """
+    try:
+        data = json.loads(path.read_text(encoding='utf-8'))
+    except (OSError, ValueError) as e:
+        raise ValueError(f"não foi possível ler {path}: {e}") from e
+    if isinstance(data, list):
+        data = {'jobs': data}
+    if not isinstance(data, dict) or not isinstance(data.get('jobs'), list) or not data['jobs']:
+        raise ValueError("o arquivo deve conter uma lista 'jobs' com ao menos um trabalho")
+
+    concurrency = data.get('concurrency', DEFAULT_JOB_CONCURRENCY)
+    if not isinstance(concurrency, int) or concurrency < 1:
+        raise ValueError("'concurrency' deve ser um número inteiro maior que zero")
+
+    jobs = []
+    names = set()
+    for index, job in enumerate(data['jobs'], 1):
+        if not isinstance(job, dict):
+            raise ValueError(f"o trabalho {index} deve ser um objeto")
+        job = dict(job)
+        job.setdefault('name', f"job-{index}")
+        label = f"trabalho '{job['name']}'"
+        if job['name'] in names:
+            raise ValueError(f"nome repetido no {label}")
+        names.add(job['name'])
+        if not str(job.get('platform_url', '')).startswith(('http://', 'https://')):
+            raise ValueError(f"{label}: 'platform_url' deve começar com http:// ou https://")
+        if not job.get('email') and not job.get('email_env'):
+            raise ValueError(f"{label}: informe 'email' ou 'email_env'")
+        if not job.get('password_env') and not job.get('password_file'):
+            raise ValueError(f"{label}: informe 'password_env' ou 'password_file'")
+        if job.setdefault('command', 'download') not in ('download', 'sync', 'plan'):
+            raise ValueError(f"{label}: 'command' deve ser 'download', 'sync' ou 'plan'")
+        selectors = job.setdefault('courses', ['*'])
+        if not isinstance(selectors, list) or not selectors:
+            raise ValueError(f"{label}: 'courses' deve ser uma lista com ao menos um seletor")
+        for selector in selectors:
+            if isinstance(selector, bool) or not isinstance(selector, (int, str)):
+                raise ValueError(f"{label}: seletor de curso inválido: {selector!r}")
+            if isinstance(selector, str) and selector.startswith('re:'):
+                try:
+                    re.compile(selector[3:])
+                except re.error as e:
+                    raise ValueError(f"{label}: expressão regular inválida {selector!r}: {e}") from e
+        jobs.append(job)
+    return concurrency, jobs
+
+def resolve_job_credentials(job: Dict[str, Any]) -> Optional[Dict[str, str]]:
+    """Returns the credentials referenced by a job, or None when the variable or file they point to is missing."""
+    email = job.get('email') or os.environ.get(job.get('email_env', ''))
+    if job.get('password_env'):
+        password = os.environ.get(job['password_env'])
+    else:
+        try:
+            password = pathlib.Path(job['password_file']).expanduser().read_text(encoding='utf-8').strip()
+        except OSError:
+            password = None
+    if not email or not password:
+        return None
+    return {'email': email, 'password': password}
+
+def course_slug(course: Dict[str, str]) -> str:
+    """Returns the last path segment of a course URL, which identifies the course across runs."""
+    return urlparse(course['url']).path.rstrip('/').rsplit('/', 1)[-1]
+
+def select_courses(courses: List[Dict[str, str]], selectors: List[Any]) -> Tuple[List[Dict[str, str]], List[Any]]:
+    """
+    Picks the courses matched by a job's selectors, keeping the order of the course list.
+
+    Args:
+        courses: The courses returned by get_course_list.
+        selectors: Course numbers (starting at 1, as in the interactive list; 0 selects
+            all of them), URL slugs, 're:' regular expressions matched against the title,
+            or '*' for all the courses.
+
+    Returns:
+        The selected courses and the selectors that matched no course.
+    """
+    selected = set()
+    unmatched = []
+    for selector in selectors:
+        if selector == '*' or selector == 0:
+            matches = set(range(len(courses)))
+        elif isinstance(selector, int):
+            matches = {selector - 1} if 1 <= selector <= len(courses) else set()
+        elif selector.startswith('re:'):
+            pattern = re.compile(selector[3:], re.IGNORECASE)
+            matches = {i for i, course in enumerate(courses) if pattern.search(course['title'])}
+        else:
+            matches = {i for i, course in enumerate(courses) if course_slug(course) == selector.strip('/')}
+        if not matches:
+            unmatched.append(selector)
+        selected |= matches
+    return [course for i, course in enumerate(courses) if i in selected], unmatched
+
+def run_job(job: Dict[str, Any], options: argparse.Namespace, transfer_semaphore=None, transfer_governor: Optional[TransferGovernor] = None) -> int:
+    """
+    Runs one job of a job file: logs in, selects the courses and downloads them.
+
+    The saved session is kept per account, so several jobs on the same school don't log
+    each other out. Nothing is ever asked in the terminal.
+
+    Returns:
+        The exit status of the job (EXIT_OK, EXIT_INCOMPLETE, EXIT_INVALID_JOB_FILE,
+        EXIT_LOGIN_FAILED or EXIT_NO_COURSES).
+    """
+    name = job['name']
+    platform_url = job['platform_url']
+    base_url = platform_url.rsplit('/', 1)[0]
+    credentials = resolve_job_credentials(job)
+    if credentials is None:
+        print(f"\n❌ [{name}] Email ou senha não encontrados nas referências do trabalho.")
+        return EXIT_LOGIN_FAILED
+    account = credentials['email']
+
+    session = restore_authenticated_session(platform_url, account)
+    if session:
+        print(f"\n✅ [{name}] Sessão salva ainda válida, login dispensado!")
+    else:
+        session = create_authenticated_session(platform_url, credentials, account)
+        if not session or not is_session_valid(session, platform_url):
+            print(f"\n❌ [{name}] Falha no login em {platform_url}.")
+            return EXIT_LOGIN_FAILED
+    enable_reauthentication(session, platform_url, credentials, account)
+
+    job_options = argparse.Namespace(**vars(options))
+    job_options.command = job['command']
+    job_options.output_dir = pathlib.Path(job['output_dir']) if job.get('output_dir') else options.output_dir / sanitize_path_component(name)
+    job_options.plan_file = pathlib.Path(job['plan_file']) if job.get('plan_file') else job_options.output_dir / PLAN_PATH.name
+    if job.get('from_plan'):
+        try:
+            plan = load_plan(pathlib.Path(job['from_plan']))
+        except ValueError as e:
+            print(f"\n❌ [{name}] Plano inválido: {e}")
+            return EXIT_INVALID_JOB_FILE
+        return execute_plan(session, plan, base_url, job_options, transfer_semaphore, transfer_governor)
+
+    courses = get_course_list(session, base_url)
+    if not courses:
+        print(f"\n❌ [{name}] Nenhum curso encontrado ou falha ao buscar a lista de cursos.")
+        return EXIT_NO_COURSES
+    selected, unmatched = select_courses(courses, job['courses'])
+    for selector in unmatched:
+        print(f"⚠️ [{name}] Nenhum curso corresponde ao seletor {selector!r}.")
+    if not selected:
+        return EXIT_NO_COURSES
+    print(f"\n✅ [{name}] {len(selected)} curso(s) selecionado(s): {', '.join(course['title'] for course in selected)}")
+
+    if job['command'] == 'plan':
+        exit_code = run_plan(session, selected, platform_url, base_url, job_options)
+    else:
+        failed_courses = download_all_courses(session, selected, base_url, job_options, transfer_semaphore, transfer_governor)
+        exit_code = EXIT_INCOMPLETE if failed_courses else EXIT_OK
+    return EXIT_INCOMPLETE if unmatched else exit_code
+
+def run_job_file(path: pathlib.Path, options: argparse.Namespace, transfer_semaphore=None, transfer_governor: Optional[TransferGovernor] = None) -> int:
+    """
+    Runs every job of a job file, several at a time, without any prompt.
+
+    All the jobs share the run's transfer semaphore and transfer governor, so --max-transfers,
+    --rate-limit and --max-host-connections are a budget for the whole batch rather than per job.
+
+    Returns:
+        The worst exit status among the jobs, or EXIT_INVALID_JOB_FILE.
+    """
+    try:
+        concurrency, jobs = load_job_file(path)
+    except ValueError as e:
+        print(f"\n❌ Arquivo de trabalhos inválido: {e}")
+        return EXIT_INVALID_JOB_FILE
+
+    print(f"\n📋 {len(jobs)} trabalho(s) em {path}, {concurrency} ao mesmo tempo.")
+    _load_lazy_module(requests)
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='trabalho') as executor:
+        futures = {executor.submit(run_job, job, options, transfer_semaphore, transfer_governor): job['name'] for job in jobs}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                print(f"\n❌ [{futures[future]}] Erro inesperado: {e}")
+                results[futures[future]] = EXIT_INCOMPLETE
+
+    status_names = {
+        EXIT_OK: 'ok', EXIT_INCOMPLETE: 'incompleto', EXIT_INVALID_JOB_FILE: 'plano inválido',
+        EXIT_LOGIN_FAILED: 'falha no login', EXIT_NO_COURSES: 'nenhum curso',
+    }
+    print("\n--- Resumo dos trabalhos ---")
+    for job in jobs:
+        print(f"{job['name']}: {status_names[results[job['name']]]}")
+    return max(results.values())
+
+def parse_arguments(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """
+    Parses the command line options.
+
+    Args:
+        argv: The arguments to parse, defaults to sys.argv.
+
+    Returns:
+        The parsed options.
+    """
+    parser = argparse.ArgumentParser(description="Downloader de cursos da plataforma Astronmembers.")
+    parser.add_argument('command', nargs='?', choices=('download', 'sync', 'plan', 'list', 'status'), default='download',
+                        help="'download' baixa os cursos selecionados; 'sync' baixa apenas as aulas novas ou "
+                             "alteradas desde a última execução e move as pastas de módulos renomeados ou reordenados; "
+                             "'plan' estima o tamanho e o tempo do download sem baixar nada e salva um plano em --plan-file; "
+                             "'list' mostra os cursos da conta, numerados como em --course; "
+                             "'status' mostra as aulas baixadas e pendentes de cada curso, sem acessar a plataforma.")
+    parser.add_argument('--scrape-workers', type=int, default=DEFAULT_SCRAPE_WORKERS,
+                        help="Quantidade de páginas de aula buscadas ao mesmo tempo.")
+    parser.add_argument('--resolve-workers', type=int, default=DEFAULT_RESOLVE_WORKERS,
+                        help="Quantidade de players (Panda/Hotmart/YouTube/Vimeo) resolvidos ao mesmo tempo.")
+    parser.add_argument('--download-workers', type=int, default=DEFAULT_DOWNLOAD_WORKERS,
+                        help="Quantidade de aulas baixadas ao mesmo tempo.")
+    parser.add_argument('--host-downloads', type=int, default=0,
+                        help="Quantidade máxima de aulas baixadas ao mesmo tempo de um mesmo servidor de vídeo "
+                             "(Panda, Hotmart, YouTube, Vimeo); as demais vagas vão para os outros servidores "
+                             "(padrão: o mesmo que --download-workers).")
+    parser.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE,
+                        help="Quantidade máxima de aulas aguardando entre cada etapa.")
+    parser.add_argument('--course-processes', type=int, default=DEFAULT_COURSE_PROCESSES,
+                        help="Quantidade de cursos baixados ao mesmo tempo, cada um em seu próprio processo, ao baixar todos os cursos.")
+    parser.add_argument('--max-transfers', type=int, default=DEFAULT_MAX_TRANSFERS,
+                        help="Limite global de vídeos e anexos sendo baixados ao mesmo tempo (0 para ilimitado).")
+    parser.add_argument('--page-cache-size', type=float, default=DEFAULT_PAGE_CACHE_SIZE_MB,
+                        help="Tamanho máximo, em MB, do cache em disco das páginas de dashboard, cursos e aulas "
+                             "(somando todos os processos da execução).")
+    parser.add_argument('--page-cache-ttl', type=float, default=None,
+                        help="Usa as páginas em cache com menos de N segundos sem consultar a plataforma (útil para planejar offline).")
+    parser.add_argument('--no-page-cache', action='store_true',
+                        help="Desativa o cache em disco das páginas.")
+    parser.add_argument('--attachment-workers', type=int, default=DEFAULT_ATTACHMENT_WORKERS,
+                        help="Quantidade de anexos baixados ao mesmo tempo.")
+    parser.add_argument('--attachment-host-connections', type=int, default=DEFAULT_ATTACHMENT_HOST_CONNECTIONS,
+                        help="Quantidade máxima de anexos baixados ao mesmo tempo de um mesmo servidor.")
+    parser.add_argument('--hls-workers', type=int, default=DEFAULT_HLS_WORKERS,
+                        help="Segmentos baixados ao mesmo tempo pelo downloader HLS nativo dos vídeos Panda (0 para usar sempre o yt-dlp).")
+    parser.add_argument('--rate-limit', type=parse_rate, default=0,
+                        help="Limite de banda somando todos os vídeos e anexos, como 500K ou 2M por segundo (0 para ilimitado).")
+    parser.add_argument('--max-host-connections', type=int, default=DEFAULT_MAX_HOST_CONNECTIONS,
+                        help="Quantidade máxima de conexões simultâneas a um mesmo servidor de vídeos ou anexos, por processo.")
+    parser.add_argument('--no-adaptive-concurrency', action='store_true',
+                        help="Usa sempre --max-host-connections em vez de ajustar as conexões conforme a velocidade e os erros 429/5xx.")
+    parser.add_argument('--control-file', type=pathlib.Path, default=CONTROL_FILE_PATH,
+                        help="Arquivo JSON lido durante a execução para alterar rate_limit, max_host_connections e adaptive.")
+    parser.add_argument('--report', type=pathlib.Path, default=REPORT_PATH,
+                        help="Arquivo JSON com as métricas da execução (tempos por etapa, bytes, novas tentativas e velocidade por player).")
+    parser.add_argument('--prometheus-textfile', type=pathlib.Path, default=None,
+                        help="Também salva as métricas neste arquivo .prom, para o textfile collector do node exporter.")
+    parser.add_argument('--profile', action='store_true',
+                        help="Mede o uso de CPU e memória de cada etapa (leitura do HTML, playlists, yt-dlp, escrita de arquivos) "
+                             "e salva um relatório em --profile-dir. Todos os cursos são baixados no processo principal.")
+    parser.add_argument('--profile-dir', type=pathlib.Path, default=PROFILE_PATH,
+                        help="Pasta do relatório de --profile.")
+    parser.add_argument('--platform-url', default=None,
+                        help="URL de login da plataforma, sem perguntar no terminal.")
+    parser.add_argument('--email', default=None,
+                        help="Email de login, sem perguntar no terminal (ou ASTRO_DL_EMAIL). A senha vem de ASTRO_DL_PASSWORD.")
+    parser.add_argument('--course', type=int, default=None,
+                        help="Número do curso a baixar, como na lista exibida (0 para todos), sem perguntar no terminal.")
+    parser.add_argument('--max-height', type=int, default=None,
+                        help="Altura máxima dos vídeos, em pixels (por exemplo 720), para Panda, Hotmart, YouTube e Vimeo.")
+    parser.add_argument('--max-bandwidth', type=parse_bitrate, default=None,
+                        help="Taxa máxima dos vídeos, como 1500k ou 2M bits por segundo (o BANDWIDTH das playlists HLS).")
+    parser.add_argument('--prefer-codec', choices=tuple(VIDEO_CODEC_PREFIXES), default=None,
+                        help="Codec de vídeo preferido quando a plataforma oferece mais de um dentro dos limites.")
+    parser.add_argument('--audio-only', action='store_true',
+                        help="Baixa apenas o áudio das aulas quando o player oferece uma faixa de áudio separada.")
+    parser.add_argument('--plan-file', type=pathlib.Path, default=PLAN_PATH,
+                        help="Arquivo onde o comando 'plan' salva o plano.")
+    parser.add_argument('--from-plan', type=pathlib.Path, default=None,
+                        help="Baixa os cursos de um plano salvo pelo comando 'plan', sem buscar novamente as páginas de cursos e aulas.")
+    parser.add_argument('--plan-throughput', type=parse_rate, default=None,
+                        help="Velocidade usada nas estimativas de tempo do plano, como 5M por segundo "
+                             "(padrão: a média da última execução, ou 10M).")
+    parser.add_argument('--panda-hosts', nargs='*', default=[], metavar='HOST',
+                        help="Servidores adicionais da CDN do Panda testados junto com o padrão (b-vz-...), como "
+                             "b-vz-xxxx.tv.pandavideo.com.br. O mais rápido é usado, e os outros assumem se ele falhar.")
+    parser.add_argument('--postprocess', nargs='*', choices=POSTPROCESS_TASKS, default=None, metavar='TAREFA',
+                        help="Processa cada aula assim que ela termina de baixar, enquanto as outras baixam: 'remux' converte "
+                             "o vídeo em MP4 com faststart sem recodificar, 'thumbnail' salva uma miniatura e 'description' "
+                             "transforma a descrição em uma página HTML. Sem tarefas, faz todas. 'remux' e 'thumbnail' precisam do ffmpeg.")
+    parser.add_argument('--postprocess-workers', type=int, default=DEFAULT_POSTPROCESS_WORKERS,
+                        help="Quantidade de processos do pós-processamento (por processo de curso).")
+    parser.add_argument('--dedupe', choices=DEDUPE_METHODS, default='auto',
+                        help="Como anexos e vídeos repetidos em outras aulas ou cursos são colocados na pasta da aula, em vez de "
+                             "baixados de novo: 'auto' tenta hardlink, reflink e cópia, nessa ordem; 'off' sempre baixa.")
+    parser.add_argument('--output-dir', type=pathlib.Path, default=DOWNLOAD_ROOT,
+                        help="Pasta onde os cursos são salvos. O manifesto, o cache e as sessões continuam em download/.")
+    parser.add_argument('--job-file', type=pathlib.Path, default=None,
+                        help="Arquivo JSON com várias escolas, credenciais e cursos para baixar sem nenhuma pergunta no terminal.")
+    parser.add_argument('--html-backend', choices=HTML_BACKENDS, default=DEFAULT_HTML_BACKEND,
+                        help="Mecanismo de leitura do HTML: árvore completa (html.parser/lxml) ou apenas os trechos usados "
+                             "(strainer/lxml-strainer). O padrão é lxml-strainer quando o lxml está instalado, senão strainer.")
+    return parser.parse_args(argv)
+
+def open_platform_session(platform_url: str, options: argparse.Namespace) -> Optional[requests.Session]:
+    """
+    Restores the saved session of a platform or logs in, asking the terminal for missing credentials.
+
+    Returns:
+        The authenticated session, already set up to log in again when it expires, or None if the login failed.
+    """
+    credentials = None
+    download_session = restore_authenticated_session(platform_url)
+    if download_session:
+        print("\n✅ Sessão salva ainda válida, login dispensado! Listando cursos...")
+    else:
+        credentials = credentials_from_environment(options.email)
+        if credentials is None:
+            credentials = request_credentials()
+        
+        if not validate_configuration(platform_url, credentials):
+            print("\n❌ Configuração cancelada pelo usuário.")
+            return None
+        
+        print("\n✅ Configuração concluída! Iniciando processo de download...")
+        
+        download_session = create_authenticated_session(platform_url, credentials)
+        if not download_session:
+            print("\n❌ Falha ao criar sessão de download.")
+            return None
+        
+        print("\n✅ Sessão de download criada com sucesso! Listando cursos...")
+    enable_reauthentication(download_session, platform_url, credentials)
+    return download_session
+
+def run_list(options: argparse.Namespace) -> int:
+    """
+    Prints the courses of the platform, numbered as --course expects them. Returns the exit status.
+
+    Only the dashboard is fetched, so neither the video downloaders nor m3u8 are loaded.
+    """
+    platform_url = options.platform_url or request_platform_url()
+    download_session = open_platform_session(platform_url, options)
+    if download_session is None:
+        return EXIT_LOGIN_FAILED
+    courses = get_course_list(download_session, platform_url.rsplit('/', 1)[0])
+    if not courses:
+        print("\n❌ Nenhum curso encontrado ou falha ao buscar a lista de cursos.")
+        return EXIT_NO_COURSES
+    print("\n--- Cursos Disponíveis ---")
+    for i, course in enumerate(courses, 1):
+        print(f"{i}. {course['title']}")
+    return EXIT_OK
+
+def run_status(options: argparse.Namespace) -> int:
+    """
+    Prints what the manifest knows about every course, without any request. Returns the exit status.
+
+    The time of the last run comes from the metrics report given by '--report'.
+
+    The exit status is EXIT_OK when every recorded lesson was downloaded, EXIT_INCOMPLETE
+    when some is still pending and EXIT_NO_COURSES when nothing was downloaded yet.
+    """
+    if not MANIFEST_PATH.exists():
+        print(f"Nenhum download registrado em {MANIFEST_PATH}.")
+        return EXIT_NO_COURSES
+    manifest = DownloadManifest(MANIFEST_PATH)
+    try:
+        summaries = manifest.course_summaries()
+    finally:
+        manifest.close()
+    if not summaries:
+        print(f"Nenhum download registrado em {MANIFEST_PATH}.")
+        return EXIT_NO_COURSES
+
+    header = f"{'curso':<48} {'aulas':>11} {'tamanho':>10}  atualizado em"
+    print(header)
+    print("-" * len(header))
+    for summary in summaries:
+        updated = time.strftime('%Y-%m-%d %H:%M', time.localtime(summary['updated_at'])) if summary['updated_at'] else '-'
+        lessons = f"{summary['completed']}/{summary['lessons']}"
+        print(f"{summary['title'][:48]:<48} {lessons:>11} {format_size(summary['bytes']):>10}  {updated}")
+    pending = sum(summary['lessons'] - summary['completed'] for summary in summaries)
+    print("-" * len(header))
+    print(f"{len(summaries)} curso(s), {format_size(sum(summary['bytes'] for summary in summaries))} salvos, "
+          f"{pending} aula(s) pendente(s).")
+    if options.report and options.report.exists():
+        try:
+            report = json.loads(options.report.read_text(encoding='utf-8'))
+            print(f"Última execução: {time.strftime('%Y-%m-%d %H:%M', time.localtime(report['finished']))}, "
+                  f"durou {format_duration(report['duration_seconds'])}.")
+        except (OSError, ValueError, KeyError):
+            pass
+    return EXIT_INCOMPLETE if pending else EXIT_OK
+
+def run_interactive(options: argparse.Namespace, transfer_semaphore=None, transfer_governor: Optional[TransferGovernor] = None) -> int:
+    """
+    Runs the download asking the terminal for whatever was not given on the command line.
+
+    Returns:
+        The exit status of the run.
+    """
+    plan = None
+    if options.from_plan:
+        try:
+            plan = load_plan(options.from_plan)
+        except ValueError as e:
+            print(f"\n❌ Plano inválido: {e}")
+            return EXIT_INVALID_JOB_FILE
+
+    platform_url = options.platform_url or (plan and plan['platform_url']) or request_platform_url()
+    base_url = platform_url.rsplit('/', 1)[0]
+
+    download_session = open_platform_session(platform_url, options)
+    if download_session is None:
+        return EXIT_LOGIN_FAILED
+    if plan:
+        return execute_plan(download_session, plan, base_url, options, transfer_semaphore, transfer_governor)
+
+    courses = get_course_list(download_session, base_url)
+    if courses is None or not courses:
+        print("\n❌ Nenhum curso encontrado ou falha ao buscar a lista de cursos.")
+        return EXIT_NO_COURSES
+        
+    print("\n--- Cursos Disponíveis ---")
+    print("0. Baixar Todos os Cursos")
+    for i, course in enumerate(courses, 1):
+        print(f"{i}. {course['title']}")
+    
+    courses_to_process = []
+    if options.course is not None:
+        if not 0 <= options.course <= len(courses):
+            print(f"\n❌ Curso {options.course} inválido. Escolha um número entre 0 e {len(courses)}.")
+            return EXIT_NO_COURSES
+        courses_to_process = courses if options.course == 0 else [courses[options.course - 1]]
+        print(f"\n✅ {len(courses_to_process)} curso(s) selecionado(s) pela linha de comando.")
+    while not courses_to_process:
+        try:
+            course_index_str = input("\nDigite o número do curso que deseja processar (ou 0 para TODOS): ")
+            course_index = int(course_index_str)
             
             if course_index == 0:
                 courses_to_process = courses
@@ -661,103 +5619,77 @@ def main() -> None:
             print("\n❌ Por favor, digite um número válido.")
             continue
     
-    for course_to_download in courses_to_process:
-        print("-" * 60)
-        print(f"🚀 Iniciando processamento para o curso: {course_to_download['title']}")
-        
-        course_structure = get_course_details(download_session, course_to_download['url'])
-
-        if course_structure:
-            course_title_sanitized = re.sub(r'[\\/*?:"<>|]', "", course_to_download['title']).strip()
-            download_path = pathlib.Path("download") / course_title_sanitized
-            print(f'-> Baixando o curso "{course_to_download["title"]}" para a pasta "{download_path}"')
-            download_path.mkdir(parents=True, exist_ok=True)
-
-            for m_idx, module in enumerate(course_structure['modules'], 1):
-                module_title_sanitized = re.sub(r'[\\/*?:"<>|]', "", module['module_title']).strip()
-                module_path = download_path / f"{m_idx:02d}. {module_title_sanitized}"
-                module_path.mkdir(parents=True, exist_ok=True)
-                print(f'--> Módulo {m_idx}: {module["module_title"]}')
-
-                for l_idx, lesson in enumerate(module['lessons'], 1):
-                    lesson_title_sanitized = re.sub(r'[\\/*?:"<>|]', "", lesson['title']).strip()
-                    lesson_path = module_path / f"{l_idx:03d}. {lesson_title_sanitized}"
-                    lesson_path.mkdir(parents=True, exist_ok=True)
-                    print(f'---> Aula {l_idx}: {lesson["title"]} ({lesson["url"]})')
-                    
-                    lesson_content = get_lesson_content(download_session, lesson['url'])
-
-                    if not lesson_content:
-                        print(f'-----> ❌ Nao foi possivel obter o conteudo da aula.')
-                        continue
-
-                    if lesson_content.get('description'):
-                        description_path = lesson_path / "Descrição.html"
-                        with open(description_path, 'w', encoding='utf-8') as f:
-                            f.write(lesson_content['description'])
-                        print(f'-----> ✅ Descrição da aula salva.')
-
-                    player_url = lesson_content.get('player_url')
-
-                    if player_url:
-                        sanitized_video_title = 'Aula'
-                        video_to_download_url = None
-                        download_headers = None
-
-                        existing_video_files = list(lesson_path.glob(f"{sanitized_video_title}.*"))
-                        if existing_video_files:
-                            print(f"-----> ⏭️ Vídeo já existe, pulando: {existing_video_files[0].name}")
-                        else:
-                            if 'pandavideo' in player_url:
-                                try:
-                                    video_to_download_url = convert_panda_video_url(player_url)
-                                    download_headers = {'Referer': player_url}
-                                except ValueError as e:
-                                    print(f"-----> ❌ Erro ao converter URL do Panda: {e}")
-                            
-                            elif 'play.hotmart.com' in player_url:
-                                video_to_download_url = get_hotmart_video_url(player_url, download_session, lesson['url'])
-                                download_headers = {
-                                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:142.0) Gecko/20100101 Firefox/142.0',
-                                    'Accept': '*/*',
-                                    'Accept-Language': 'pt-BR,pt;q=0.8,en-US;q=0.5,en;q=0.3',
-                                    'Origin': 'https://cf-embed.play.hotmart.com',
-                                    'Referer': player_url,
-                                    'Connection': 'keep-alive',
-                                    'Sec-Fetch-Dest': 'empty',
-                                    'Sec-Fetch-Mode': 'cors',
-                                    'Sec-Fetch-Site': 'same-site',
-                                }
-                                
-                            elif 'youtube.com' in player_url or 'vimeo.com' in player_url:
-                                video_to_download_url = player_url
-                                download_headers = {'Referer': base_url}
-                            
-                            if video_to_download_url:
-                                print(f"-----> 🎬 Baixando vídeo...")
-                                download_video(video_to_download_url, lesson_path, sanitized_video_title, download_session, http_headers=download_headers)
-                            else:
-                                print(f"-----> ⚠️ Player não suportado ou falha ao extrair URL de: {player_url}")
-                    else:
-                        print('-----> ℹ️ Nenhum player de vídeo encontrado nesta aula.')
-                        
-                    if lesson_content.get('attachments'):
-                        print('-----> 📎 Verificando anexos...')
-                        for attachment in lesson_content['attachments']:
-                            sanitized_name = re.sub(r'[\\/*?:"<>|]', "", attachment['name']).strip()
-                            file_extension = pathlib.Path(urlparse(attachment['url']).path).suffix or '.pdf'
-                            attachment_filename = f"{sanitized_name}{file_extension}"
-                            attachment_path = lesson_path / attachment_filename
-                            
-                            if attachment_path.exists():
-                                print(f"      -> ⏭️ Anexo já existe, pulando: {attachment_filename}")
-                            else:
-                                download_attachment(download_session, attachment['url'], lesson_path, attachment['name'])
-        else:
-            print(f"\n❌ Não foi possível obter a estrutura do curso: {course_to_download['title']}")
+    if options.command == 'plan':
+        return run_plan(download_session, courses_to_process, platform_url, base_url, options)
+    if len(courses_to_process) > 1:
+        failed_courses = download_all_courses(download_session, courses_to_process, base_url, options, transfer_semaphore, transfer_governor)
+    else:
+        failed_courses = sum(
+            not process_course(download_session, course_to_download, base_url, options)
+            for course_to_download in courses_to_process
+        )
+    return EXIT_INCOMPLETE if failed_courses else EXIT_OK
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Main function of the astronmembers platform downloader application.
+
+    Args:
+        argv: The command line arguments, defaults to sys.argv.
+
+    Returns:
+        The exit status: EXIT_OK when everything was downloaded, EXIT_INCOMPLETE when some
+        lesson or course failed, EXIT_INVALID_JOB_FILE, EXIT_LOGIN_FAILED or EXIT_NO_COURSES.
+    """
+    options = parse_arguments(argv)
+    # The quick commands skip the banner, the transfer services and the run report
+    if options.command == 'status':
+        return run_status(options)
+    configure_runtime(options)
+    if options.command == 'list':
+        return run_list(options)
+    if options.profile:
+        # cProfile and tracemalloc only see the process they run in
+        options.course_processes = 1
+        configure_profiler(StageProfiler(options.profile_dir))
+        _profiler.start()
+
+    transfer_semaphore = None
+    if options.max_transfers > 0:
+        transfer_semaphore = _process_context.BoundedSemaphore(options.max_transfers)
+        configure_media_transfer_limit(transfer_semaphore)
+    transfer_governor = TransferGovernor(
+        rate_limit=options.rate_limit,
+        max_host_connections=options.max_host_connections,
+        adaptive=not options.no_adaptive_concurrency,
+    )
+    configure_transfer_governor(transfer_governor)
+    stop_control_watcher = watch_control_file(options.control_file, transfer_governor)
+
+    print("🚀 === Kurseduka-dl ===")
+    print('Este é um aplicativo mínimo para download de cursos da plataforma Astronmembers (https://www.astronmembers.com.br)')
+    print('Seu autor é o @katomaro (Telegram e Discord), seu guia de uso (altamente recomendado visitar) pode ser encontrado em: https://katomart.com/astrok.html')
+    print('Lembrando, todos os aplicativos mínimos dispostos em katomart.com são melhor elaborados na suíte completa que está em construção.')
+    print("=" * 60)
+
+    if options.job_file:
+        exit_code = run_job_file(options.job_file, options, transfer_semaphore, transfer_governor)
+    else:
+        exit_code = run_interactive(options, transfer_semaphore, transfer_governor)
 
-    print("\n🎉 Processo de download concluído para os cursos selecionados!")
+    close_download_services()
+    stop_control_watcher.set()
+    write_run_report(options.report, options.prometheus_textfile)
+    if _profiler is not None:
+        print(f"🔬 Relatório de desempenho salvo em {_profiler.write_report()}")
+    if exit_code == EXIT_OK:
+        print("\n🎉 Processo de download concluído para os cursos selecionados!")
+    else:
+        print(f"\n⚠️ Processo finalizado com pendências (código de saída {exit_code}).")
+    return exit_code
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Required by the process pool on frozen (PyInstaller) Windows builds
+    multiprocessing.freeze_support()
+    sys.exit(main())